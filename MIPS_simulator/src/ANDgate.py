@@ -3,6 +3,8 @@ from testElement import TestElement
 import unittest
 
 class ANDgate(CPUElement):
+    __slots__ = ('controlName_Branch', 'Alu_zero', 'controlOutput')
+
     def connect(self, inputSources, outputValueNames, control, outputSignalNames):
         CPUElement.connect(self, inputSources, outputValueNames, control, outputSignalNames)
 
@@ -34,6 +36,9 @@ class ANDgate(CPUElement):
         # Updating the value in the map with output control signals
         self.outputControlSignals[self.controlOutput] = output
 
+    def generateOutput(self, inputs, controls):
+        return {self.controlOutput: '(%s & %s)' % (controls[self.controlName_Branch], controls[self.Alu_zero])}
+
 class TestANDgate(unittest.TestCase):
     def setUp(self):
         self.ANDgate = ANDgate()
@@ -4,6 +4,10 @@ from testElement import TestElement
 
 
 class IF_ID_Register(CPUElement):
+    __slots__ = (
+        'slice_names', 'add_address_input', 'sliced_instruction_inputs', 'add_address_output',
+        'sliced_instruction_outputs', 'add_address_value', 'add_instruction_value')
+
     def __init__(self):
         self.slice_names = ['jump_target', 'opcode', 'rs', 'rt', 'rd', 'imm', 'func']
 
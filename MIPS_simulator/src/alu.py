@@ -2,9 +2,12 @@ import unittest
 from cpuElement import CPUElement
 from testElement import TestElement
 import common
+import tracing
 from common import Overflow
 
 class ALU(CPUElement):
+    __slots__ = ('inputReg', 'inputMux', 'outputName', 'controlName', 'outputZero')
+
     def connect(self, inputSources, outputValueNames, control, outputSignalNames):
         '''
         Connect ALU to input sources and controller
@@ -68,7 +71,8 @@ class ALU(CPUElement):
         else:       # if a controlsignal is given, but it is not any of the above, a valueError is raised
             raise ValueError(f"The given control signal is not recognized: {controlSignal}")
         
-        print(f"alu: resultatet er: {hex(result)}")   # Debug print to check the calculated result
+        if tracing.alu:
+            tracing.emit('alu', f"resultatet er: {hex(result)}")   # Debug trace to check the calculated result
         self.outputValues[self.outputName] = result     # Updating the output value to be the result
        
     def setControlSignals(self):
@@ -1,8 +1,11 @@
 import unittest
 from cpuElement import CPUElement
 from testElement import TestElement
+import tracing
 
 class ALUControl(CPUElement):
+    __slots__ = ('funct', 'ALUOp', 'alucontrol')
+
     def connect(self, inputSources, outputValueNames, control, outputSignalName):
         CPUElement.connect(self, inputSources, outputValueNames, control, outputSignalName)
 
@@ -51,7 +54,8 @@ class ALUControl(CPUElement):
             raise ValueError(f"The given AluOp value is not recognized: {aluop}")
 
         self.outputControlSignals[self.alucontrol] = alucontrol
-        print(f"AC: the signal sent to alu: {self.outputControlSignals}")
+        if tracing.control:
+            tracing.emit('control', f"AC: the signal sent to alu: {self.outputControlSignals}")
 
 class TestALU(unittest.TestCase):
     def setUp(self):
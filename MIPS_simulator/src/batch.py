@@ -0,0 +1,373 @@
+'''
+Runs many programs in a pool of processes, and writes one JSON line per program.
+
+Usage: python batch.py [options] files or glob patterns...
+For example, to grade the test memfiles on all cores:
+    python batch.py --total Total.md "../tests/memfiles/*.mem"
+
+Memory files with subtests (lines starting with '>', see tests/README.md) are
+split into one job per subtest. Each subtest's record holds its outcome in
+tests/test_mips.py, 'point', 'miss' or 'stop', for the trap test ('trap', for
+subtests that should trap) and for the value test ('value'). The total score of
+a file is then computed like test_mips.py does: each test scores the points of
+the file's subtests in order, up to the first one that stops it. The totals are
+written like tests/sumresult.py does.
+
+Code written for inf-2200, University of Tromso
+'''
+
+import argparse
+import functools
+import glob
+import json
+import os
+import sys
+import time
+import unittest
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from common import fromUnsignedWordToSignedWord
+from memoryImage import MemoryImage
+from registerFile import RegisterFile
+
+REGISTER_NAMES = RegisterFile().registerNames
+
+# Calls submitted to the pool ahead of the results, per worker
+PENDING_PER_WORKER = 4
+
+
+class Job:
+    '''
+    One program to run.
+
+    program is a filename or a MemoryImage. registers (numbers) and memory
+    (addresses) select the values reported after the run. expected holds the
+    subtest header (destination, expected value, 'trap' or '!trap') and the
+    number of instructions before the break, for programs that are scored.
+    '''
+
+    def __init__(self, name, program, maxCycles=None, maxSeconds=None, registers=(), memory=(), expected=None):
+        self.name = name
+        self.program = program
+        self.maxCycles = maxCycles
+        self.maxSeconds = maxSeconds
+        self.registers = registers
+        self.memory = memory
+        self.expected = expected
+
+
+def makeSimulator(kind, program):
+    # Imported here, so that only the simulator used is imported by each worker
+    if kind == 'datapath':
+        from mipsSimulator import MIPSSimulator
+        return MIPSSimulator(program)
+    from functionalSimulator import FunctionalSimulator
+    assert kind in ('functional', 'translated'), 'Unknown simulator: \'%s\'' % (kind,)
+    return FunctionalSimulator(program, translated=kind == 'translated')
+
+
+def jobsFromFile(filename, maxCycles=None, maxSeconds=None, registers=(), memory=()):
+    '''
+    Return the jobs for one file: one per subtest, or one for the whole file.
+    '''
+    name = os.path.basename(filename)
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if not data.startswith(b'\x7fELF') and b'\n>' not in b'\n' + data:
+        return [Job(name, filename, maxCycles, maxSeconds, registers, memory)]
+
+    jobs = []
+    lines = data.decode().splitlines(keepends=True)
+    for i, header in enumerate(lines):
+        if not header.startswith('>'):
+            continue
+        _, test, destination, value, trap = header.split()
+        code = []
+        for line in lines[i + 1:]:
+            if not line.startswith('0'):
+                break
+            code.append(line)
+        minCycles = sum(1 for line in code if not line.split('\t')[2].startswith('break'))
+
+        # Like tests/test_mips.py, which runs up to ten cycles per instruction
+        limit = len(code) * 10 + 1
+        jobs.append(Job('%s:%s' % (name, test), MemoryImage.parse(''.join(code)),
+                        limit if maxCycles is None else min(limit, maxCycles), maxSeconds,
+                        registers, memory, (destination, value, trap, minCycles)))
+    return jobs
+
+
+def runJob(job, kind='datapath'):
+    '''
+    Run one job, and return its result as a dictionary.
+    '''
+    start = time.perf_counter()
+    simulator = None
+    try:
+        simulator = makeSimulator(kind, job.program)
+        result = simulator.run(max_cycles=job.maxCycles, max_wall_seconds=job.maxSeconds)
+        reason, message = result.reason, result.message
+    except Exception as e:
+        reason, message = 'error', '%s: %s' % (type(e).__name__, e)
+
+    record = {'name': job.name, 'reason': reason, 'cycles': simulator.nCycles if simulator else 0,
+              'elapsed': round(time.perf_counter() - start, 6)}
+    if message is not None:
+        record['message'] = message
+    if simulator is not None:
+        register = simulator.registerFile.register
+        memory = simulator.dataMemory.memory
+        record['registers'] = {REGISTER_NAMES[n]: register[n] for n in job.registers}
+        record['memory'] = {'0x%08x' % (a,): memory.readWord(a) for a in job.memory}
+    if job.expected is not None:
+        record['trap'], record['value'] = score(job, simulator, reason)
+    return record
+
+
+def score(job, simulator, reason):
+    '''
+    Return the outcomes (trap, value) of a subtest in test_trap and test_val of
+    tests/test_mips.py: 'point' scores a point, 'miss' scores none and the test
+    goes on with the next subtest, and 'stop' fails the test, so that the later
+    subtests of the file score nothing. trap is None for a subtest that should
+    not trap.
+    '''
+    destination, value, trap, minCycles = job.expected
+
+    # test_trap expects Overflow, and goes on after any exception but Break
+    if trap != 'trap':
+        trapOutcome = None
+    elif reason == 'overflow':
+        trapOutcome = 'point'
+    elif reason == 'error':
+        trapOutcome = 'miss'
+    else:
+        trapOutcome = 'stop'
+
+    # test_val expects any exception, then checks the cycle count and the value
+    if simulator is None:
+        valueOutcome = 'miss'
+    elif reason == 'cycle limit' or reason == 'timeout' or simulator.nCycles <= minCycles:
+        valueOutcome = 'stop'
+    elif 'Test_sw' in job.name:
+        actual = simulator.dataMemory.memory.get(int(destination, 16))
+        if actual is None or hex(actual) != value:
+            # The error report of test_mips.py fails with a TypeError, which it goes on after
+            valueOutcome = 'miss'
+        else:
+            try:
+                bytes.fromhex(value[2:]).decode('ASCII')
+                valueOutcome = 'point'
+            except ValueError:
+                valueOutcome = 'stop'
+    elif fromUnsignedWordToSignedWord(simulator.registerFile.register[int(destination)]) == int(value):
+        valueOutcome = 'point'
+    else:
+        valueOutcome = 'stop'
+
+    return trapOutcome, valueOutcome
+
+
+def grade(records):
+    '''
+    Return (points, maximum points) of one memory file, from the records of its
+    subtests in file order, like test_trap and test_val of tests/test_mips.py.
+    '''
+    points = maximum = 0
+    for test in ('trap', 'value'):
+        outcomes = [record[test] for record in records if record.get(test) is not None]
+        maximum += len(outcomes)
+        for outcome in outcomes:
+            if outcome == 'stop':
+                break
+            points += outcome == 'point'
+    return points, maximum
+
+
+def runPool(function, items, workers=None):
+    '''
+    Call function(item) for every item in a process pool, yielding the results
+    as they complete. Only a few calls per worker are submitted ahead, so items
+    can be a long iterator.
+
+    @param function: A function that can be pickled, such as a module-level
+    function or a functools.partial of one.
+    @param workers: Number of processes, the number of processors if None,
+    or 0 to make the calls in this process, in order.
+    '''
+    if workers == 0:
+        for item in items:
+            yield function(item)
+        return
+
+    limit = PENDING_PER_WORKER * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for item in items:
+            pending.add(executor.submit(function, item))
+            if len(pending) >= limit:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def addWorkersArgument(parser):
+    '''
+    Add the --workers option of the tools that use runPool().
+    '''
+    parser.add_argument('--workers', type=int, help='number of processes (0 runs in this process)')
+
+
+def runBatch(jobs, kind='datapath', workers=None):
+    '''
+    Run jobs with runPool(), yielding each result as it completes.
+    '''
+    return runPool(functools.partial(runJob, kind=kind), jobs, workers)
+
+
+def writeTotal(points, total, filename):
+    '''
+    Write the total score in the format of tests/sumresult.py.
+    '''
+    with open(filename, 'w') as f:
+        f.write("# Result:\n")
+        f.write(f"{points} out of {total}")
+
+
+def parseRegister(name):
+    return int(name) if name.isdigit() else REGISTER_NAMES.index(name if name.startswith('$') else '$' + name)
+
+
+def main(argv=None, output=None):
+    parser = argparse.ArgumentParser(description='Run many MIPS programs in parallel.')
+    parser.add_argument('files', nargs='+', help='memory files, ELF files or glob patterns')
+    parser.add_argument('--simulator', choices=['datapath', 'functional', 'translated'], default='datapath')
+    parser.add_argument('--max-cycles', type=int, help='cycle limit of each program')
+    parser.add_argument('--max-seconds', type=float, help='wall-clock limit of each program')
+    addWorkersArgument(parser)
+    parser.add_argument('--registers', default='', help='registers to report, such as "t0,9,$sp"')
+    parser.add_argument('--memory', default='', help='memory words to report, such as "0x0,0x10"')
+    parser.add_argument('--total', help='write the total score to this file, like Total.md')
+    args = parser.parse_args(argv)
+    output = output or sys.stdout
+
+    registers = tuple(parseRegister(r.strip()) for r in args.registers.split(',') if r.strip())
+    memory = tuple(int(a, 16) for a in args.memory.split(',') if a.strip())
+
+    files = []
+    for pattern in args.files:
+        files.extend(sorted(glob.glob(pattern)) or [pattern])
+    groups = [jobsFromFile(filename, args.max_cycles, args.max_seconds, registers, memory) for filename in files]
+    jobs = [job for group in groups for job in group]
+
+    records = {}
+    for record in runBatch(jobs, args.simulator, args.workers):
+        output.write(json.dumps(record) + '\n')
+        output.flush()
+        records[record['name']] = record
+
+    points = total = 0
+    for group in groups:
+        filePoints, fileTotal = grade([records[job.name] for job in group if job.expected is not None])
+        points += filePoints
+        total += fileTotal
+
+    if args.total:
+        writeTotal(points, total, args.total)
+    return points, total
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.folder = os.path.dirname(os.path.abspath(__file__))
+        self.memfiles = os.path.join(os.path.dirname(self.folder), 'tests', 'memfiles')
+
+    def test_subtests(self):
+        jobs = jobsFromFile(os.path.join(self.memfiles, 'add.mem'))
+        self.assertEqual([job.name for job in jobs],
+                         ['add.mem:Test_add_20+20', 'add.mem:Test_add_1-1', 'add.mem:Test_addi_0x7fff+1'])
+        self.assertEqual(jobs[2].expected, ('11', '2147483647', 'trap', 6))
+        self.assertEqual(jobs[2].maxCycles, 71)
+
+        records = {record['name']: record for record in runBatch(jobs, 'functional', workers=0)}
+        self.assertEqual((records['add.mem:Test_add_20+20']['trap'], records['add.mem:Test_add_20+20']['value']),
+                         (None, 'point'))
+        self.assertEqual(records['add.mem:Test_addi_0x7fff+1']['reason'], 'overflow')
+        # The trap point, but the value test stops: it ran 6 cycles, as many as its instructions
+        self.assertEqual(records['add.mem:Test_addi_0x7fff+1']['trap'], 'point')
+        self.assertEqual(records['add.mem:Test_addi_0x7fff+1']['value'], 'stop')
+        self.assertEqual(grade([records[job.name] for job in jobs]), (3, 4))
+
+    def test_grade(self):
+        records = [{'trap': None, 'value': 'point'}, {'trap': 'miss', 'value': 'stop'},
+                   {'trap': 'point', 'value': 'point'}, {'trap': 'stop', 'value': 'point'}, {'trap': 'point'}]
+        self.assertEqual(grade(records), (2, 8))
+        self.assertEqual(grade([]), (0, 0))
+
+    def test_same_grade_as_test_mips(self):
+        import subprocess
+        import tempfile
+        from testCommon import runMain
+
+        for kind in ['datapath', 'functional']:
+            with self.subTest(kind=kind), tempfile.TemporaryDirectory() as folder:
+                environment = dict(os.environ, MIPS_SIMULATOR=kind)
+                subprocess.run([sys.executable, '-m', 'pytest', '-q', '-p', 'no:cacheprovider',
+                                os.path.join(os.path.dirname(self.folder), 'tests', 'test_mips.py')],
+                               cwd=folder, env=environment, stdout=subprocess.DEVNULL, check=False)
+                with open(os.path.join(folder, 'result')) as f:
+                    lines = f.read().split()
+                expected = [sum(int(line.split('/')[i]) for line in lines) for i in (0, 1)]
+                result, _ = runMain(main, [os.path.join(self.memfiles, '*.mem'), '--simulator', kind, '--workers', '0'])
+                self.assertEqual(list(result), expected)
+
+    def test_process_pool(self):
+        files = sorted(glob.glob(os.path.join(self.memfiles, '*.mem')))
+        jobs = [job for filename in files for job in jobsFromFile(filename)]
+        self.assertEqual(sum(2 if job.expected[2] == 'trap' else 1 for job in jobs), 36)
+
+        inProcess = sorted(runBatch(jobs, 'translated', workers=0), key=lambda r: r['name'])
+        pooled = sorted(runBatch(jobs, 'translated', workers=2), key=lambda r: r['name'])
+        for record in inProcess + pooled:
+            del record['elapsed']
+        self.assertEqual(pooled, inProcess)
+
+    def test_limits_and_selected_values(self):
+        loop = MemoryImage.fromPairs([(0x1000, 0x25290001), (0x1004, 0x08000400)])  # addiu $t1, 1; j 0x1000
+        records = list(runBatch([Job('cycles', loop, maxCycles=100, registers=(9,), memory=(0x0,)),
+                                 Job('seconds', loop, maxSeconds=0.01)], 'functional', workers=0))
+        self.assertEqual(records[0]['reason'], 'cycle limit')
+        self.assertEqual(records[0]['registers'], {'$t1': 50})
+        self.assertEqual(records[0]['memory'], {'0x00000000': 0})
+        self.assertEqual(records[1]['reason'], 'timeout')
+
+    def test_main(self):
+        from testCommon import runMain
+
+        with self.subTest('program'):
+            _, text = runMain(main, [os.path.join(self.folder, 'add.mem'), '--registers', 't0,$t1', '--workers', '0'])
+            record = json.loads(text)
+            self.assertEqual((record['name'], record['reason']), ('add.mem', 'break'))
+            self.assertEqual(set(record['registers']), {'$t0', '$t1'})
+
+        with self.subTest('memfiles'):
+            import tempfile
+            with tempfile.TemporaryDirectory() as folder:
+                total = os.path.join(folder, 'Total.md')
+                (points, maximum), _ = runMain(main, [os.path.join(self.memfiles, '*.mem'), '--simulator',
+                                                      'functional', '--workers', '2', '--total', total])
+                with open(total) as f:
+                    self.assertEqual(f.read(), '# Result:\n%d out of %d' % (points, maximum))
+                self.assertEqual(maximum, 36)
+
+    def test_pool_bounds_pending_calls(self):
+        import itertools
+
+        # An endless iterator, of which only the calls needed for the first results are submitted
+        results = runPool(abs, itertools.count(-1, -1), workers=2)
+        self.assertEqual(sorted(itertools.islice(results, 20))[:3], [1, 2, 3])
+        results.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+'''
+End-to-end benchmarks of MIPSSimulator, compared against a JSON baseline.
+
+Usage: python benchmark.py [options] [benchmark names...]
+For example, to compare all benchmarks against the baseline in the repository,
+and then to record a new baseline after a deliberate change:
+    python benchmark.py
+    python benchmark.py --save
+The exit status is 1 when a benchmark regresses by more than --threshold percent.
+
+Each benchmark runs one program, the memory files in src or scaled versions of
+them, in a new process, and reports the cycles, the wall time of run() and
+the cycles per second, the construction time (MIPSSimulator.__init__, which
+connects the elements) and the peak resident set size of the process. The
+run time is the median of at least --repeat runs, and of as many as fit in
+half a second for the short programs, so that one run slowed down or sped up
+by the rest of the machine does not move it. A benchmark that regresses is
+measured again before it is reported, since a busy machine can slow down
+every run of one benchmark, and for the same reason --save records the
+median of three runs of the suite. The construction time is the best of
+10, and is only reported: at under a millisecond, it varies by more than any
+useful threshold. Timings depend on the machine, so compare against a
+baseline recorded on the same machine (see --baseline), and use more repeats
+on a busy machine.
+
+Code written for inf-2200, University of Tromso
+'''
+
+import argparse
+import gc
+import json
+import math
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from memoryImage import MemoryImage, loadImage
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows, where the peak RSS is not reported
+
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(os.path.dirname(FOLDER), 'benchmarks', 'baseline.json')
+
+MODES = {'default': {}, 'eventDriven': {'eventDriven': True}, 'generated': {'generated': True}}
+
+# Constructions timed by each benchmark, the best is kept
+CONSTRUCTIONS = 10
+
+# Short programs are run until their runs take this many seconds in total
+MIN_SECONDS = 0.5
+
+# Runs of the suite recorded by --save, the median of each benchmark is kept
+SAVE_ROUNDS = 3
+
+# Metrics compared against the baseline, and whether higher is better (constructionSeconds is too noisy)
+METRICS = {'cyclesPerSecond': True, 'peakRssKiB': False}
+
+
+def memoryFile(name):
+    return lambda: loadImage(os.path.join(FOLDER, name))
+
+
+def scaledAdd(count):
+    '''add.mem, summing 0 to count - 1 instead of 0 to 99.'''
+    image = loadImage(os.path.join(FOLDER, 'add.mem'))
+    words = image.words()
+    words[image.symbols['last_number']] = count
+    return MemoryImage.fromWords(words, image.symbols)
+
+
+def scaledFibonacci(count):
+    '''fibonacci.mem, storing count numbers instead of 64 (wrapping around on the datapath).'''
+    image = loadImage(os.path.join(FOLDER, 'fibonacci.mem'))
+    words = image.words()
+    words[0xbfc00200] = 0x24100000 | count  # addiu s0, zero, count
+    return MemoryImage.fromWords(words, image.symbols)
+
+
+def scaledSelectionSort(count):
+    '''selectionsort.mem, sorting count pseudo-random signed words instead of 13.'''
+    image = loadImage(os.path.join(FOLDER, 'selectionsort.mem'))
+    words = image.words()
+    words[0xbffffffc] = count
+    value = 12345
+    for i in range(count):
+        value = (value * 1103515245 + 12345) & 0xffffffff
+        words[0xc0000000 + 4 * i] = value
+    return MemoryImage.fromWords(words, image.symbols)
+
+
+BENCHMARKS = {
+    'add': memoryFile('add.mem'),
+    'fibonacci': memoryFile('fibonacci.mem'),
+    'selectionsort': memoryFile('selectionsort.mem'),
+    'add-10000': lambda: scaledAdd(10000),
+    'fibonacci-5000': lambda: scaledFibonacci(5000),
+    'selectionsort-80': lambda: scaledSelectionSort(80),
+}
+
+
+def peakRss():
+    '''Peak resident set size of this process in KiB, None if unknown.'''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def measure(name, mode='default', repeat=3):
+    '''
+    Run one benchmark at least repeat times, and until the runs take
+    MIN_SECONDS, in this process, and return its results. Like timeit, the
+    garbage collector is disabled while timing.
+    '''
+    from mipsSimulator import MIPSSimulator
+
+    program = BENCHMARKS[name]()
+    construction = math.inf
+    runs = []
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        # Construction is short, so it is timed more often
+        for _ in range(CONSTRUCTIONS):
+            start = time.perf_counter()
+            MIPSSimulator(program, **MODES[mode])
+            construction = min(construction, time.perf_counter() - start)
+        while len(runs) < repeat or sum(runs) < MIN_SECONDS:
+            simulator = MIPSSimulator(program, **MODES[mode])
+            result = simulator.run()
+            runs.append(result.elapsed)
+    finally:
+        if enabled:
+            gc.enable()
+
+    seconds = statistics.median(runs)
+
+    return {'reason': result.reason, 'cycles': result.cycles, 'seconds': round(seconds, 6),
+            'cyclesPerSecond': round(result.cycles / seconds, 1), 'constructionSeconds': round(construction, 6),
+            'peakRssKiB': peakRss()}
+
+
+def key(name, mode):
+    return name if mode == 'default' else '%s/%s' % (name, mode)
+
+
+def runSuite(names, modes=('default',), repeat=3, isolated=True):
+    '''
+    Run benchmarks one after the other, each in a new process if isolated.
+
+    @return: Dictionary mapping key(name, mode) to the results of measure().
+    '''
+    results = {}
+    for mode in modes:
+        for name in names:
+            if isolated:
+                # A new process for each benchmark, so that the peak RSS is its own
+                context = multiprocessing.get_context('spawn')
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    results[key(name, mode)] = executor.submit(measure, name, mode, repeat).result()
+            else:
+                results[key(name, mode)] = measure(name, mode, repeat)
+    return results
+
+
+def compare(results, baseline, threshold):
+    '''
+    Return the regressions of results against the baseline, as a list of
+    (key, description). A metric regresses when it is more than threshold
+    percent worse, and a benchmark whose cycles changed always regresses.
+    Benchmarks missing from the baseline are not compared.
+    '''
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if (result['reason'], result['cycles']) != (base['reason'], base['cycles']):
+            regressions.append((name, 'stops with %s after %d cycles, was %s after %d cycles' % (
+                result['reason'], result['cycles'], base['reason'], base['cycles'])))
+        for metric, higherIsBetter in METRICS.items():
+            if result.get(metric) is None or not base.get(metric):
+                continue
+            change = 100.0 * (result[metric] - base[metric]) / base[metric]
+            if (-change if higherIsBetter else change) > threshold:
+                regressions.append((name, '%s is %s, was %s (%+.1f%%)' % (metric, result[metric], base[metric], change)))
+    return regressions
+
+
+def loadBaseline(filename):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)['benchmarks']
+
+
+def saveBaseline(results, filename):
+    '''
+    Write results to the baseline file, keeping the benchmarks that were not run.
+    '''
+    benchmarks = loadBaseline(filename)
+    benchmarks.update(results)
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename, 'w') as f:
+        json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                   'benchmarks': benchmarks}, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def formatTable(results, baseline):
+    lines = ['%-32s %10s %10s %12s %10s %10s %10s' % (
+        'benchmark', 'cycles', 'seconds', 'cycles/s', 'change', 'build s', 'peak KiB')]
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        change = '%+.1f%%' % (100.0 * (result['cyclesPerSecond'] / base['cyclesPerSecond'] - 1),) \
+            if base and base.get('cyclesPerSecond') else '-'
+        lines.append('%-32s %10d %10.4f %12.0f %10s %10.4f %10s' % (
+            name, result['cycles'], result['seconds'], result['cyclesPerSecond'], change,
+            result['constructionSeconds'], result['peakRssKiB'] if result['peakRssKiB'] is not None else '-'))
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv=None, output=None):
+    parser = argparse.ArgumentParser(description='Benchmark MIPSSimulator against a baseline.')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (all by default): ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--modes', default='default', help='evaluation modes: ' + ', '.join(MODES))
+    parser.add_argument('--repeat', type=int, default=3, help='least runs of each benchmark, the median is kept')
+    parser.add_argument('--threshold', type=float, default=20.0, help='allowed regression in percent')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline file')
+    parser.add_argument('--save', action='store_true', help='save the results to the baseline file')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--in-process', action='store_true', help='run every benchmark in this process')
+    args = parser.parse_args(argv)
+    output = output or sys.stdout
+
+    names = args.names or list(BENCHMARKS)
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: %s' % (name,))
+    for mode in modes:
+        if mode not in MODES:
+            parser.error('unknown mode: %s' % (mode,))
+
+    results = runSuite(names, modes, args.repeat, isolated=not args.in_process)
+    baseline = loadBaseline(args.baseline)
+    if args.save:
+        rounds = [results] + [runSuite(names, modes, args.repeat, isolated=not args.in_process)
+                              for _ in range(SAVE_ROUNDS - 1)]
+        for name in results:
+            ordered = sorted((suite[name] for suite in rounds), key=lambda result: result['cyclesPerSecond'])
+            results[name] = ordered[len(ordered) // 2]
+    else:
+        # Measure the regressed benchmarks again, and keep the better result
+        regressed = {name for name, _ in compare(results, baseline, args.threshold)}
+        for mode in modes:
+            for name in names:
+                if key(name, mode) in regressed:
+                    result = runSuite([name], [mode], args.repeat, isolated=not args.in_process)[key(name, mode)]
+                    if result['cyclesPerSecond'] > results[key(name, mode)]['cyclesPerSecond']:
+                        results[key(name, mode)] = result
+    output.write(formatTable(results, baseline))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save:
+        saveBaseline(results, args.baseline)
+        output.write('Saved %d benchmarks to %s\n' % (len(results), args.baseline))
+        return []
+
+    regressions = compare(results, baseline, args.threshold)
+    for name, description in regressions:
+        output.write('REGRESSION %s: %s\n' % (name, description))
+    return regressions
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_scaled_programs(self):
+        from functionalSimulator import FunctionalSimulator
+        from common import fromUnsignedWordToSignedWord
+
+        simulator = FunctionalSimulator(scaledAdd(1000))
+        self.assertEqual(simulator.run().reason, 'break')
+        self.assertEqual(simulator.registerFile.register[10], sum(range(1000)))
+
+        image = scaledSelectionSort(30)
+        simulator = FunctionalSimulator(image)
+        self.assertEqual(simulator.run().reason, 'break')
+        memory = simulator.dataMemory.memory
+        values = [fromUnsignedWordToSignedWord(memory[0xc0000000 + 4 * i]) for i in range(30)]
+        original = [fromUnsignedWordToSignedWord(image.words()[0xc0000000 + 4 * i]) for i in range(30)]
+        self.assertEqual(values, sorted(original))
+
+        # The numbers from the second are stored from 0xbfc04000
+        simulator = FunctionalSimulator(scaledFibonacci(10))
+        self.assertEqual(simulator.run().reason, 'break')
+        self.assertEqual([simulator.dataMemory.memory[0xbfc04000 + 4 * i] for i in range(10)],
+                         [1, 1, 2, 3, 5, 8, 13, 21, 34, 55])
+
+    def test_measure(self):
+        results = runSuite(['add'], ['default', 'generated'], repeat=1)
+        for mode in ('add', 'add/generated'):
+            result = results[mode]
+            self.assertEqual((result['reason'], result['cycles']), ('break', 311))
+            self.assertGreater(result['cyclesPerSecond'], 0)
+            self.assertGreater(result['constructionSeconds'], 0)
+            if resource is not None:
+                self.assertGreater(result['peakRssKiB'], 0)
+
+    def test_compare(self):
+        base = {'reason': 'break', 'cycles': 100, 'seconds': 1.0, 'cyclesPerSecond': 100.0,
+                'constructionSeconds': 0.01, 'peakRssKiB': 20000}
+        baseline = {'a': base}
+        self.assertEqual(compare({'a': dict(base, cyclesPerSecond=91.0)}, baseline, 10), [])
+        self.assertEqual(compare({'b': dict(base, cyclesPerSecond=1.0)}, baseline, 10), [])
+        self.assertEqual(compare({'a': dict(base, constructionSeconds=0.02)}, baseline, 10), [])
+
+        for change, metric in [({'cyclesPerSecond': 89.0}, 'cyclesPerSecond'),
+                               ({'peakRssKiB': 23000}, 'peakRssKiB'),
+                               ({'cycles': 101}, 'cycles')]:
+            with self.subTest(metric=metric):
+                regressions = compare({'a': dict(base, **change)}, baseline, 10)
+                self.assertEqual(len(regressions), 1)
+                self.assertIn(metric, regressions[0][1])
+
+    def test_main(self):
+        from testCommon import runMain
+
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'baseline.json')
+            arguments = ['add', '--repeat', '1', '--in-process', '--baseline', filename]
+            self.assertEqual(runMain(main, arguments + ['--save'])[0], [])
+            self.assertEqual(runMain(main, arguments + ['--threshold', '1000'])[0], [])
+
+            # A baseline ten times faster than this machine
+            with open(filename) as f:
+                data = json.load(f)
+            data['benchmarks']['add']['cyclesPerSecond'] *= 10
+            with open(filename, 'w') as f:
+                json.dump(data, f)
+            regressions, text = runMain(main, arguments)
+            self.assertEqual({name for name, _ in regressions}, {'add'})
+            self.assertIn('REGRESSION add: cyclesPerSecond', text)
+
+    def test_baseline_in_repository(self):
+        baseline = loadBaseline(BASELINE)
+        for name in BENCHMARKS:
+            self.assertIn(name, baseline)
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
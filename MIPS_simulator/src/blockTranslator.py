@@ -0,0 +1,347 @@
+'''
+Translates basic blocks of MIPS code into Python functions for the functional simulator.
+
+Code written for inf-2200, University of Tromso
+'''
+
+import os
+import unittest
+from common import Break, Overflow
+
+
+class Block:
+    '''
+    A translated basic block.
+
+    The block function runs every instruction of the block, and returns the
+    index of the exit taken: 0 falls through (or jumps), 1 is a taken branch.
+    '''
+
+    def __init__(self, start, length, exits, source, code, final=False):
+        self.start = start
+        self.length = length
+
+        # The block ends with a break, nothing runs after it
+        self.final = final
+
+        # Address of the next instruction for each exit
+        self.exits = exits
+
+        # Block that follows each exit, linked on first use
+        self.successors = [None] * len(exits)
+
+        self.source = source
+        self.code = code
+
+
+class BlockTranslator:
+    '''
+    Basic-block translation cache for FunctionalSimulator.
+
+    A block starts at the current PC and ends with the first beq, bne, j or
+    break, or after maxLength instructions. Each block is translated once into
+    a Python function that keeps the registers it uses in local variables.
+    Translations are cached by start address, and each block links directly to
+    the blocks that follow it, so most blocks are found without a lookup.
+
+    Translations are dropped when InstructionMemory.writeInstruction() or
+    invalidate() changes the code they were made from.
+    '''
+
+    maxLength = 64
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+
+        # Start address -> Block
+        self.blocks = {}
+
+        # Instruction address -> start addresses of the blocks containing it
+        self.owners = {}
+
+        # Block at simulator.pc when the previous block linked to it
+        self.current = None
+
+        self.translations = 0
+
+        # Cycle count that a block must not pass, set by FunctionalSimulator.run()
+        self.limit = None
+
+        simulator.instructionMemory.invalidationCallbacks.append(self.invalidate)
+
+    def __call__(self):
+        '''
+        Run the block at the simulator's PC.
+
+        Like FunctionalSimulator.tick() the caller has already counted one cycle;
+        the rest of the block's instructions are added here. A block that would
+        run past self.limit is replaced by a single instruction.
+        '''
+        simulator = self.simulator
+        block = self.current
+        if block is None or block.start != simulator.pc:
+            block = self.lookup(simulator.pc)
+
+        if self.limit is not None and simulator.nCycles + block.length - 1 > self.limit:
+            simulator.executeInstruction()
+            self.current = None
+            return
+
+        exit = block.code()
+        simulator.nCycles += block.length - 1
+        simulator.pc = block.exits[exit]
+
+        successor = block.successors[exit]
+        if successor is None and not block.final:
+            successor = block.successors[exit] = self.lookup(simulator.pc)
+        self.current = successor
+
+    def lookup(self, address):
+        '''
+        Return the block starting at address, translating it if needed.
+        '''
+        block = self.blocks.get(address)
+        if block is None:
+            block = self.blocks[address] = self.translate(address)
+            for i in range(block.length):
+                self.owners.setdefault((address + 4 * i) & 0xffffffff, set()).add(address)
+        return block
+
+    def invalidate(self, address):
+        '''
+        Drop the blocks containing address, or every block if address is None.
+        '''
+        if address is None:
+            self.blocks.clear()
+            self.owners.clear()
+        else:
+            for start in self.owners.pop(address, ()):
+                self.blocks.pop(start, None)
+
+        # Links may point to dropped blocks
+        for block in self.blocks.values():
+            block.successors = [None] * len(block.exits)
+        self.current = None
+
+    def translate(self, start):
+        '''
+        Generate and compile the function for the block starting at start.
+        '''
+        fetch = self.simulator.instructionMemory.fetch
+
+        body = []
+        reads = set()
+        written = []
+        exits = None
+        final = False
+
+        def reg(n):
+            if n == 0:
+                return '0'
+            reads.add(n)
+            return 'r%d' % (n,)
+
+        def assign(n, expression):
+            if n != 0:
+                body.append('r%d = %s' % (n, expression))
+                if n not in written:
+                    written.append(n)
+
+        def leave(indent, index, cycles=None, pc=None):
+            # Store modified registers before leaving the block
+            lines = ['register[%d] = r%d' % (n, n) for n in written]
+            if cycles is not None:
+                lines.append('sim.nCycles += %d' % (cycles,))
+                lines.append('sim.pc = 0x%08x' % (pc,))
+            else:
+                lines.append('return %d' % (index,))
+            body.extend(indent + line for line in lines)
+
+        def trap(i, pc, condition, exception, message):
+            body.append('if %s:' % (condition,))
+            leave('    ', None, i, pc)
+            body.append('    raise %s(%r)' % (exception, message))
+
+        def access(i, pc, statement):
+            # Memory raises ValueError for an invalid address, store the state before the instruction first
+            body.append('try:')
+            body.append('    ' + statement)
+            body.append('except ValueError:')
+            leave('    ', None, i, pc)
+            body.append('    raise')
+
+        pc = start
+        for i in range(self.maxLength):
+            instruction, target, opcode, rs, rt, rd, imm, funct = fetch(pc)
+            simm = imm - 0x10000 if imm & 0x8000 else imm
+            nextPc = (pc + 4) & 0xffffffff
+            body.append('# 0x%08x: 0x%08x' % (pc, instruction))
+
+            if opcode == 0x0:
+                a = reg(rs)
+                b = reg(rt)
+                if funct == 0x20 or (funct == 0xd and instruction != 0xd):  # add, like ALUControl for funct 0xd
+                    body.append('t = (%s + %s) & 0xffffffff' % (a, b))
+                    trap(i, pc, '~(%s ^ %s) & (%s ^ t) & 0x80000000' % (a, b, a),
+                         'Overflow', 'Overflow detected: add at 0x%08x' % (pc,))
+                    assign(rd, 't')
+                elif funct == 0x21:  # addu
+                    assign(rd, '(%s + %s) & 0xffffffff' % (a, b))
+                elif funct == 0x22:  # sub
+                    body.append('t = (%s - %s) & 0xffffffff' % (a, b))
+                    trap(i, pc, '(%s ^ %s) & (%s ^ t) & 0x80000000' % (a, b, a),
+                         'Overflow', 'Overflow detected: sub at 0x%08x' % (pc,))
+                    assign(rd, 't')
+                elif funct == 0x23:  # subu
+                    assign(rd, '(%s - %s) & 0xffffffff' % (a, b))
+                elif funct == 0x24:  # and
+                    assign(rd, '%s & %s' % (a, b))
+                elif funct == 0x25:  # or
+                    assign(rd, '%s | %s' % (a, b))
+                elif funct == 0x27:  # nor
+                    assign(rd, '~(%s | %s) & 0xffffffff' % (a, b))
+                elif funct == 0x2a:  # slt, flipping the sign bits orders the words as signed
+                    assign(rd, '1 if (%s ^ 0x80000000) < (%s ^ 0x80000000) else 0' % (a, b))
+                elif funct == 0x0:  # sll, which is nop when all fields are zero
+                    if rd != 0:
+                        assign(rd, '(%s << %d) & 0xffffffff' % (b, (instruction >> 6) & 0x1f))
+                elif instruction == 0xd:  # break, only the whole word stops the datapath
+                    body.append('im.BREAK = True')
+                    exits = [nextPc]
+                    final = True
+                else:
+                    trap(i, pc, 'True', 'ValueError',
+                         'The given funct field value is not recognized: %d at 0x%08x' % (funct, pc))
+                    exits = [nextPc]
+
+            elif opcode == 0x2:  # j
+                exits = [(nextPc & 0xf0000000) | (target << 2)]
+
+            elif opcode == 0x9:  # addiu
+                assign(rt, '(%s + %d) & 0xffffffff' % (reg(rs), simm))
+            elif opcode == 0x8:  # addi
+                a = reg(rs)
+                body.append('t = (%s + %d) & 0xffffffff' % (a, simm))
+                trap(i, pc, '~(%s ^ %d) & (%s ^ t) & 0x80000000' % (a, simm, a),
+                     'Overflow', 'Overflow detected: addi at 0x%08x' % (pc,))
+                assign(rt, 't')
+            elif opcode == 0xf:  # lui
+                assign(rt, '0x%08x' % (imm << 16,))
+            elif opcode == 0x23:  # lw
+                access(i, pc, 't = memory.readWord((%s + %d) & 0xffffffff)' % (reg(rs), simm))
+                assign(rt, 't')
+            elif opcode == 0x2b:  # sw
+                access(i, pc, 'memory.writeWord((%s + %d) & 0xffffffff, %s)' % (reg(rs), simm, reg(rt)))
+            elif opcode == 0x4 or opcode == 0x5:  # beq, bne
+                body.append('if %s %s %s:' % (reg(rs), '==' if opcode == 0x4 else '!=', reg(rt)))
+                leave('    ', 1)
+                exits = [nextPc, (nextPc + (simm << 2)) & 0xffffffff]
+            else:
+                trap(i, pc, 'True', 'ValueError',
+                     'The given opcode is not recognized: %d at 0x%08x' % (opcode, pc))
+                exits = [nextPc]
+
+            pc = nextPc
+            if exits is not None:
+                break
+        else:
+            exits = [pc]
+
+        leave('', 0)
+
+        lines = ['register = rf.registers', 'memory = dm.memory']
+        lines.extend('r%d = register[%d]' % (n, n) for n in sorted(reads))
+        source = 'def makeBlock(sim, rf, dm, im, Overflow):\n    def block():\n%s\n    return block\n' % (
+            '\n'.join('        ' + line for line in lines + body))
+
+        namespace = {}
+        exec(compile(source, '<block 0x%08x>' % (start,), 'exec'), namespace)
+        simulator = self.simulator
+        code = namespace['makeBlock'](simulator, simulator.registerFile, simulator.dataMemory,
+                                      simulator.instructionMemory, Overflow)
+
+        self.translations += 1
+        return Block(start, i + 1, exits, source, code, final)
+
+
+class TestBlockTranslator(unittest.TestCase):
+    def setUp(self):
+        self.folder = os.path.dirname(os.path.abspath(__file__))
+
+    def runProgram(self, simulator, exception=Break):
+        with self.assertRaises(exception):
+            while simulator.nCycles < 10000:
+                simulator.tick()
+        return simulator
+
+    def test_same_result_as_interpreter(self):
+        from functionalSimulator import FunctionalSimulator
+
+        for filename, exception in [('add.mem', Break), ('fibonacci.mem', Overflow), ('selectionsort.mem', Break)]:
+            with self.subTest(filename=filename):
+                interpreted = self.runProgram(FunctionalSimulator(os.path.join(self.folder, filename)), exception)
+                translated = self.runProgram(
+                    FunctionalSimulator(os.path.join(self.folder, filename), translated=True), exception)
+
+                self.assertEqual(translated.nCycles, interpreted.nCycles)
+                self.assertEqual(translated.pc, interpreted.pc)
+                self.assertEqual(translated.registerFile.register, interpreted.registerFile.register)
+                self.assertEqual(translated.dataMemory.memory, interpreted.dataMemory.memory)
+
+    def test_invalid_address_in_block(self):
+        from functionalSimulator import FunctionalSimulator
+
+        for access in [0x8c0a0003,      # lw $t2, 3($zero)
+                       0xac090002]:     # sw $t1, 2($zero)
+            program = {0x1000: 0x25290001,      # addiu $t1, $t1, 1
+                       0x1004: access,
+                       0x1008: 0x0000000d}      # break
+            with self.subTest(access=hex(access)):
+                interpreted = self.runProgram(FunctionalSimulator(program), ValueError)
+                translated = self.runProgram(FunctionalSimulator(program, translated=True), ValueError)
+
+                self.assertEqual((interpreted.nCycles, interpreted.pc), (2, 0x1004))
+                self.assertEqual(translated.nCycles, interpreted.nCycles)
+                self.assertEqual(translated.pc, interpreted.pc)
+                self.assertEqual(translated.registerFile.register, interpreted.registerFile.register)
+                self.assertEqual(translated.registerFile.register[9], 1)
+
+    def test_no_successor_after_break(self):
+        from functionalSimulator import FunctionalSimulator
+
+        simulator = self.runProgram(FunctionalSimulator({0x1000: 0x25290001,      # addiu $t1, $t1, 1
+                                                         0x1004: 0x0000000d}, translated=True))
+        self.assertEqual(list(simulator.translator.blocks), [0x1000])
+        self.assertIsNone(simulator.translator.current)
+
+    def test_blocks_are_cached_and_linked(self):
+        from functionalSimulator import FunctionalSimulator
+
+        simulator = self.runProgram(
+            FunctionalSimulator(os.path.join(self.folder, 'selectionsort.mem'), translated=True))
+        translator = simulator.translator
+
+        self.assertEqual(translator.translations, len(translator.blocks))
+        self.assertLess(translator.translations, 20)
+        self.assertTrue(any(successor is not None
+                            for block in translator.blocks.values() for successor in block.successors))
+
+    def test_write_invalidates(self):
+        from functionalSimulator import FunctionalSimulator
+
+        simulator = FunctionalSimulator(os.path.join(self.folder, 'add.mem'), translated=True)
+        start = simulator.pc
+        simulator.tick()
+        block = simulator.translator.blocks[start]
+        simulator.pc = start
+
+        # Turn the first instruction into addiu $t1, $zero, 7
+        simulator.instructionMemory.writeInstruction(start, 0x24090007)
+        self.assertNotIn(start, simulator.translator.blocks)
+        simulator.tick()
+        self.assertIsNot(simulator.translator.blocks[start], block)
+        self.assertEqual(simulator.registerFile.register[9], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
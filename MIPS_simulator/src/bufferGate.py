@@ -3,6 +3,8 @@ from testElement import TestElement
 import unittest
 
 class BufferGate(CPUElement):
+    __slots__ = ('regWriteIn', 'regWriteOut')
+
     def connect(self, inputSources, outputValueNames, control, outputSignalNames):
         CPUElement.connect(self, inputSources, outputValueNames, control, outputSignalNames)
 
@@ -27,7 +29,16 @@ class BufferGate(CPUElement):
         elif (self.controlSignals[self.regWriteIn] == 0):
             self.outputControlSignals[self.regWriteOut] = 0
         else:
-            raise ValueError(f"The given control signal is not recognized: {self.controlSignal[self.regWriteOut]}")            
+            raise ValueError(f"The given control signal is not recognized: {self.controlSignals[self.regWriteIn]}")
+
+    def generateOutput(self, inputs, controls):
+        # RegWrite from the controller is always 0 or 1
+        return {self.regWriteOut: '(1 if %s == 1 else 0)' % (controls[self.regWriteIn],)}
+
+    def generateChecks(self, inputs, controls):
+        regWrite = controls[self.regWriteIn]
+        return ['if %s != 1 and %s != 0: raise ValueError(f"The given control signal is not recognized: {%s}")' % (
+            regWrite, regWrite, regWrite)]
 
 class TestBuffer(unittest.TestCase):
     def setUp(self):
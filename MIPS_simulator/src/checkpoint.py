@@ -0,0 +1,197 @@
+'''
+Implements checkpoints of the state of a MIPSSimulator, and their file format.
+
+Code written for inf-2200, University of Tromso
+'''
+
+import os
+import struct
+import sys
+import tempfile
+import unittest
+import zlib
+from array import array
+from common import WORD, Break
+from memory import PAGE_WORDS
+
+MAGIC = b'MIPSCKP1'
+HEADER = struct.Struct('>QIII')
+PAGE = struct.Struct('>IB')
+
+# Header flag for a checkpoint taken after a break instruction
+BREAK = 1
+
+
+class Checkpoint:
+    '''
+    State of a MIPSSimulator between two clock cycles.
+
+    Made by MIPSSimulator.checkpoint(), and restored with MIPSSimulator.restore()
+    into a simulator of the same program, in any evaluation mode. Pages that
+    are still shared with the program image are not copied, and are stored as
+    None in instructionPages and dataPages (see SparseMemory.snapshot()).
+
+    The file format (see pack()) is MAGIC followed by the zlib-compressed, big-endian
+        number of cycles, PC, flags, number of wires, registers, wires,
+        instruction memory pages, data memory pages
+    where the wires are signed 64-bit values, and each memory is stored as its
+    number of pages, then for each page its number, 1 if it is stored (0 if
+    shared with the image), and for stored pages the words and the present bytes.
+    '''
+
+    def __init__(self, nCycles, pc, breakFlag, registers, wires, instructionPages, dataPages):
+        self.nCycles = nCycles
+        self.pc = pc
+        self.breakFlag = breakFlag
+
+        # RegisterFile.snapshot()
+        self.registers = registers
+
+        # Tuple with the value of every output and output control signal, see Netlist.wires
+        self.wires = wires
+
+        self.instructionPages = instructionPages
+        self.dataPages = dataPages
+
+    def pack(self):
+        '''
+        Return the checkpoint as bytes.
+        '''
+        registers = array(WORD, self.registers)
+        if sys.byteorder == 'little':
+            registers.byteswap()
+        chunks = [HEADER.pack(self.nCycles, self.pc, BREAK if self.breakFlag else 0, len(self.wires)),
+                  registers.tobytes(),
+                  struct.pack('>%dq' % (len(self.wires),), *self.wires)]
+
+        for pages in (self.instructionPages, self.dataPages):
+            chunks.append(struct.pack('>I', len(pages)))
+            for number, saved in sorted(pages.items()):
+                chunks.append(PAGE.pack(number, saved is not None))
+                if saved is not None:
+                    words = array(WORD, saved[0])
+                    if sys.byteorder == 'little':
+                        words.byteswap()
+                    chunks.append(words.tobytes())
+                    chunks.append(saved[1])
+
+        return MAGIC + zlib.compress(b''.join(chunks))
+
+    @classmethod
+    def unpack(cls, data):
+        '''
+        Read a checkpoint from bytes made by pack().
+        '''
+        assert data[:len(MAGIC)] == MAGIC, 'Not a checkpoint'
+        data = zlib.decompress(data[len(MAGIC):])
+
+        nCycles, pc, flags, count = HEADER.unpack_from(data)
+        offset = HEADER.size
+        registers = array(WORD)
+        registers.frombytes(data[offset:offset + 4 * 32])
+        if sys.byteorder == 'little':
+            registers.byteswap()
+        offset += 4 * 32
+        wires = struct.unpack_from('>%dq' % (count,), data, offset)
+        offset += 8 * count
+
+        memories = []
+        for _ in range(2):
+            pages = {}
+            (n,) = struct.unpack_from('>I', data, offset)
+            offset += 4
+            for _ in range(n):
+                number, stored = PAGE.unpack_from(data, offset)
+                offset += PAGE.size
+                if not stored:
+                    pages[number] = None
+                    continue
+                words = array(WORD)
+                words.frombytes(data[offset:offset + 4 * PAGE_WORDS])
+                if sys.byteorder == 'little':
+                    words.byteswap()
+                offset += 4 * PAGE_WORDS
+                pages[number] = (words.tobytes(), data[offset:offset + PAGE_WORDS])
+                offset += PAGE_WORDS
+            memories.append(pages)
+        assert offset == len(data), 'Truncated checkpoint'
+
+        return cls(nCycles, pc, bool(flags & BREAK), registers.tobytes(), wires, *memories)
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.pack())
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            return cls.unpack(f.read())
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'selectionsort.mem')
+
+    def assertSameState(self, simulator, other):
+        self.assertEqual(simulator.nCycles, other.nCycles)
+        self.assertEqual(simulator.pc.currentAddress(), other.pc.currentAddress())
+        self.assertEqual(simulator.registerFile.register, other.registerFile.register)
+        self.assertEqual(simulator.dataMemory.memory, other.dataMemory.memory)
+        self.assertEqual(simulator.netlist.wires, other.netlist.wires)
+
+    def test_branch_from_checkpoint(self):
+        from mipsSimulator import MIPSSimulator
+
+        reference = MIPSSimulator(self.filename)
+        reference.run()
+
+        simulator = MIPSSimulator(self.filename)
+        simulator.run(max_cycles=300)
+        checkpoint = simulator.checkpoint()
+        netlist = simulator.netlist
+
+        for kwargs in [{}, {'eventDriven': True}, {'generated': True}]:
+            with self.subTest(**kwargs):
+                for branch in (simulator, MIPSSimulator(self.filename, **kwargs)):
+                    branch.restore(checkpoint)
+                    self.assertEqual(branch.nCycles, 300)
+                    self.assertEqual(branch.run().reason, 'break')
+                    self.assertSameState(branch, reference)
+
+        # Restoring reuses the elements and the compiled netlist
+        self.assertIs(simulator.netlist, netlist)
+
+    def test_save_and_load(self):
+        from mipsSimulator import MIPSSimulator
+
+        simulator = MIPSSimulator(self.filename)
+        simulator.run(max_cycles=500)
+        checkpoint = simulator.checkpoint()
+        simulator.run()
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'selectionsort.ckp')
+            checkpoint.save(path)
+            loaded = Checkpoint.load(path)
+
+        self.assertEqual(vars(loaded), vars(checkpoint))
+        restored = MIPSSimulator(self.filename)
+        restored.restore(loaded)
+        restored.run()
+        self.assertSameState(restored, simulator)
+
+    def test_break(self):
+        from mipsSimulator import MIPSSimulator
+
+        simulator = MIPSSimulator(self.filename)
+        simulator.run()
+        checkpoint = Checkpoint.unpack(simulator.checkpoint().pack())
+        self.assertTrue(checkpoint.breakFlag)
+
+        restored = MIPSSimulator(self.filename)
+        restored.restore(checkpoint)
+        self.assertRaises(Break, restored.tick)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,12 @@ Code written for inf-2200, University of Tromso
 Author: Erlend Graff <erlend.h.graff@uit.no>
 '''
 
+import time
+from array import array
+
+# Array type code for unsigned 32-bit words
+WORD = 'I' if array('I').itemsize == 4 else 'L'
+
 # Number conversion function
 # Used by ALU slt operation and debug print to display correct numbers
 def fromUnsignedWordToSignedWord(num):
@@ -27,4 +33,75 @@ class Break(Exception):
 
 class Overflow(Exception):
     def __init__(self, message):
-        self.message = message
\ No newline at end of file
+        self.message = message
+
+
+class RunResult:
+    '''
+    Outcome of a call to run() on a simulator.
+
+    reason is one of 'break', 'overflow', 'error', 'cycle limit' or 'timeout'.
+    'error' is an instruction the simulator does not decode or a memory access
+    to an address that is not word aligned (a ValueError). cycles is the
+    simulator's cycle count when it stopped, and elapsed the wall-clock time of
+    the call in seconds. message holds the Overflow or ValueError message, if any.
+    '''
+
+    def __init__(self, reason, cycles, elapsed, message=None):
+        self.reason = reason
+        self.cycles = cycles
+        self.elapsed = elapsed
+        self.message = message
+
+    def __repr__(self):
+        return 'RunResult(reason=%r, cycles=%d, elapsed=%.6f)' % (self.reason, self.cycles, self.elapsed)
+
+
+# Number of cycles run between checks of the wall-clock limit
+TIME_CHECK_INTERVAL = 1024
+
+
+def runCycles(simulator, cycle, max_cycles=None, max_wall_seconds=None):
+    '''
+    Run cycle() until the program breaks, overflows, fails or a limit is reached.
+
+    Counts and stops like calling simulator.tick() in a loop: each call to
+    cycle() is one more cycle, and a break is detected at the start of the
+    cycle after the break instruction.
+
+    @param simulator: Object with nCycles and instructionMemory.BREAK
+    @param cycle: Function that simulates one cycle, without counting it
+    @param max_cycles: Stop when simulator.nCycles reaches this value
+    @param max_wall_seconds: Stop after about this many seconds
+    '''
+    start = time.perf_counter()
+    deadline = None if max_wall_seconds is None else start + max_wall_seconds
+    instructionMemory = simulator.instructionMemory
+    reason = None
+    message = None
+
+    try:
+        while reason is None:
+            stop = simulator.nCycles + TIME_CHECK_INTERVAL
+            if max_cycles is not None and max_cycles < stop:
+                stop = max_cycles
+
+            while simulator.nCycles < stop:
+                simulator.nCycles += 1
+                if instructionMemory.BREAK:
+                    reason = 'break'
+                    break
+                cycle()
+            else:
+                if max_cycles is not None and simulator.nCycles >= max_cycles:
+                    reason = 'cycle limit'
+                elif deadline is not None and time.perf_counter() >= deadline:
+                    reason = 'timeout'
+    except Overflow as overflow:
+        reason = 'overflow'
+        message = overflow.message
+    except ValueError as error:
+        reason = 'error'
+        message = str(error)
+
+    return RunResult(reason, simulator.nCycles, time.perf_counter() - start, message)
@@ -10,6 +10,8 @@ class Constant(CPUElement):
     '''
     Element that always output a constant value.
     '''
+
+    __slots__ = ('constantValue', 'outputName')
     def __init__(self, constant):
         '''
         Constructor.
@@ -30,3 +32,6 @@ class Constant(CPUElement):
 
     def writeOutput(self):
         self.outputValues[self.outputName] = self.constantValue
+
+    def generateOutput(self, inputs, controls):
+        return {self.outputName: repr(self.constantValue)}
@@ -4,6 +4,12 @@ from testElement import TestElement
 
 
 class Control(CPUElement):
+    __slots__ = (
+        'type_of_instruction', 'outputField_Jump', 'outputField_BEQ', 'outputField_RegDst',
+        'outputField_MemRead', 'outputField_MemtoReg', 'outputField_ALUOp', 'outputField_MemWrite',
+        'outputField_ALUSrc', 'outputField_RegWrite', 'outputField_BNE', 'outputField_Immediate',
+        'connectedElements')
+
     # Setup connections for Control
     outputSignalNames = [
         'outputField_Jump', 'outputField_BEQ', 'outputField_RegDst',
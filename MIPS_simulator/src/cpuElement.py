@@ -9,6 +9,10 @@ class CPUElement:
     Superclass for all elements in the datapath
     '''
 
+    __slots__ = (
+        'inputSources', 'inputValues', 'outputValues', 'controlSources', 'controlSignals',
+        'outputControlSignals')
+
     def connect(self, input, outputValueNames, control, outputSignalNames):
         '''
         Connect element to other elements.
@@ -132,6 +136,55 @@ class CPUElement:
         # Most classes do not set any control signals
         pass
 
+    def clockEdge(self):
+        '''
+        Update internal state at the end of the clock cycle.
+
+        This function is called once for each simulation step, after every element
+        has written its outputs. Only elements that hold state (PC, register file,
+        data memory) implement it.
+        '''
+        # Most classes are purely combinational
+        pass
+
+    def latchedInputs(self):
+        '''
+        Return the names of inputs and control signals that are only sampled on the clock edge.
+
+        These ports are read right before clockEdge(), so connections to them do not
+        make this element depend on their source within a cycle. This is what breaks
+        the feedback loops through the PC and the register file write port.
+        '''
+        return []
+
+    def generateOutput(self, inputs, controls):
+        '''
+        Return Python expressions that compute the outputs of this element.
+
+        Used to inline simple combinational elements into one generated function
+        per cycle (see stepFunction.py). Only elements whose outputs are a pure
+        function of their inputs and control signals can be inlined.
+
+        @param inputs: Maps each input name to an expression for its value.
+        @param controls: Maps each control signal name to an expression for its value.
+        @return: Dictionary mapping each output value and output control signal name
+        to an expression, or None if the element cannot be inlined.
+        '''
+        return None
+
+    def generateChecks(self, inputs, controls):
+        '''
+        Return Python statements that check the ports of an inlined element, as
+        writeOutput() and setControlSignals() do.
+
+        Emitted before the expressions of generateOutput(), with the same
+        arguments. Checks made with assert in the interpreted code should be
+        assert statements here too, so that python -O skips them in both.
+
+        @return: List of statements, one per line.
+        '''
+        return []
+
     def getOutputValue(self, outputName):
         '''
         Return an output value
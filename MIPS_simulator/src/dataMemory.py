@@ -6,11 +6,17 @@ Code written for inf-2200, University of Tromso
 
 from cpuElement import CPUElement
 from memory import Memory
+import os
 import unittest
 from testElement import TestElement
+import tracing
 
 
 class DataMemory(Memory):
+    __slots__ = (
+        'inputField_address', 'inputField_writeData', 'outputField_readData', 'control_readEnable',
+        'control_writeEnable')
+
     def __init__(self, filename):
         Memory.__init__(self, filename)
 
@@ -34,7 +40,6 @@ class DataMemory(Memory):
 
     def writeOutput(self):
         address = self.inputValues[self.inputField_address]
-        write_data = self.inputValues[self.inputField_writeData]
         
         dataMemoryControlRead = self.controlSignals[self.control_readEnable]
         dataMemoryControlWrite = self.controlSignals[self.control_writeEnable]
@@ -49,25 +54,32 @@ class DataMemory(Memory):
 
         # Reading from Memory
         if dataMemoryControlRead == 1:
-            print(f"DM: read {hex(address)}")
-            self.outputValues[self.outputField_readData] = self.memory.get(address, 0)
+            if tracing.memory:
+                tracing.emit('memory', f"read {hex(address)}")
+            # ValueError for an unaligned address, see SparseMemory
+            self.outputValues[self.outputField_readData] = self.memory.readWord(address)
             
-        # Writing to Memory
+        # Writing to Memory, the write itself is done on the clock edge
         elif dataMemoryControlWrite == 1:
-            # Write the given data to the memory at the given address
-            self.memory[address] = write_data
             self.outputValues[self.outputField_readData] = 1
         # ''' raise AssertionError("writeOutput not implemented in class DataMemory!")'''
         else:
             self.outputValues[self.outputField_readData] = 0
 
+    def clockEdge(self):
+        # A read takes precedence over a write, as in writeOutput
+        if self.controlSignals[self.control_writeEnable] == 1 and self.controlSignals[self.control_readEnable] != 1:
+            # Write the given data to the memory at the given address
+            self.memory.writeWord(self.inputValues[self.inputField_address], self.inputValues[self.inputField_writeData])
+            if tracing.memory:
+                tracing.emit('memory', f"write {hex(self.inputValues[self.inputField_writeData])} to {hex(self.inputValues[self.inputField_address])}")
 
 
 
 class TestDataMemory(unittest.TestCase):
     def setUp(self):
         # Create an instance of DataMemory with a sample memory file
-        self.dataMemory = DataMemory("src/add.mem")
+        self.dataMemory = DataMemory(os.path.join(os.path.dirname(os.path.abspath(__file__)), "add.mem"))
 
         # Create test elements to simulate inputs and outputs
         self.testInput = TestElement()
@@ -109,6 +121,7 @@ class TestDataMemory(unittest.TestCase):
         self.dataMemory.readInput()
         self.dataMemory.readControlSignals()
         self.dataMemory.writeOutput()
+        self.dataMemory.clockEdge()
 
         # Both reading and writing are enable
         self.testInput.setOutputControl('dataMemoryControlRead', 1)
@@ -159,6 +172,7 @@ class TestDataMemory(unittest.TestCase):
         self.dataMemory.readInput()
         self.dataMemory.readControlSignals()
         self.dataMemory.writeOutput()
+        self.dataMemory.clockEdge()
 
         # Now read directly from the memory to confirm the write
         output = self.dataMemory.memory.get(test_address, 0)  # Replace 0 with the default read value.
@@ -178,10 +192,11 @@ class TestDataMemory(unittest.TestCase):
         self.dataMemory.readInput()
         self.dataMemory.readControlSignals()
         self.dataMemory.writeOutput()
+        self.dataMemory.clockEdge()
         self.testOutput.readInput()
 
         # Check if the memory state has changed
-        self.assertDictEqual(self.dataMemory.memory, initial_state)
+        self.assertEqual(dict(self.dataMemory.memory), initial_state)
 
         # Check if the output is default read value (e.g. 0)
         output = self.testOutput.inputValues['readData']
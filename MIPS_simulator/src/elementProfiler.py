@@ -0,0 +1,243 @@
+'''
+Implements a profiler of the time spent in each element of the datapath.
+
+Usage: python elementProfiler.py [--event-driven] [--json file] memoryFile
+For example:
+    python elementProfiler.py selectionsort.mem
+
+Code written for inf-2200, University of Tromso
+'''
+
+import argparse
+import json
+import os
+import sys
+import unittest
+from time import perf_counter_ns
+from cpuElement import CPUElement
+from netlist import PROFILE_PHASES
+import tracing
+
+# Phases that only move values between the wires and the ports of an element
+PLUMBING = ('readControlSignals', 'readInput', 'driveWires')
+
+
+class ElementProfiler:
+    '''
+    Records, for every element of a MIPSSimulator, the time and the number of
+    calls of each phase of its evaluation (see netlist.PROFILE_PHASES): reading
+    its control signals and inputs from the wires, writeOutput(),
+    setControlSignals(), driving its outputs onto the wires and clockEdge().
+
+    start() replaces simulateCycle() of the simulator by a version that times
+    every phase, and stop() restores it, so a simulator that is not profiled
+    runs exactly as before. The elements are named by their attribute in the
+    simulator (mux2, alucontrol, registerFile...).
+
+    A simulator with a generated step function is profiled with the netlist's
+    full sweep instead, since the generated function has no element boundaries,
+    and report() says so.
+    '''
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        netlist = simulator.netlist
+        names = {id(value): name for name, value in vars(simulator).items() if isinstance(value, CPUElement)}
+        self.names = [names.get(id(elem), type(elem).__name__) for elem in netlist.schedule]
+        self.types = [type(elem).__name__ for elem in netlist.schedule]
+
+        # Preallocated, indexed by step index * len(PROFILE_PHASES) + phase
+        self.times = [0] * (len(netlist.steps) * len(PROFILE_PHASES))
+        self.calls = [0] * len(self.times)
+        self.cycles = 0
+        self.timerOverhead = measureTimerOverhead()
+
+    def start(self):
+        self.simulator.simulateCycle = self.simulateCycle
+        return self
+
+    def stop(self):
+        if self.simulator.__dict__.get('simulateCycle') == self.simulateCycle:
+            del self.simulator.simulateCycle
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def simulateCycle(self):
+        '''Profiled version of MIPSSimulator.simulateCycle().'''
+        netlist = self.simulator.netlist
+        if self.simulator.eventDriven:
+            netlist.evaluateChangedProfiled(self.times, self.calls)
+        else:
+            netlist.evaluateProfiled(self.times, self.calls)
+        netlist.clockProfiled(self.times, self.calls)
+        self.cycles += 1
+        if tracing.cycle:
+            tracing.emit('cycle', f"cycle number: {self.simulator.nCycles}")
+
+    def seconds(self, step, phase):
+        '''
+        Time of one phase of one step, without the measured cost of reading the timer.
+        '''
+        index = step * len(PROFILE_PHASES) + phase
+        return max(self.times[index] - self.calls[index] * self.timerOverhead, 0) / 1e9
+
+    def profile(self):
+        '''
+        Return the profile as a dictionary, with the elements sorted by decreasing total time.
+        '''
+        elements = []
+        for step, name in enumerate(self.names):
+            base = step * len(PROFILE_PHASES)
+            phases = {phase: {'seconds': self.seconds(step, i), 'calls': self.calls[base + i]}
+                      for i, phase in enumerate(PROFILE_PHASES) if self.calls[base + i]}
+            elements.append({'name': name, 'type': self.types[step],
+                             'calls': max(self.calls[base:base + len(PROFILE_PHASES)]),
+                             'seconds': sum(phase['seconds'] for phase in phases.values()),
+                             'phases': phases})
+        elements.sort(key=lambda element: -element['seconds'])
+
+        phases = {phase: sum(element['phases'].get(phase, {}).get('seconds', 0) for element in elements)
+                  for phase in PROFILE_PHASES}
+        return {'cycles': self.cycles, 'seconds': sum(phases.values()), 'timerOverheadNs': self.timerOverhead,
+                'fullSweep': self.simulator.stepFunction is not None, 'phases': phases, 'elements': elements}
+
+    def report(self):
+        '''
+        Return the profile as text: one line per element, sorted by decreasing
+        total time, then the time of each phase over all elements.
+        '''
+        profile = self.profile()
+        total = profile['seconds'] or 1
+        lines = ['%d cycles, %.3f ms in elements' % (profile['cycles'], profile['seconds'] * 1e3)]
+        if profile['fullSweep']:
+            lines.append('The simulator uses a generated step function, profiled as the full netlist sweep instead')
+        lines += ['',
+                 '%-20s %-16s %9s %10s %7s   %s' % ('element', 'type', 'calls', 'total ms', '%', 'ms per phase')]
+        for element in profile['elements']:
+            phases = ', '.join('%s %.3f' % (phase, values['seconds'] * 1e3)
+                               for phase, values in element['phases'].items())
+            lines.append('%-20s %-16s %9d %10.3f %6.1f%%   %s' % (
+                element['name'], element['type'], element['calls'], element['seconds'] * 1e3,
+                100 * element['seconds'] / total, phases))
+
+        lines.append('')
+        for phase, seconds in profile['phases'].items():
+            lines.append('%-20s %10.3f ms %6.1f%%' % (phase, seconds * 1e3, 100 * seconds / total))
+        plumbing = sum(profile['phases'][phase] for phase in PLUMBING)
+        lines.append('%-20s %10.3f ms %6.1f%%' % ('port plumbing', plumbing * 1e3, 100 * plumbing / total))
+        return '\n'.join(lines) + '\n'
+
+
+def measureTimerOverhead(samples=1000):
+    '''
+    Return the smallest time between two calls of the timer, in nanoseconds.
+    '''
+    best = None
+    for _ in range(samples):
+        t0 = perf_counter_ns()
+        t1 = perf_counter_ns()
+        if best is None or t1 - t0 < best:
+            best = t1 - t0
+    return best
+
+
+def main(argv=None, output=None):
+    parser = argparse.ArgumentParser(description='Profile the elements of the datapath.')
+    parser.add_argument('memoryFile')
+    parser.add_argument('--event-driven', action='store_true', help='profile the event-driven evaluation')
+    parser.add_argument('--max-cycles', type=int, help='cycle limit')
+    parser.add_argument('--json', help='write the profile to this file')
+    args = parser.parse_args(argv)
+    output = output or sys.stdout
+
+    from mipsSimulator import MIPSSimulator
+    simulator = MIPSSimulator(args.memoryFile, eventDriven=args.event_driven)
+    with ElementProfiler(simulator) as profiler:
+        result = simulator.run(max_cycles=args.max_cycles)
+
+    output.write('%s: %s\n' % (args.memoryFile, result.reason))
+    output.write(profiler.report())
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(profiler.profile(), f, indent=2)
+    return profiler
+
+
+class TestElementProfiler(unittest.TestCase):
+    def setUp(self):
+        self.filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'selectionsort.mem')
+
+    def test_profile(self):
+        from mipsSimulator import MIPSSimulator
+
+        reference = MIPSSimulator(self.filename)
+        reference.run()
+
+        for eventDriven in [False, True]:
+            with self.subTest(eventDriven=eventDriven):
+                simulator = MIPSSimulator(self.filename, eventDriven=eventDriven)
+                with ElementProfiler(simulator) as profiler:
+                    result = simulator.run()
+                self.assertEqual(result.cycles, reference.nCycles)
+                self.assertEqual(simulator.registerFile.register, reference.registerFile.register)
+                self.assertEqual(simulator.dataMemory.memory, reference.dataMemory.memory)
+
+                # The cycle that finds the break flag is not simulated
+                profile = profiler.profile()
+                self.assertEqual(profile['cycles'], reference.nCycles - 1)
+                elements = {element['name']: element for element in profile['elements']}
+                self.assertEqual(len(elements), len(simulator.elements))
+                self.assertEqual(elements['pc']['phases']['clockEdge']['calls'], profile['cycles'])
+                self.assertEqual(elements['alu']['type'], 'ALU')
+                if eventDriven:
+                    self.assertEqual(elements['constant4']['calls'], 1)
+                else:
+                    self.assertEqual(elements['mux2']['phases']['writeOutput']['calls'], profile['cycles'])
+                self.assertEqual([e['seconds'] for e in profile['elements']],
+                                 sorted((e['seconds'] for e in profile['elements']), reverse=True))
+
+    def test_generated(self):
+        from mipsSimulator import MIPSSimulator
+
+        simulator = MIPSSimulator(self.filename, generated=True)
+        with ElementProfiler(simulator) as profiler:
+            simulator.run(max_cycles=20)
+        self.assertTrue(profiler.profile()['fullSweep'])
+        self.assertIn('generated step function', profiler.report())
+
+        with ElementProfiler(MIPSSimulator(self.filename)) as profiler:
+            profiler.simulator.run(max_cycles=20)
+        self.assertNotIn('generated step function', profiler.report())
+
+    def test_stop_restores_simulator(self):
+        from mipsSimulator import MIPSSimulator
+
+        simulator = MIPSSimulator(self.filename)
+        profiler = ElementProfiler(simulator).start()
+        simulator.run(max_cycles=10)
+        profiler.stop()
+        self.assertNotIn('simulateCycle', vars(simulator))
+        simulator.run(max_cycles=20)
+        self.assertEqual(profiler.cycles, 10)
+
+    def test_report(self):
+        import tempfile
+        from testCommon import runMain
+
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'profile.json')
+            _, text = runMain(main, [self.filename, '--max-cycles', '50', '--json', filename])
+            with open(filename) as f:
+                profile = json.load(f)
+        self.assertEqual(profile['cycles'], 50)
+        for name in ('registerFile', 'alucontrol', 'mux2', 'port plumbing'):
+            self.assertIn(name, text)
+
+
+if __name__ == '__main__':
+    main()
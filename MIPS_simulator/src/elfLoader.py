@@ -0,0 +1,211 @@
+'''
+Implements loading of statically linked ELF32 big-endian MIPS executables.
+
+Each PT_LOAD segment is copied into the image as one range of words, and the
+part of a segment that is not in the file (such as .bss) is filled with zeros.
+The start address is the entry point, and the symbol table, if any, is kept in
+MemoryImage.symbols. Use loadImage() in memoryImage.py, which recognizes ELF
+files, or parseElf() on the contents of a file.
+
+writeElf() builds such files, and is used to make the ELF versions of the
+memory files (see memToElf.py).
+
+Code written for inf-2200, University of Tromso
+'''
+
+import os
+import struct
+import sys
+import unittest
+from array import array
+from common import WORD
+from memoryImage import MemoryImage, ELF_MAGIC
+
+ELF_HEADER = struct.Struct('>16sHHIIIIIHHHHHH')
+PROGRAM_HEADER = struct.Struct('>IIIIIIII')
+SECTION_HEADER = struct.Struct('>IIIIIIIIII')
+SYMBOL = struct.Struct('>IIIBBH')
+
+ELFCLASS32 = 1
+ELFDATA2MSB = 2
+ET_EXEC = 2
+EM_MIPS = 8
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+
+STT_SECTION = 3
+STT_FILE = 4
+STB_GLOBAL = 1
+SHN_UNDEF = 0
+SHN_ABS = 0xfff1
+
+
+def parseElf(data):
+    '''
+    Return the MemoryImage of an ELF file.
+
+    @param data: Contents of the file.
+    @raise ValueError: If the file is not a statically linked ELF32 big-endian MIPS executable.
+    '''
+    if len(data) < ELF_HEADER.size or data[:4] != ELF_MAGIC:
+        raise ValueError("Not an ELF file")
+    (ident, fileType, machine, _, entry, phoff, shoff, _, _,
+     phentsize, phnum, shentsize, shnum, _) = ELF_HEADER.unpack_from(data)
+    if ident[4] != ELFCLASS32 or ident[5] != ELFDATA2MSB:
+        raise ValueError("Only 32-bit big-endian ELF files are supported")
+    if machine != EM_MIPS:
+        raise ValueError("The ELF file is not a MIPS executable (machine %d)" % (machine,))
+    if fileType != ET_EXEC:
+        raise ValueError("The ELF file is not a statically linked executable (type %d)" % (fileType,))
+
+    ranges = []
+    for i in range(phnum):
+        segmentType, offset, vaddr, _, filesz, memsz, _, _ = readHeader(data, PROGRAM_HEADER, phoff + i * phentsize)
+        if segmentType in (PT_DYNAMIC, PT_INTERP):
+            raise ValueError("The ELF file is not a statically linked executable")
+        if segmentType != PT_LOAD or memsz == 0:
+            continue
+        if vaddr & 3 or filesz > memsz or offset + filesz > len(data) or vaddr + memsz > 0x100000000:
+            raise ValueError("Invalid PT_LOAD segment at 0x%08x" % (vaddr,))
+
+        # Whole words, the last one padded with zeros
+        contents = data[offset:offset + filesz]
+        words = array(WORD)
+        words.frombytes(contents + bytes(-len(contents) % 4))
+        if sys.byteorder == 'little':
+            words.byteswap()
+        words.extend(bytes((memsz + 3) // 4 - len(words)))
+        ranges.append((vaddr, words))
+
+    ranges.sort(key=lambda r: r[0])
+    for (address, words), (nextAddress, _) in zip(ranges, ranges[1:]):
+        if address + 4 * len(words) > nextAddress:
+            raise ValueError("Overlapping PT_LOAD segments at 0x%08x" % (nextAddress,))
+
+    return MemoryImage(entry, tuple(ranges), readSymbols(data, shoff, shentsize, shnum))
+
+
+def readHeader(data, header, offset):
+    if offset + header.size > len(data):
+        raise ValueError("Truncated ELF file")
+    return header.unpack_from(data, offset)
+
+
+def readSymbols(data, shoff, shentsize, shnum):
+    '''
+    Return the named symbols of the symbol table as a dictionary, global symbols
+    replacing local symbols with the same name.
+    '''
+    sections = [readHeader(data, SECTION_HEADER, shoff + i * shentsize) for i in range(shnum)] if shoff else []
+    symbols = {}
+    for _, sectionType, _, _, offset, size, link, _, _, entsize in sections:
+        if sectionType != SHT_SYMTAB or link >= len(sections):
+            continue
+        strtabOffset = sections[link][4]
+        entsize = entsize or SYMBOL.size
+
+        # Entry 0 is reserved
+        entries = []
+        for position in range(offset + entsize, offset + size, entsize):
+            name, value, _, info, _, index = readHeader(data, SYMBOL, position)
+            if name and index != SHN_UNDEF and info & 0xf not in (STT_SECTION, STT_FILE):
+                end = data.index(b'\0', strtabOffset + name)
+                entries.append((info >> 4 == STB_GLOBAL, data[strtabOffset + name:end].decode(), value))
+        for _, name, value in sorted(entries, key=lambda e: e[0]):
+            symbols[name] = value
+    return symbols
+
+
+def writeElf(segments, entry, symbols=None):
+    '''
+    Return the contents of an ELF32 big-endian MIPS executable.
+
+    @param segments: List of (address, contents, size) for each PT_LOAD segment,
+    where contents are bytes and size is the size in memory (at least len(contents)).
+    @param entry: Entry point.
+    @param symbols: Dictionary mapping names to addresses, written as absolute global symbols.
+    '''
+    symbols = symbols or {}
+
+    # ELF header and program headers, filled in last, then the segment contents,
+    # the symbol and string tables and the section headers
+    result = bytearray(ELF_HEADER.size + PROGRAM_HEADER.size * len(segments))
+
+    def append(data):
+        result.extend(bytes(-len(result) % 4))
+        offset = len(result)
+        result.extend(data)
+        return offset
+
+    programHeaders = [PROGRAM_HEADER.pack(PT_LOAD, append(data), address, address, len(data), size, 7, 4)
+                      for address, data, size in segments]
+
+    strtab = bytearray(b'\0')
+    symtab = bytearray(SYMBOL.size)
+    for name, address in symbols.items():
+        symtab += SYMBOL.pack(len(strtab), address, 0, STB_GLOBAL << 4, 0, SHN_ABS)
+        strtab += name.encode() + b'\0'
+    shstrtab = b'\0.symtab\0.strtab\0.shstrtab\0'
+
+    sectionHeaders = [
+        bytes(SECTION_HEADER.size),
+        SECTION_HEADER.pack(1, SHT_SYMTAB, 0, 0, append(symtab), len(symtab), 2, 1, 4, SYMBOL.size),
+        SECTION_HEADER.pack(9, SHT_STRTAB, 0, 0, append(strtab), len(strtab), 0, 0, 1, 0),
+        SECTION_HEADER.pack(17, SHT_STRTAB, 0, 0, append(shstrtab), len(shstrtab), 0, 0, 1, 0),
+    ]
+    shoff = append(b''.join(sectionHeaders))
+
+    ident = ELF_MAGIC + bytes([ELFCLASS32, ELFDATA2MSB, 1]) + bytes(9)
+    result[:ELF_HEADER.size] = ELF_HEADER.pack(
+        ident, ET_EXEC, EM_MIPS, 1, entry, ELF_HEADER.size, shoff, 0, ELF_HEADER.size,
+        PROGRAM_HEADER.size, len(segments), SECTION_HEADER.size, len(sectionHeaders), 3)
+    result[ELF_HEADER.size:ELF_HEADER.size + PROGRAM_HEADER.size * len(segments)] = b''.join(programHeaders)
+    return bytes(result)
+
+
+class TestElfLoader(unittest.TestCase):
+    def setUp(self):
+        self.folder = os.path.dirname(os.path.abspath(__file__))
+
+    def test_segments(self):
+        data = writeElf([(0x400000, bytes.fromhex('3c097fff0000000d'), 8),
+                         (0x10000000, bytes.fromhex('0000002a01'), 12)], 0x400004, {'main': 0x400000})
+        image = parseElf(data)
+
+        self.assertEqual(image.start, 0x400004)
+        self.assertEqual(image.words(), {0x400000: 0x3c097fff, 0x400004: 0xd,
+                                         0x10000000: 0x2a, 0x10000004: 0x01000000, 0x10000008: 0})
+        self.assertEqual(image.symbols, {'main': 0x400000})
+
+    def test_invalid(self):
+        valid = writeElf([(0x400000, bytes(8), 8)], 0x400000)
+        for name, data in [('not elf', b'#0x00001000\t0x00000000\n' * 4),
+                           ('little-endian', valid[:5] + b'\x01' + valid[6:]),
+                           ('not mips', valid[:18] + b'\x00\x03' + valid[20:]),
+                           ('unaligned', writeElf([(0x400002, bytes(8), 8)], 0x400000)),
+                           ('overlapping', writeElf([(0x400000, bytes(8), 8), (0x400004, bytes(4), 4)], 0x400000))]:
+            with self.subTest(name=name):
+                self.assertRaises(ValueError, parseElf, data)
+
+    def test_same_result_as_memory_file(self):
+        from mipsSimulator import MIPSSimulator
+
+        for name in ['add', 'selectionsort']:
+            with self.subTest(name=name):
+                elf = MIPSSimulator(os.path.join(self.folder, name + '.elf'))
+                mem = MIPSSimulator(os.path.join(self.folder, name + '.mem'))
+                self.assertEqual(elf.instructionMemory.image.symbols, mem.instructionMemory.image.symbols)
+                self.assertEqual(elf.pc.currentAddress(), mem.pc.currentAddress())
+
+                self.assertEqual(elf.run().cycles, mem.run().cycles)
+                self.assertEqual(elf.registerFile.register, mem.registerFile.register)
+                self.assertEqual(elf.dataMemory.memory, mem.dataMemory.memory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,21 @@ import unittest
 # Import elements with tests
 from mux import *
 from registerFile import *
+from netlist import *
+from stepFunction import *
+from functionalSimulator import *
+from memoryImage import *
+from elfLoader import *
+from checkpoint import *
+from sampling import *
+from batch import *
+from lockstep import *
+from fuzzer import *
+from benchmark import *
+from elementProfiler import *
+from guestProfiler import *
+from blockTranslator import *
+from tracing import *
 from testCommon import *
 
 if __name__ == '__main__':
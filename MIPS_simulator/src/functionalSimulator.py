@@ -0,0 +1,324 @@
+'''
+Implements an instruction-level simulator for the same MIPS subset as the datapath.
+
+Code written for inf-2200, University of Tromso
+'''
+
+import os
+import unittest
+from instructionMemory import InstructionMemory
+from dataMemory import DataMemory
+from memoryImage import toImage
+from registerFile import RegisterFile
+from blockTranslator import BlockTranslator
+from common import Break, Overflow, fromUnsignedWordToSignedWord, runCycles
+
+
+class FunctionalSimulator():
+    '''Instruction-level MIPS simulator.
+
+    Executes one instruction per tick() without modelling the datapath, and
+    keeps its state in the same RegisterFile and DataMemory objects as
+    MIPSSimulator. Like the single-cycle datapath, a break instruction is
+    fetched and retired in one cycle, and Break is raised on the next tick().
+
+    '''
+
+    def __init__(self, memoryFile, translated=False):
+        '''
+        @param memoryFile: Memory file holding the program and its data, or a program
+        in any other form accepted by memoryImage.toImage().
+        @param translated: Run a whole basic block per tick(), translated to a
+        Python function on first use (see blockTranslator.py). nCycles still
+        counts one cycle per instruction.
+        '''
+        self.nCycles = 0  # Used to hold number of clock cycles spent executing instructions
+
+        # Convert the program once, both memories share the image
+        image = toImage(memoryFile)
+
+        # Memories and register file are used for storage only, they are never connected
+        self.instructionMemory = InstructionMemory(image)
+        self.dataMemory = DataMemory(image)
+        self.registerFile = RegisterFile()
+
+        # Address of the next instruction to execute
+        self.pc = self.startAddress()
+
+        self.translator = BlockTranslator(self) if translated else None
+
+    def startAddress(self):
+        '''
+        Returns first instruction from instruction memory
+        '''
+        return self.instructionMemory.image.start
+
+    def clockCycles(self):
+        '''Returns the number of clock cycles spent executing instructions.'''
+        return self.nCycles
+
+    def printDataMemory(self):
+        self.dataMemory.printAll()
+
+    def printRegisterFile(self):
+        self.registerFile.printAll()
+
+    def tick(self):
+        '''Execute one instruction, or one basic block in translated mode.'''
+
+        self.nCycles += 1
+
+        if self.instructionMemory.BREAK == True:
+            raise Break("Break instruction before 0x%08x" % (self.pc,))
+
+        if self.translator is not None:
+            self.executeBlock()
+        else:
+            self.executeInstruction()
+
+    def run(self, max_cycles=None, max_wall_seconds=None):
+        '''
+        Run instructions until the program stops or a limit is reached.
+
+        @param max_cycles: Stop when nCycles reaches this value.
+        @param max_wall_seconds: Stop after about this many seconds.
+        @return: RunResult with the stop reason, the cycle count and the elapsed time.
+        '''
+        if self.translator is None:
+            return runCycles(self, self.executeInstruction, max_cycles, max_wall_seconds)
+
+        # Blocks that would pass max_cycles run one instruction at a time
+        self.translator.limit = max_cycles
+        try:
+            return runCycles(self, self.executeBlock, max_cycles, max_wall_seconds)
+        finally:
+            self.translator.limit = None
+
+    def executeBlock(self):
+        '''Execute the basic block at pc with the translator, without counting its first cycle.'''
+        self.translator()
+
+    def executeInstruction(self):
+        '''Execute the instruction at pc, without counting the cycle.'''
+
+        pc = self.pc
+        register = self.registerFile.registers
+        instruction, target, opcode, rs, rt, rd, imm, funct = (
+            self.instructionMemory.decoded.get(pc) or self.instructionMemory.fetch(pc))
+        nextPc = (pc + 4) & 0xffffffff
+
+        if opcode == 0x0:  # R-type
+            a = register[rs]
+            b = register[rt]
+
+            if funct == 0x20 or (funct == 0xd and instruction != 0xd):  # add, ALUControl also decodes funct 0xd as add
+                result = (a + b) & 0xffffffff
+                if ~(a ^ b) & (a ^ result) & 0x80000000:
+                    raise Overflow("Overflow detected: add at 0x%08x" % (pc,))
+            elif funct == 0x21:  # addu
+                result = (a + b) & 0xffffffff
+            elif funct == 0x22:  # sub
+                result = (a - b) & 0xffffffff
+                if (a ^ b) & (a ^ result) & 0x80000000:
+                    raise Overflow("Overflow detected: sub at 0x%08x" % (pc,))
+            elif funct == 0x23:  # subu
+                result = (a - b) & 0xffffffff
+            elif funct == 0x24:  # and
+                result = a & b
+            elif funct == 0x25:  # or
+                result = a | b
+            elif funct == 0x27:  # nor
+                result = ~(a | b) & 0xffffffff
+            elif funct == 0x2a:  # slt
+                result = 1 if fromUnsignedWordToSignedWord(a) < fromUnsignedWordToSignedWord(b) else 0
+            elif funct == 0x0:  # sll, which is nop when all fields are zero
+                result = (b << ((instruction >> 6) & 0x1f)) & 0xffffffff
+            elif instruction == 0xd:  # break, only the whole word stops the datapath
+                self.instructionMemory.BREAK = True
+                rd = 0
+                result = 0
+            else:
+                raise ValueError("The given funct field value is not recognized: %d at 0x%08x" % (funct, pc))
+
+            if rd != 0:
+                register[rd] = result
+
+        elif opcode == 0x2:  # j
+            nextPc = (nextPc & 0xf0000000) | (target << 2)
+
+        else:
+            simm = imm - 0x10000 if imm & 0x8000 else imm
+
+            if opcode == 0x9:  # addiu
+                result = (register[rs] + simm) & 0xffffffff
+            elif opcode == 0x8:  # addi
+                a = register[rs]
+                result = (a + simm) & 0xffffffff
+                if ~(a ^ simm) & (a ^ result) & 0x80000000:
+                    raise Overflow("Overflow detected: addi at 0x%08x" % (pc,))
+            elif opcode == 0xf:  # lui
+                result = imm << 16
+            elif opcode == 0x23:  # lw
+                result = self.dataMemory.memory.readWord((register[rs] + simm) & 0xffffffff)
+            elif opcode == 0x2b:  # sw
+                self.dataMemory.memory.writeWord((register[rs] + simm) & 0xffffffff, register[rt])
+                rt = 0
+            elif opcode == 0x4:  # beq
+                if register[rs] == register[rt]:
+                    nextPc = (nextPc + (simm << 2)) & 0xffffffff
+                rt = 0
+            elif opcode == 0x5:  # bne
+                if register[rs] != register[rt]:
+                    nextPc = (nextPc + (simm << 2)) & 0xffffffff
+                rt = 0
+            else:
+                raise ValueError("The given opcode is not recognized: %d at 0x%08x" % (opcode, pc))
+
+            if rt != 0:
+                register[rt] = result
+
+        self.pc = nextPc
+
+
+class TestFunctionalSimulator(unittest.TestCase):
+    def setUp(self):
+        self.folder = os.path.dirname(os.path.abspath(__file__))
+
+    def runProgram(self, simulator):
+        with self.assertRaises(Break):
+            while simulator.nCycles < 10000:
+                simulator.tick()
+        return simulator
+
+    def loadProgram(self, instructions):
+        '''
+        Replace the program in add.mem with the given instructions.
+        '''
+        simulator = FunctionalSimulator(os.path.join(self.folder, 'add.mem'))
+        simulator.instructionMemory.memory.clear()
+        simulator.instructionMemory.invalidate()
+        for i, instruction in enumerate(instructions):
+            simulator.instructionMemory.writeInstruction(0x1000 + 4 * i, instruction)
+        simulator.pc = 0x1000
+        return simulator
+
+    def test_same_result_as_datapath(self):
+        # Imported here, so that running the functional simulator does not load the datapath
+        from mipsSimulator import MIPSSimulator
+
+        for filename in ['add.mem', 'selectionsort.mem']:
+            with self.subTest(filename=filename):
+                datapath = self.runProgram(MIPSSimulator(os.path.join(self.folder, filename)))
+                functional = self.runProgram(FunctionalSimulator(os.path.join(self.folder, filename)))
+
+                self.assertEqual(functional.nCycles, datapath.nCycles)
+                self.assertEqual(functional.registerFile.register, datapath.registerFile.register)
+                self.assertEqual(functional.dataMemory.memory, datapath.dataMemory.memory)
+
+    def test_break_is_the_whole_word(self):
+        from mipsSimulator import MIPSSimulator
+
+        program = {0x1000: 0x24090005,      # addiu $t1, $zero, 5
+                   0x1004: 0x240a0007,      # addiu $t2, $zero, 7
+                   0x1008: 0x012a584d,      # funct 0xd, which ALUControl decodes as add $t3, $t1, $t2
+                   0x100c: 0x0000004d,      # funct 0xd with a shift amount, not a break
+                   0x1010: 0x0000000d}      # break
+        datapath = self.runProgram(MIPSSimulator(program))
+        for translated in [False, True]:
+            with self.subTest(translated=translated):
+                functional = self.runProgram(FunctionalSimulator(program, translated=translated))
+                self.assertEqual(functional.nCycles, datapath.nCycles)
+                self.assertEqual(functional.registerFile.register, datapath.registerFile.register)
+                self.assertEqual(functional.registerFile.register[11], 12)
+
+    def test_fibonacci_overflow(self):
+        # The sample loads 0x40 as the count, and the 47th number does not fit in a signed word
+        simulator = FunctionalSimulator(os.path.join(self.folder, 'fibonacci.mem'))
+        self.assertRaises(Overflow, self.runProgram, simulator)
+        self.assertEqual(simulator.registerFile.register[8], 45)
+        self.assertEqual(simulator.registerFile.register[10], 1836311903)
+
+    def test_run(self):
+        for translated in [False, True]:
+            with self.subTest(translated=translated):
+                simulator = FunctionalSimulator(os.path.join(self.folder, 'fibonacci.mem'), translated=translated)
+                result = simulator.run()
+                self.assertEqual(result.reason, 'overflow')
+                self.assertEqual(result.message, 'Overflow detected: add at 0xbfc00220')
+                self.assertEqual(simulator.registerFile.register[8], 45)
+
+                simulator = FunctionalSimulator(os.path.join(self.folder, 'selectionsort.mem'), translated=translated)
+                result = simulator.run()
+                self.assertEqual((result.reason, result.cycles), ('break', 813))
+
+    def test_run_stops_at_cycle_limit(self):
+        interpreted = FunctionalSimulator(os.path.join(self.folder, 'selectionsort.mem'))
+        translated = FunctionalSimulator(os.path.join(self.folder, 'selectionsort.mem'), translated=True)
+        for limit in [10, 11, 200, 500]:
+            with self.subTest(limit=limit):
+                for simulator in [interpreted, translated]:
+                    result = simulator.run(max_cycles=limit)
+                    self.assertEqual((result.reason, result.cycles), ('cycle limit', limit))
+                self.assertEqual(translated.pc, interpreted.pc)
+                self.assertEqual(translated.registerFile.register, interpreted.registerFile.register)
+        self.assertEqual(translated.run().cycles, 813)
+        self.assertIsNone(translated.translator.limit)
+
+    def test_run_error(self):
+        simulator = FunctionalSimulator({0x1000: 0x25290001,      # addiu $t1, $t1, 1
+                                         0x1004: 0x8c0a0003,      # lw    $t2, 3($zero)
+                                         0x1008: 0x0000000d})     # break
+        result = simulator.run()
+        self.assertEqual((result.reason, result.cycles, result.message), ('error', 2, 'Invalid word address: 0x3'))
+        self.assertEqual(simulator.registerFile.register[9], 1)
+
+    def test_arithmetic(self):
+        simulator = self.runProgram(self.loadProgram([
+            0x3c097fff,     # lui   $t1, 0x7fff
+            0x240affff,     # addiu $t2, $zero, -1
+            0x012a5821,     # addu  $t3, $t1, $t2
+            0x012a6023,     # subu  $t4, $t1, $t2
+            0x012a6827,     # nor   $t5, $t1, $t2
+            0x0149702a,     # slt   $t6, $t2, $t1
+            0x0000000d,     # break
+        ]))
+        register = simulator.registerFile.register
+        self.assertEqual(register[11], 0x7ffeffff)
+        self.assertEqual(register[12], 0x7fff0001)
+        self.assertEqual(register[13], 0)
+        self.assertEqual(register[14], 1)
+        self.assertEqual(simulator.nCycles, 8)
+
+    def test_overflow(self):
+        simulator = self.loadProgram([
+            0x3c097fff,     # lui  $t1, 0x7fff
+            0x2129ffff,     # addi $t1, $t1, -1
+            0x21297fff,     # addi $t1, $t1, 0x7fff
+            0x21297fff,     # addi $t1, $t1, 0x7fff
+            0x21290003,     # addi $t1, $t1, 3
+            0x0000000d,     # break
+        ])
+        self.assertRaises(Overflow, self.runProgram, simulator)
+        self.assertEqual(simulator.registerFile.register[9], 0x7ffffffd)
+
+    def test_memory_and_branches(self):
+        simulator = self.runProgram(self.loadProgram([
+            0x240a0003,     # addiu $t2, $zero, 3
+            0x25290001,     # addiu $t1, $t1, 1         <loop>
+            0xad690100,     # sw    $t1, 0x100($t3)
+            0x256b0004,     # addiu $t3, $t3, 4
+            0x152afffc,     # bne   $t1, $t2, <loop>
+            0x8d6c00fc,     # lw    $t4, 0xfc($t3)
+            0x11800001,     # beq   $t4, $zero, <end>
+            0x08000409,     # j     0x1024
+            0x0000000d,     # break                     <end>
+            0x0000000d,     # break
+        ]))
+        self.assertEqual(simulator.dataMemory.memory[0x100], 1)
+        self.assertEqual(simulator.dataMemory.memory[0x108], 3)
+        self.assertEqual(simulator.registerFile.register[12], 3)
+        self.assertEqual(simulator.pc, 0x1028)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,329 @@
+'''
+Differential fuzzer: runs random programs on the datapath (MIPSSimulator) and
+on the functional simulator, which is used as the reference, and shrinks each
+program on which they end in a different state to a minimal reproduction.
+
+Usage: python fuzzer.py [options]
+For example, to run 1000 programs on all cores and save the reproductions:
+    python fuzzer.py --programs 1000 --output fuzz
+Each reproduction is a memory file, which can be run with simulator.py.
+
+Programs use the instructions that Control decodes, with the funct fields that
+ALUControl accepts. Each starts by setting $t0-$t7 to edge values (0, -1,
+0x7fffffff, 0x80000000, ...) with lui and addiu, and immediates are biased to
+edge values too, so that overflow in add, addi and sub is common. Branches and
+jumps only go forward, loads and stores use aligned addresses in a small data
+area, and every program ends with a break.
+
+Code written for inf-2200, University of Tromso
+'''
+
+import argparse
+import functools
+import os
+import random
+import sys
+import unittest
+from batch import addWorkersArgument, makeSimulator, runPool, REGISTER_NAMES
+
+BASE_ADDRESS = 0xbfc00000
+BREAK_INSTRUCTION = 0x0000000d
+
+# Registers set by the prologue and used by the generated instructions
+REGISTERS = tuple(range(8, 16))
+DATA_WORDS = 16
+
+EDGE_VALUES = (0, 1, 0xffffffff, 0x7fffffff, 0x80000000, 0x7fff, 0x8000, 0xffff, 0x10000000)
+EDGE_IMMEDIATES = (0, 1, 0x7fff, 0x8000, 0xffff)
+
+R_TYPE = {'add': 0x20, 'sub': 0x22, 'and': 0x24, 'or': 0x25, 'nor': 0x27, 'slt': 0x2a}
+I_TYPE = {'addi': 0x8, 'addiu': 0x9, 'lui': 0xf, 'lw': 0x23, 'sw': 0x2b, 'beq': 0x4, 'bne': 0x5}
+OPS = tuple(R_TYPE) + tuple(I_TYPE) + ('j',)
+
+
+def setRegister(register, value):
+    '''
+    Return the lui and addiu instructions that set a register to a value.
+    '''
+    return [('lui', register, 0, ((value + 0x8000) >> 16) & 0xffff), ('addiu', register, register, value & 0xffff)]
+
+
+def generate(rng, length, ops=OPS):
+    '''
+    Return a random program: a prologue setting $t0-$t7, then length random instructions.
+
+    Instructions are tuples (name, a, b, c), with the operands in assembly order:
+    registers for R-type instructions, (rt, rs, immediate) for addi and addiu,
+    (rt, 0, immediate) for lui, (rt, 0, offset from $zero) for lw and sw,
+    (rs, rt, instructions skipped) for beq and bne, and (0, 0, instructions skipped) for j.
+    '''
+    program = []
+    for register in REGISTERS:
+        value = rng.choice(EDGE_VALUES) if rng.random() < 0.7 else rng.getrandbits(32)
+        program.extend(setRegister(register, value))
+
+    def source():
+        return rng.choice(REGISTERS) if rng.random() < 0.9 else 0
+
+    def immediate():
+        return rng.choice(EDGE_IMMEDIATES) if rng.random() < 0.5 else rng.getrandbits(16)
+
+    for _ in range(length):
+        name = rng.choice(ops)
+        if name in R_TYPE:
+            program.append((name, source(), source(), source()))
+        elif name in ('addi', 'addiu'):
+            program.append((name, source(), source(), immediate()))
+        elif name == 'lui':
+            program.append((name, source(), 0, immediate()))
+        elif name in ('lw', 'sw'):
+            program.append((name, source(), 0, 4 * rng.randrange(DATA_WORDS)))
+        elif name in ('beq', 'bne'):
+            program.append((name, source(), source(), rng.randrange(4)))
+        else:
+            program.append(('j', 0, 0, rng.randrange(4)))
+    return program
+
+
+def assemble(program):
+    '''
+    Return the (address, word) pairs of a program followed by a break. Forward
+    branches and jumps past the end go to the break.
+    '''
+    words = []
+    for i, (name, a, b, c) in enumerate(program):
+        skip = min(c, len(program) - i - 1)
+        if name in R_TYPE:
+            words.append((b << 21) | (c << 16) | (a << 11) | R_TYPE[name])
+        elif name in ('beq', 'bne'):
+            words.append((I_TYPE[name] << 26) | (a << 21) | (b << 16) | skip)
+        elif name == 'j':
+            words.append((0x2 << 26) | (((BASE_ADDRESS + 4 * (i + 1 + skip)) >> 2) & 0x3ffffff))
+        else:
+            words.append((I_TYPE[name] << 26) | (b << 21) | (a << 16) | (c & 0xffff))
+    words.append(BREAK_INSTRUCTION)
+    return [(BASE_ADDRESS + 4 * i, word) for i, word in enumerate(words)]
+
+
+def disassemble(instruction):
+    name, a, b, c = instruction
+    r = REGISTER_NAMES
+    if name in R_TYPE:
+        return '%s\t%s, %s, %s' % (name, r[a], r[b], r[c])
+    if name in ('addi', 'addiu'):
+        return '%s\t%s, %s, 0x%x' % (name, r[a], r[b], c)
+    if name == 'lui':
+        return 'lui\t%s, 0x%x' % (r[a], c)
+    if name in ('lw', 'sw'):
+        return '%s\t%s, 0x%x($zero)' % (name, r[a], c)
+    if name in ('beq', 'bne'):
+        return '%s\t%s, %s, +%d' % (name, r[a], r[b], c)
+    return 'j\t+%d' % (c,)
+
+
+def toMemoryFile(program, comment=''):
+    '''
+    Return a program as the text of a memory file.
+    '''
+    lines = ['#', '# ' + comment if comment else '# Generated by fuzzer.py', '#']
+    for (address, word), instruction in zip(assemble(program), program + [None]):
+        lines.append('0x%08x\t0x%08x\t%s' % (address, word, disassemble(instruction) if instruction else 'break'))
+    return '\n'.join(lines) + '\n'
+
+
+def execute(kind, program):
+    '''
+    Run a program, and return the stop reason, the registers and the data memory.
+    '''
+    simulator = makeSimulator(kind, assemble(program))
+    try:
+        reason = simulator.run(max_cycles=len(program) + 2).reason
+    except Exception as e:
+        reason = 'error (%s)' % (type(e).__name__,)
+    return reason, list(simulator.registerFile.registers), dict(simulator.dataMemory.memory.items())
+
+
+def compare(program):
+    '''
+    Run a program on both simulators.
+
+    @return: None if they agree, otherwise (category, description) of the first
+    difference, where category is 'reason', a register name or 'memory'.
+    '''
+    datapath = execute('datapath', program)
+    reference = execute('functional', program)
+    if datapath[0] != reference[0]:
+        return 'reason', 'datapath stops with %s, reference with %s' % (datapath[0], reference[0])
+    for number, (actual, expected) in enumerate(zip(datapath[1], reference[1])):
+        if actual != expected:
+            return REGISTER_NAMES[number], '%s is 0x%08x on the datapath, 0x%08x on the reference' % (
+                REGISTER_NAMES[number], actual, expected)
+    for address in sorted(set(datapath[2]) | set(reference[2])):
+        actual, expected = datapath[2].get(address), reference[2].get(address)
+        if actual != expected:
+            return 'memory', 'word 0x%08x is %s on the datapath, %s on the reference' % (
+                address, actual if actual is None else '0x%08x' % actual,
+                expected if expected is None else '0x%08x' % expected)
+    return None
+
+
+def shrink(program, category):
+    '''
+    Remove instructions, then simplify the immediates and skips of the rest,
+    as long as the simulators still differ in the same category.
+    '''
+    def fails(candidate):
+        difference = compare(candidate)
+        return difference is not None and difference[0] == category
+
+    # Until neither removing nor simplifying makes progress
+    progress = True
+    while progress:
+        progress = False
+        chunk = max(len(program) // 2, 1)
+        while chunk:
+            i = 0
+            while i < len(program):
+                candidate = program[:i] + program[i + chunk:]
+                if candidate and fails(candidate):
+                    program = candidate
+                    progress = True
+                else:
+                    i += chunk
+            chunk //= 2
+
+        for i, (name, a, b, c) in enumerate(program):
+            for simpler in (0, 1):
+                if simpler < c and name not in ('lw', 'sw'):
+                    candidate = program[:i] + [(name, a, b, simpler)] + program[i + 1:]
+                    if fails(candidate):
+                        program = candidate
+                        progress = True
+                        break
+    return program
+
+
+def fuzzOne(seed, length=20, ops=OPS):
+    '''
+    Generate and check the program of one seed.
+
+    @return: None if the simulators agree, otherwise a dictionary with the seed,
+    the shrunk program, the length of the original program and the difference
+    found on the shrunk program.
+    '''
+    program = generate(random.Random(seed), length, ops)
+    difference = compare(program)
+    if difference is None:
+        return None
+    shrunk = shrink(program, difference[0])
+    return {'seed': seed, 'program': shrunk, 'length': len(program), 'difference': compare(shrunk)[1]}
+
+
+def fuzz(programs, seed=0, length=20, ops=OPS, workers=None):
+    '''
+    Check programs with seeds seed, seed + 1, ... with batch.runPool(), yielding
+    the result of fuzzOne() for each program on which the simulators differ.
+    '''
+    check = functools.partial(fuzzOne, length=length, ops=ops)
+    for result in runPool(check, range(seed, seed + programs), workers):
+        if result is not None:
+            yield result
+
+
+def main(argv=None, output=None):
+    parser = argparse.ArgumentParser(description='Check the datapath against the functional simulator.')
+    parser.add_argument('--programs', type=int, default=100, help='number of programs to check')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first program')
+    parser.add_argument('--length', type=int, default=20, help='random instructions in each program')
+    parser.add_argument('--ops', default=','.join(OPS), help='instructions to use, such as "add,lw,beq"')
+    addWorkersArgument(parser)
+    parser.add_argument('--output', help='folder to write a memory file for each distinct reproduction')
+    args = parser.parse_args(argv)
+    output = output or sys.stdout
+
+    ops = tuple(op.strip() for op in args.ops.split(',') if op.strip())
+    for op in ops:
+        if op not in OPS:
+            parser.error('unknown instruction: %s (use %s)' % (op, ', '.join(OPS)))
+
+    # Many seeds shrink to the same program, which is reported once
+    distinct = {}
+    for failure in fuzz(args.programs, args.seed, args.length, ops, args.workers):
+        key = tuple(failure['program'])
+        if key in distinct:
+            distinct[key]['seeds'].append(failure['seed'])
+            continue
+        distinct[key] = failure
+        failure['seeds'] = [failure['seed']]
+        output.write('seed %d: %s\n' % (failure['seed'], failure['difference']))
+        for instruction in failure['program']:
+            output.write('\t%s\n' % (disassemble(instruction),))
+        output.flush()
+
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+            with open(os.path.join(args.output, 'fuzz-%d.mem' % (failure['seed'],)), 'w') as f:
+                f.write(toMemoryFile(failure['program'], failure['difference']))
+
+    failing = sum(len(failure['seeds']) for failure in distinct.values())
+    output.write('%d of %d programs differ, %d distinct reproductions\n' % (failing, args.programs, len(distinct)))
+    return list(distinct.values())
+
+
+class TestFuzzer(unittest.TestCase):
+    def test_programs_are_valid(self):
+        from functionalSimulator import FunctionalSimulator
+
+        for seed in range(40):
+            program = generate(random.Random(seed), 30)
+            simulator = FunctionalSimulator(assemble(program))
+            result = simulator.run(max_cycles=len(program) + 2)
+            self.assertIn(result.reason, ('break', 'overflow'))
+
+    def test_set_register(self):
+        for value in EDGE_VALUES + (0x12345678, 0xffff8000):
+            with self.subTest(value=hex(value)):
+                reason, registers, _ = execute('functional', setRegister(8, value))
+                self.assertEqual((reason, registers[8]), ('break', value))
+
+    def test_agreeing_instructions(self):
+        # The datapath implements these like the reference
+        ops = ('and', 'or', 'slt', 'addiu', 'lui', 'lw', 'sw', 'j')
+        self.assertEqual(list(fuzz(20, length=15, ops=ops, workers=0)), [])
+
+    def test_shrink(self):
+        # NOR of the datapath gives 1 or 0 instead of the bitwise result
+        failures = list(fuzz(4, length=15, ops=('nor',), workers=0))
+        self.assertEqual(len(failures), 4)
+        for failure in failures:
+            self.assertLessEqual(len(failure['program']), 3)
+            self.assertIn('nor', [instruction[0] for instruction in failure['program']])
+            self.assertEqual(compare(failure['program'])[1], failure['difference'])
+
+        # Overflow, which only the reference traps
+        program = setRegister(8, 0x7fffffff) + [('addi', 9, 8, 1), ('and', 10, 8, 8)]
+        self.assertEqual(compare(program)[0], 'reason')
+        self.assertEqual(shrink(program, 'reason'), program[:3])
+
+    def test_process_pool(self):
+        inProcess = list(fuzz(6, seed=100, length=10, workers=0))
+        pooled = sorted(fuzz(6, seed=100, length=10, workers=2), key=lambda failure: failure['seed'])
+        self.assertEqual(pooled, inProcess)
+
+    def test_main(self):
+        import tempfile
+        from testCommon import runMain
+
+        with tempfile.TemporaryDirectory() as folder:
+            failures, text = runMain(main, ['--programs', '3', '--ops', 'nor', '--workers', '0', '--output', folder])
+            self.assertEqual(sorted(os.listdir(folder)), ['fuzz-%d.mem' % (f['seed'],) for f in failures])
+
+            # The reproductions are memory files that differ in the same way
+            from memoryImage import MemoryImage
+            for failure in failures:
+                with open(os.path.join(folder, 'fuzz-%d.mem' % (failure['seed'],))) as f:
+                    self.assertEqual(MemoryImage.parse(f.read()).words(), dict(assemble(failure['program'])))
+        self.assertIn('3 of 3 programs differ', text)
+
+if __name__ == '__main__':
+    main()
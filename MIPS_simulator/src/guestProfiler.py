@@ -0,0 +1,420 @@
+'''
+Implements a profiler of the MIPS program being simulated: how often each
+instruction runs, the mix of instructions, and the labels they belong to.
+
+Usage: python guestProfiler.py [--simulator datapath|functional|translated] [--listing] memoryFile
+For example, to see which loops of selectionsort.mem run most:
+    python guestProfiler.py --listing selectionsort.mem
+
+Code written for inf-2200, University of Tromso
+'''
+
+import argparse
+import json
+import os
+import sys
+import unittest
+from array import array
+from bisect import bisect_right
+from common import WORD, fromUnsignedWordToSignedWord
+
+R_TYPE = {0x20: 'add', 0x21: 'addu', 0x22: 'sub', 0x23: 'subu', 0x24: 'and', 0x25: 'or', 0x27: 'nor',
+          0x2a: 'slt', 0x0: 'sll', 0xd: 'add'}
+I_TYPE = {0x2: 'j', 0x4: 'beq', 0x5: 'bne', 0x8: 'addi', 0x9: 'addiu', 0xf: 'lui', 0x23: 'lw', 0x2b: 'sw'}
+
+
+def mnemonic(word):
+    '''
+    Return the instruction class of a word: its mnemonic, 'nop', or the unknown opcode or funct.
+    '''
+    if word == 0:
+        return 'nop'
+    if word == 0xd:
+        # Only the whole word stops the datapath, ALUControl decodes other funct 0xd words as add
+        return 'break'
+    opcode = word >> 26
+    if opcode == 0:
+        return R_TYPE.get(word & 0x3f, 'funct 0x%02x' % (word & 0x3f,))
+    return I_TYPE.get(opcode, 'opcode 0x%02x' % (opcode,))
+
+
+def disassemble(word, pc):
+    '''
+    Return an instruction as assembly, with register numbers.
+    '''
+    name = mnemonic(word)
+    rs, rt, rd = (word >> 21) & 0x1f, (word >> 16) & 0x1f, (word >> 11) & 0x1f
+    simm = fromUnsignedWordToSignedWord(word & 0xffff | (0xffff0000 if word & 0x8000 else 0))
+    if name in ('nop', 'break') or name.startswith(('opcode', 'funct')):
+        return name
+    if name == 'sll':
+        return 'sll $%d, $%d, %d' % (rd, rt, (word >> 6) & 0x1f)
+    if word >> 26 == 0:
+        return '%s $%d, $%d, $%d' % (name, rd, rs, rt)
+    if name == 'j':
+        return 'j 0x%08x' % ((((pc + 4) & 0xf0000000) | ((word & 0x3ffffff) << 2)),)
+    if name in ('beq', 'bne'):
+        return '%s $%d, $%d, 0x%08x' % (name, rs, rt, (pc + 4 + (simm << 2)) & 0xffffffff)
+    if name == 'lui':
+        return 'lui $%d, 0x%x' % (rt, word & 0xffff)
+    if name in ('lw', 'sw'):
+        return '%s $%d, %d($%d)' % (name, rt, simm, rs)
+    return '%s $%d, $%d, %d' % (name, rt, rs, simm)
+
+
+class GuestProfiler:
+    '''
+    Counts how many times each instruction of the program runs on a
+    MIPSSimulator or a FunctionalSimulator (interpreted or translated).
+
+    Every word of the program image has a slot in a preallocated array of
+    counts, and a last slot counts the instructions run outside the image.
+    start() shadows the method the simulator runs for each step with a
+    counting wrapper in the instance dictionary: simulateCycle() on the
+    datapath, executeInstruction() on the interpreter and executeBlock() on
+    the translator, whose BlockTranslator and translated blocks are left
+    untouched. Translated blocks are counted with one increment and one
+    decrement of a difference array, whatever their length.
+
+    The instruction mix and the attribution to labels (MemoryImage.symbols,
+    from memory file comments such as "#0xbfc000f8 <loop1>" or ELF symbols)
+    are computed from the counts when reporting, not while running.
+    '''
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        image = simulator.instructionMemory.image
+        self.symbols = sorted((address, name) for name, address in image.symbols.items())
+        self.symbolAddresses = [address for address, _ in self.symbols]
+
+        # Address, first slot and number of words of each range of the image
+        self.starts = [address for address, _ in image.ranges]
+        self.firsts = []
+        self.lengths = [len(words) for _, words in image.ranges]
+        self.words = array(WORD)
+        for _, words in image.ranges:
+            self.firsts.append(len(self.words))
+            self.words.extend(words)
+
+        self.outside = len(self.words)
+        self.counts = array('q', bytes(8 * (len(self.words) + 1)))
+        self.runs = array('q', bytes(8 * (len(self.words) + 2)))
+        self.wrapped = None
+
+    def slot(self, pc):
+        '''
+        Return the slot of an address, self.outside if it is not in the image.
+        '''
+        i = bisect_right(self.starts, pc) - 1
+        if i >= 0:
+            offset = (pc - self.starts[i]) >> 2
+            if offset < self.lengths[i] and not pc & 3:
+                return self.firsts[i] + offset
+        return self.outside
+
+    def start(self):
+        '''
+        Start counting. The simulator must not be run from another thread meanwhile.
+        '''
+        assert self.wrapped is None, 'Profiler already started'
+        simulator = self.simulator
+        counts = self.counts
+        runs = self.runs
+        slot = self.slot
+
+        # Range of the previous instruction: most instructions are found without bisect
+        base = end = first = 0
+
+        def find(pc):
+            nonlocal base, end, first
+            i = bisect_right(self.starts, pc) - 1
+            if i >= 0:
+                base, end, first = self.starts[i], self.starts[i] + 4 * self.lengths[i], self.firsts[i]
+            return slot(pc)
+
+        if hasattr(simulator, 'netlist'):
+            name = 'simulateCycle'
+            original = simulator.simulateCycle
+            pc = simulator.pc
+
+            def counted():
+                address = pc.address
+                if base <= address < end:
+                    counts[first + ((address - base) >> 2)] += 1
+                else:
+                    counts[find(address)] += 1
+                original()
+        elif simulator.translator is not None:
+            name = 'executeBlock'
+            original = simulator.executeBlock
+
+            def counted():
+                address = simulator.pc
+                before = simulator.nCycles
+                try:
+                    original()
+                finally:
+                    # The caller counted the first instruction of the block
+                    length = simulator.nCycles - before + 1
+                    if not base <= address < end:
+                        find(address)
+                    if base <= address and address + 4 * length <= end:
+                        runs[first + ((address - base) >> 2)] += 1
+                        runs[first + ((address - base) >> 2) + length] -= 1
+                    else:
+                        self.countRun(address, length)
+        else:
+            name = 'executeInstruction'
+            original = simulator.executeInstruction
+
+            def counted():
+                address = simulator.pc
+                if base <= address < end:
+                    counts[first + ((address - base) >> 2)] += 1
+                else:
+                    counts[find(address)] += 1
+                original()
+
+        self.wrapped = (name, simulator.__dict__.get(name))
+        setattr(simulator, name, counted)
+        return self
+
+    def stop(self):
+        name, previous = self.wrapped
+        if previous is None:
+            delattr(self.simulator, name)
+        else:
+            setattr(self.simulator, name, previous)
+        self.wrapped = None
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def countRun(self, address, length):
+        '''
+        Count length instructions run one after the other from address.
+        '''
+        first = self.slot(address)
+        last = self.slot(address + 4 * (length - 1))
+        if first != self.outside and last != self.outside and last - first == length - 1:
+            self.runs[first] += 1
+            self.runs[first + length] -= 1
+        else:
+            for i in range(length):
+                self.counts[self.slot(address + 4 * i)] += 1
+
+    def executions(self):
+        '''
+        Return the number of executions of every slot, as a list.
+        '''
+        result = list(self.counts)
+        running = 0
+        for i in range(len(self.words)):
+            running += self.runs[i]
+            result[i] += running
+        return result
+
+    def address(self, slot):
+        i = bisect_right(self.firsts, slot) - 1
+        return self.starts[i] + 4 * (slot - self.firsts[i])
+
+    def label(self, address):
+        '''
+        Return the nearest label at or before address, or None.
+        '''
+        i = bisect_right(self.symbolAddresses, address) - 1
+        return self.symbols[i][1] if i >= 0 else None
+
+    def profile(self, top=20):
+        '''
+        Return the profile as a dictionary: the instructions run, the number of
+        them per label and per instruction class, and the top hottest addresses.
+        '''
+        executions = self.executions()
+        total = sum(executions)
+        labels = {}
+        mix = {}
+        hot = []
+        for slot, count in enumerate(executions[:self.outside]):
+            if count:
+                address = self.address(slot)
+                label = self.label(address) or '(no label)'
+                labels[label] = labels.get(label, 0) + count
+                name = mnemonic(self.words[slot])
+                mix[name] = mix.get(name, 0) + count
+                hot.append((count, address))
+        if executions[self.outside]:
+            labels['(outside the image)'] = executions[self.outside]
+            mix['nop'] = mix.get('nop', 0) + executions[self.outside]
+
+        def ordered(counts):
+            return [{'name': name, 'count': count} for name, count in sorted(counts.items(), key=lambda e: -e[1])]
+
+        hot.sort(key=lambda e: (-e[0], e[1]))
+        return {'instructions': total, 'labels': ordered(labels), 'mix': ordered(mix),
+                'hot': [{'address': '0x%08x' % (address,), 'label': self.label(address), 'count': count,
+                         'instruction': disassemble(self.words[self.slot(address)], address)}
+                        for count, address in hot[:top]]}
+
+    def report(self, top=10):
+        '''
+        Return the flat profile as text: instructions per label, the instruction mix and the hottest addresses.
+        '''
+        profile = self.profile(top)
+        total = profile['instructions'] or 1
+        lines = ['%d instructions' % (profile['instructions'],), '', '%10s %7s  %s' % ('count', '%', 'label')]
+        for entry in profile['labels']:
+            lines.append('%10d %6.1f%%  %s' % (entry['count'], 100 * entry['count'] / total, entry['name']))
+        lines += ['', '%10s %7s  %s' % ('count', '%', 'instruction')]
+        for entry in profile['mix']:
+            lines.append('%10d %6.1f%%  %s' % (entry['count'], 100 * entry['count'] / total, entry['name']))
+        lines += ['', '%10s %7s  %-10s  %s' % ('count', '%', 'address', 'instruction')]
+        for entry in profile['hot']:
+            lines.append('%10d %6.1f%%  %s  %-28s <%s>' % (entry['count'], 100 * entry['count'] / total,
+                                                          entry['address'], entry['instruction'], entry['label']))
+        return '\n'.join(lines) + '\n'
+
+    def listing(self):
+        '''
+        Return an annotated listing of every range of the image that ran: each
+        word with its count and share of all instructions, under its label.
+        '''
+        executions = self.executions()
+        total = sum(executions) or 1
+        symbols = {}
+        for address, name in self.symbols:
+            symbols.setdefault(address, []).append(name)
+
+        lines = []
+        for start, first, length in zip(self.starts, self.firsts, self.lengths):
+            if not any(executions[first:first + length]):
+                continue
+            lines.append('')
+            for i in range(length):
+                address = start + 4 * i
+                for name in symbols.get(address, ()):
+                    lines.append('%19s<%s>:' % ('', name))
+                count = executions[first + i]
+                word = self.words[first + i]
+                lines.append('%10s %7s  0x%08x  0x%08x  %s' % (
+                    count or '', '%.1f%%' % (100 * count / total,) if count else '',
+                    address, word, disassemble(word, address)))
+        if executions[self.outside]:
+            lines += ['', '%10d %6.1f%%  outside the image' % (
+                executions[self.outside], 100 * executions[self.outside] / total)]
+        return '\n'.join(lines[1:]) + '\n'
+
+
+def main(argv=None, output=None):
+    parser = argparse.ArgumentParser(description='Profile a MIPS program.')
+    parser.add_argument('memoryFile')
+    parser.add_argument('--simulator', choices=['datapath', 'functional', 'translated'], default='translated')
+    parser.add_argument('--max-cycles', type=int, help='cycle limit')
+    parser.add_argument('--listing', action='store_true', help='also print the annotated listing')
+    parser.add_argument('--json', help='write the profile to this file')
+    args = parser.parse_args(argv)
+    output = output or sys.stdout
+
+    from batch import makeSimulator
+    simulator = makeSimulator(args.simulator, args.memoryFile)
+    with GuestProfiler(simulator) as profiler:
+        result = simulator.run(max_cycles=args.max_cycles)
+
+    output.write('%s: %s after %d cycles\n\n' % (args.memoryFile, result.reason, result.cycles))
+    output.write(profiler.report())
+    if args.listing:
+        output.write('\n' + profiler.listing())
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(profiler.profile(), f, indent=2)
+    return profiler
+
+
+class TestGuestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'selectionsort.mem')
+
+    def test_same_counts_on_every_simulator(self):
+        from batch import makeSimulator
+
+        profiles = {}
+        for kind in ['datapath', 'functional', 'translated']:
+            simulator = makeSimulator(kind, self.filename)
+            with GuestProfiler(simulator) as profiler:
+                result = simulator.run()
+            profiles[kind] = profiler.executions()
+
+            # Every cycle runs one instruction, except the one that finds the break
+            self.assertEqual(sum(profiles[kind]), result.cycles - 1)
+            self.assertNotIn('simulateCycle', vars(simulator))
+            self.assertNotIn('executeInstruction', vars(simulator))
+            self.assertNotIn('executeBlock', vars(simulator))
+
+        self.assertEqual(profiles['functional'], profiles['datapath'])
+        self.assertEqual(profiles['translated'], profiles['datapath'])
+
+    def test_translator_is_kept(self):
+        from functionalSimulator import FunctionalSimulator
+        from blockTranslator import BlockTranslator
+
+        simulator = FunctionalSimulator(self.filename, translated=True)
+        translator = simulator.translator
+        with GuestProfiler(simulator) as profiler:
+            self.assertIs(simulator.translator, translator)
+            result = simulator.run(max_cycles=100)
+            self.assertTrue(simulator.translator.blocks)
+        self.assertIsInstance(simulator.translator, BlockTranslator)
+        self.assertNotIn('executeBlock', vars(simulator))
+
+        # The cycle limit of translated runs still holds while profiling
+        self.assertEqual((result.reason, result.cycles), ('cycle limit', 100))
+        self.assertEqual(sum(profiler.executions()), 100)
+
+    def test_labels_and_mix(self):
+        from functionalSimulator import FunctionalSimulator
+
+        simulator = FunctionalSimulator(self.filename)
+        with GuestProfiler(simulator) as profiler:
+            simulator.run()
+        profile = profiler.profile()
+        labels = [entry['name'] for entry in profile['labels']]
+        self.assertEqual(labels[0], 'loop2')
+        self.assertIn('selection_sort', labels)
+
+        mix = {entry['name']: entry['count'] for entry in profile['mix']}
+        self.assertEqual(sum(mix.values()), profile['instructions'])
+        self.assertEqual(mix['break'], 1)
+        self.assertEqual(profile['hot'][0]['label'], 'loop2')
+
+        listing = profiler.listing()
+        self.assertIn('<loop2>:', listing)
+        self.assertIn('beq $9, $17, 0xbfc00150', listing)
+
+    def test_overflow_in_block(self):
+        from functionalSimulator import FunctionalSimulator
+
+        # lui $t0, 0x7fff; addi $t0, $t0, 0x7fff; addi $t0, $t0, 0x7fff; addi $t0, $t0, 2; break
+        program = [(0x1000, 0x3c087fff), (0x1004, 0x21087fff), (0x1008, 0x21087fff), (0x100c, 0x21080002),
+                   (0x1010, 0x0000000d)]
+        for translated in [False, True]:
+            with self.subTest(translated=translated):
+                simulator = FunctionalSimulator(program, translated=translated)
+                with GuestProfiler(simulator) as profiler:
+                    self.assertEqual(simulator.run().reason, 'overflow')
+                self.assertEqual(profiler.executions(), [1, 1, 1, 1, 0, 0])
+
+    def test_main(self):
+        from testCommon import runMain
+
+        _, text = runMain(main, [self.filename, '--listing'])
+        self.assertIn('selectionsort.mem: break', text)
+        self.assertIn('loop1', text)
+        self.assertIn('<selection_sort>:', text)
+
+
+if __name__ == '__main__':
+    main()
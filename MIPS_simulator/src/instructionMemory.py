@@ -9,13 +9,24 @@ from memory import Memory
 from testElement import TestElement
 import unittest
 from common import Break
+import tracing
 
 
 class InstructionMemory(Memory):
-    BREAK = False
+    __slots__ = (
+        'BREAK', 'decoded', 'invalidationCallbacks', 'pcInputName', 'instruction_instruction',
+        'instruction_jump', 'instruction_opcode', 'instruction_rs', 'instruction_rt',
+        'instruction_rd', 'instruction_imm', 'instruction_func', 'outputFields', 'instruction')
 
     def __init__(self, filename):
         Memory.__init__(self, filename)
+        self.BREAK = False
+
+        # Address -> decoded instruction, filled on first fetch (see fetch())
+        self.decoded = {}
+
+        # Functions called with the address of each write, or None when everything changed
+        self.invalidationCallbacks = []
 
 
     def connect(self, inputSources, outputValueNames, control, outputSignalNames):
@@ -39,6 +50,9 @@ class InstructionMemory(Memory):
         self.instruction_imm = outputValueNames[6]
         self.instruction_func = outputValueNames[7]
 
+        # Output names in the same order as the fields of a decoded instruction
+        self.outputFields = list(outputValueNames)
+
     def slice_instruction(self, instruction):
         instruction_bin = format(instruction, '032b')
 
@@ -54,29 +68,62 @@ class InstructionMemory(Memory):
         }
         return slices
 
+    def decodeInstruction(self, instruction):
+        """
+        Split an instruction into its fields.
+
+        @return: Tuple of (instruction, jump, opcode, rs, rt, rd, imm, func)
+        """
+        return (instruction,
+                instruction & 0x3ffffff,  # Bits 25 to 0
+                instruction >> 26,  # Bits 31 to 26
+                (instruction >> 21) & 0x1f,  # Bits 25 to 21
+                (instruction >> 16) & 0x1f,  # Bits 20 to 16
+                (instruction >> 11) & 0x1f,  # Bits 15 to 11
+                instruction & 0xffff,  # Bits 15 to 0
+                instruction & 0x3f)  # Bits 5 to 0
+
     def getInstruction(self, address):
         """Retrieve instruction at the given address"""
-        instruction = self.memory.get(address, None)
-        if instruction is None:
-            instruction = 0
-        return instruction
+        return self.memory.readWord(address)
+
+    def fetch(self, address):
+        """
+        Return the decoded instruction at the given address.
+
+        Each address is decoded once; later fetches are served from self.decoded.
+        """
+        record = self.decoded.get(address)
+        if record is None:
+            record = self.decoded[address] = self.decodeInstruction(self.getInstruction(address))
+        return record
+
+    def writeInstruction(self, address, instruction):
+        """Store an instruction, dropping the decoded copy of the old one"""
+        self.memory.writeWord(address, instruction)
+        self.decoded.pop(address, None)
+        for callback in self.invalidationCallbacks:
+            callback(address)
+
+    def invalidate(self):
+        """Drop all decoded instructions, needed after changing self.memory directly"""
+        self.decoded.clear()
+        for callback in self.invalidationCallbacks:
+            callback(None)
 
     def writeOutput(self):
         """Remove this and replace with your implementation!
         # raise AssertionError("writeOutput not implemented in class InstructionMemory!")"""
         pcValue = self.inputValues[self.pcInputName]
-        self.instruction = self.getInstruction(pcValue)
+        record = self.fetch(pcValue)
+        self.instruction = record[0]
 
         if self.instruction == 0xD:
             self.BREAK = True
-        
-        self.instruction_slices = self.slice_instruction(self.instruction)
-        self.outputValues[self.instruction_instruction] = self.instruction
 
-        for key, value in self.instruction_slices.items():
-            self.outputValues[key] = int(value, 2)
-        ov = len(self.outputValues)
-        print(f"IM: outputvalues are: {self.outputValues}")
+        self.outputValues.update(zip(self.outputFields, record))
+        if tracing.fetch:
+            tracing.emit('fetch', f"{hex(pcValue)}: outputvalues are: {self.outputValues}")
 
 
 class TestInstructionMemory(unittest.TestCase):
@@ -150,6 +197,31 @@ class TestInstructionMemory(unittest.TestCase):
                 self.assertEqual(instruction_slices[slice_range], expected_binary,
                                  f"Slice {slice_range} should be {expected_binary}")
 
+    def test_decode_matches_slices(self):
+        self.testInput.setOutputValue('PC', 0xbfc00000)
+        self.instructionMemory.readInput()
+        self.instructionMemory.writeOutput()
+
+        for instruction in [0x0bf00080, 0x014b6020, 0xad2b0000, 0x112affff, 0xffffffff, 0]:
+            with self.subTest(instruction=hex(instruction)):
+                slices = self.instructionMemory.slice_instruction(instruction)
+                record = self.instructionMemory.decodeInstruction(instruction)
+                expected = [instruction] + [int(slices[name], 2) for name in self.instructionMemory.outputFields[1:]]
+                self.assertEqual(list(record), expected)
+
+    def test_write_invalidates(self):
+        self.testInput.setOutputValue('PC', 0xbfc00000)
+        self.instructionMemory.readInput()
+        self.instructionMemory.writeOutput()
+        self.assertIn(0xbfc00000, self.instructionMemory.decoded)
+
+        self.instructionMemory.writeInstruction(0xbfc00000, 0x014b6020)
+        self.instructionMemory.writeOutput()
+        self.testOutput.readInput()
+        self.assertEqual(self.testOutput.inputValues['instructionOut'], 0x014b6020)
+        self.assertEqual(self.testOutput.inputValues['rd'], 12)
+        self.assertEqual(self.testOutput.inputValues['func'], 0x20)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -4,6 +4,8 @@ import unittest
 
 
 class JumpMerge(CPUElement):
+    __slots__ = ('address', 'pc4', 'jumpAddress')
+
     def connect(self, inputSources, outputValueNames, control, outputSignalNames):
         CPUElement.connect(self, inputSources, outputValueNames, control, outputSignalNames)
         assert len(inputSources) == 2, 'Jump merge should have 2 inputs'
@@ -24,6 +26,9 @@ class JumpMerge(CPUElement):
 
         self.outputValues[self.jumpAddress] = (input2 & 0xf0000000) + (input1)
 
+    def generateOutput(self, inputs, controls):
+        return {self.jumpAddress: '((%s & 0xf0000000) + %s)' % (inputs[self.pc4], inputs[self.address])}
+
 class TestJumpMerge(unittest.TestCase):
     def setUp(self):
         self.jmerge = JumpMerge()
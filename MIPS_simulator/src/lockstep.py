@@ -0,0 +1,400 @@
+'''
+Implements lockstep simulation of many independent machine contexts with NumPy.
+
+NumPy is optional for the rest of the simulator, and only needed by this module.
+
+Code written for inf-2200, University of Tromso
+'''
+
+import os
+import time
+import unittest
+from memoryImage import toImage
+from memory import PAGE_SHIFT, PAGE_MASK, PAGE_WORDS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Context status
+RUNNING = 0
+BREAK = 1
+OVERFLOW = 2
+ERROR = 3
+
+REASONS = {RUNNING: 'cycle limit', BREAK: 'break', OVERFLOW: 'overflow', ERROR: 'error'}
+
+# Instruction kinds, decoded once for every word of the program image
+(INVALID, ADD, ADDU, SUB, SUBU, AND, OR, NOR, SLT, SLL, BREAK_INSTRUCTION,
+ J, ADDIU, ADDI, LUI, LW, SW, BEQ, BNE) = range(19)
+
+R_TYPE = {0x20: ADD, 0x21: ADDU, 0x22: SUB, 0x23: SUBU, 0x24: AND, 0x25: OR, 0x27: NOR, 0x2a: SLT,
+          0x0: SLL, 0xd: ADD}
+I_TYPE = {0x2: J, 0x9: ADDIU, 0x8: ADDI, 0xf: LUI, 0x23: LW, 0x2b: SW, 0x4: BEQ, 0x5: BNE}
+
+
+class LockstepResult:
+    '''
+    Outcome of LockstepSimulator.run().
+
+    reasons maps each stop reason (as in RunResult, or 'error' for an invalid
+    instruction or address) to the number of contexts that stopped for it.
+    instructions counts the instructions executed by all contexts together.
+    '''
+
+    def __init__(self, reasons, instructions, elapsed):
+        self.reasons = reasons
+        self.instructions = instructions
+        self.elapsed = elapsed
+
+    def rate(self):
+        '''Context-instructions per second.'''
+        return self.instructions / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return 'LockstepResult(reasons=%r, instructions=%d, elapsed=%.6f)' % (
+            self.reasons, self.instructions, self.elapsed)
+
+
+class LockstepSimulator:
+    '''
+    Runs one program in many contexts at once, each with its own PC, registers
+    and data memory, following the semantics of FunctionalSimulator.
+
+    Each step executes the instruction at the PC of every running context.
+    Contexts take their own branches, and stop on their own at a break (one
+    cycle after the break instruction, like the other simulators), on
+    Overflow, or at an invalid instruction or address, without affecting the
+    others. nCycles counts the cycles of each context like FunctionalSimulator.
+
+    Words of the program image are shared by all contexts. A page that any
+    context writes is copied for every context, so memory grows with the
+    pages written, not with the number of contexts.
+    '''
+
+    def __init__(self, program, contexts):
+        '''
+        @param program: Program in any form accepted by memoryImage.toImage().
+        @param contexts: Number of contexts, all starting with the same state.
+        '''
+        if np is None:
+            raise ImportError('LockstepSimulator needs NumPy')
+        image = toImage(program)
+        self.contexts = contexts
+
+        self.registers = np.zeros((contexts, 32), dtype=np.uint32)
+        self.pc = np.full(contexts, image.start or 0, dtype=np.uint32)
+        self.nCycles = np.zeros(contexts, dtype=np.int64)
+        self.status = np.zeros(contexts, dtype=np.int8)
+        self.breakFlag = np.zeros(contexts, dtype=bool)
+        self.instructions = 0
+
+        # Pages of the image, shared by every context
+        pages = image.pages()
+        self.imageKeys = np.array(sorted(pages), dtype=np.int64)
+        self.imagePages = np.array([np.frombuffer(pages[number][0], dtype=np.uint32) for number in sorted(pages)],
+                                   dtype=np.uint32).reshape(-1, PAGE_WORDS)
+
+        # Pages written by some context, one copy per context
+        self.pageKeys = np.zeros(0, dtype=np.int64)
+        self.pages = np.zeros((contexts, 0, PAGE_WORDS), dtype=np.uint32)
+
+        self.decode(image)
+
+    def decode(self, image):
+        '''
+        Decode every word of the image into arrays indexed like self.addresses.
+        The last entry is a nop, executed at addresses outside the image.
+        '''
+        addresses = [np.arange(address, address + 4 * len(words), 4, dtype=np.int64)
+                     for address, words in image.ranges]
+        words = [np.frombuffer(words, dtype=np.uint32) for _, words in image.ranges]
+        addresses = np.concatenate(addresses) if addresses else np.zeros(0, dtype=np.int64)
+        order = np.argsort(addresses, kind='stable')
+        self.addresses = addresses[order]
+        instruction = np.concatenate(words + [np.zeros(1, dtype=np.uint32)])
+        instruction[:-1] = instruction[:-1][order]
+
+        opcode = instruction >> 26
+        funct = instruction & 0x3f
+        kind = np.full(len(instruction), INVALID, dtype=np.int8)
+        for value, k in R_TYPE.items():
+            kind[(opcode == 0) & (funct == value)] = k
+        # Like the datapath, only the whole word 0xd breaks, ALUControl decodes other funct 0xd words as add
+        kind[instruction == 0xd] = BREAK_INSTRUCTION
+        for value, k in I_TYPE.items():
+            kind[opcode == value] = k
+        self.kind = kind
+
+        self.rs = ((instruction >> 21) & 0x1f).astype(np.intp)
+        self.rt = ((instruction >> 16) & 0x1f).astype(np.intp)
+        rd = ((instruction >> 11) & 0x1f).astype(np.intp)
+        self.shamt = (instruction >> 6) & 0x1f
+        imm = instruction & 0xffff
+        self.simm = (imm.astype(np.int16).astype(np.int32)).astype(np.uint32)
+        self.upper = imm << 16
+        self.target = (instruction & 0x3ffffff) << 2
+
+        # Register written by each instruction, 0 for none
+        self.destination = np.where(np.isin(kind, [ADD, ADDU, SUB, SUBU, AND, OR, NOR, SLT, SLL]), rd,
+                                    np.where(np.isin(kind, [ADDIU, ADDI, LUI, LW]), self.rt, 0))
+
+    def setRegister(self, number, values):
+        '''
+        Set a register in every context, to one value or to an array of one value per context.
+        '''
+        if number != 0:
+            self.registers[:, number] = np.asarray(values, dtype=np.int64) & 0xffffffff
+
+    def readWord(self, address):
+        '''
+        Return the word at address in every context.
+        '''
+        return self.load(np.arange(self.contexts), np.full(self.contexts, address, dtype=np.uint32))
+
+    def writeWord(self, address, values):
+        '''
+        Set the word at address in every context, to one value or to an array of one value per context.
+        '''
+        values = np.broadcast_to(np.asarray(values, dtype=np.int64) & 0xffffffff, (self.contexts,))
+        self.store(np.arange(self.contexts), np.full(self.contexts, address, dtype=np.uint32),
+                   values.astype(np.uint32))
+
+    def find(self, keys, numbers):
+        position = np.minimum(np.searchsorted(keys, numbers), max(len(keys) - 1, 0))
+        found = keys[position] == numbers if len(keys) else np.zeros(len(numbers), dtype=bool)
+        return position, found
+
+    def load(self, contexts, addresses):
+        numbers = (addresses >> PAGE_SHIFT).astype(np.int64)
+        words = (addresses & PAGE_MASK) >> 2
+        values = np.zeros(len(contexts), dtype=np.uint32)
+
+        position, own = self.find(self.pageKeys, numbers)
+        values[own] = self.pages[contexts[own], position[own], words[own]]
+        position, shared = self.find(self.imageKeys, numbers)
+        shared &= ~own
+        values[shared] = self.imagePages[position[shared], words[shared]]
+        return values
+
+    def store(self, contexts, addresses, values):
+        numbers = (addresses >> PAGE_SHIFT).astype(np.int64)
+        _, own = self.find(self.pageKeys, numbers)
+        for number in np.unique(numbers[~own]):
+            self.allocate(number)
+        position, _ = self.find(self.pageKeys, numbers)
+        self.pages[contexts, position, (addresses & PAGE_MASK) >> 2] = values
+
+    def allocate(self, number):
+        '''
+        Give every context its own copy of a page.
+        '''
+        position, shared = self.find(self.imageKeys, np.array([number]))
+        initial = self.imagePages[position[0]] if shared[0] else np.zeros(PAGE_WORDS, dtype=np.uint32)
+        insert = np.searchsorted(self.pageKeys, number)
+        self.pageKeys = np.insert(self.pageKeys, insert, number)
+        self.pages = np.insert(self.pages, insert, initial, axis=1)
+
+    def step(self, max_cycles=None):
+        '''
+        Execute one instruction in every running context, except those that
+        have run max_cycles cycles.
+
+        @return: Number of contexts that ran the cycle.
+        '''
+        running = self.status == RUNNING
+        if max_cycles is not None:
+            running &= self.nCycles < max_cycles
+        active = np.flatnonzero(running)
+        ran = len(active)
+        if not ran:
+            return 0
+        self.nCycles[active] += 1
+
+        # The cycle after a break instruction stops the context
+        broke = self.breakFlag[active]
+        if broke.any():
+            self.status[active[broke]] = BREAK
+            active = active[~broke]
+
+        pc = self.pc[active]
+        position, found = self.find(self.addresses, pc.astype(np.int64))
+        index = np.where(found, position, len(self.kind) - 1)
+        kind = self.kind[index]
+        a = self.registers[active, self.rs[index]]
+        b = self.registers[active, self.rt[index]]
+        simm = self.simm[index]
+
+        n = len(active)
+        value = np.zeros(n, dtype=np.uint32)
+        nextPc = pc + np.uint32(4)
+        overflow = np.zeros(n, dtype=bool)
+        error = np.zeros(n, dtype=bool)
+
+        for k in np.flatnonzero(np.bincount(kind, minlength=BNE + 1)):
+            m = kind == k
+            if k == ADD or k == ADDI:
+                x, y = a[m], (b[m] if k == ADD else simm[m])
+                s = x + y
+                value[m] = s
+                overflow[m] = (~(x ^ y) & (x ^ s) & 0x80000000) != 0
+            elif k == ADDU:
+                value[m] = a[m] + b[m]
+            elif k == SUB:
+                x, y = a[m], b[m]
+                s = x - y
+                value[m] = s
+                overflow[m] = ((x ^ y) & (x ^ s) & 0x80000000) != 0
+            elif k == SUBU:
+                value[m] = a[m] - b[m]
+            elif k == AND:
+                value[m] = a[m] & b[m]
+            elif k == OR:
+                value[m] = a[m] | b[m]
+            elif k == NOR:
+                value[m] = ~(a[m] | b[m])
+            elif k == SLT:
+                value[m] = a[m].view(np.int32) < b[m].view(np.int32)
+            elif k == SLL:
+                value[m] = b[m] << self.shamt[index[m]]
+            elif k == BREAK_INSTRUCTION:
+                self.breakFlag[active[m]] = True
+            elif k == J:
+                nextPc[m] = (nextPc[m] & 0xf0000000) | self.target[index[m]]
+            elif k == ADDIU:
+                value[m] = a[m] + simm[m]
+            elif k == LUI:
+                value[m] = self.upper[index[m]]
+            elif k == LW or k == SW:
+                addresses = a[m] + simm[m]
+                aligned = (addresses & 3) == 0
+                error[np.flatnonzero(m)[~aligned]] = True
+                m[np.flatnonzero(m)[~aligned]] = False
+                if k == LW:
+                    value[m] = self.load(active[m], addresses[aligned])
+                else:
+                    self.store(active[m], addresses[aligned], b[m])
+            elif k == BEQ or k == BNE:
+                taken = (a[m] == b[m]) == (k == BEQ)
+                branch = nextPc[m]
+                branch[taken] += simm[m][taken] << np.uint32(2)
+                nextPc[m] = branch
+            else:
+                error[m] = True
+
+        # Trapping instructions change nothing, the context stops at them
+        stopped = overflow | error
+        write = (self.destination[index] != 0) & ~stopped
+        self.registers[active[write], self.destination[index[write]]] = value[write]
+        self.pc[active] = np.where(stopped, pc, nextPc)
+        self.status[active[overflow]] = OVERFLOW
+        self.status[active[error]] = ERROR
+        self.instructions += n
+
+        return ran
+
+    def run(self, max_cycles=None):
+        '''
+        Step until every context has stopped, or has run max_cycles cycles.
+
+        @return: LockstepResult
+        '''
+        start = time.perf_counter()
+        instructions = self.instructions
+        while self.step(max_cycles):
+            pass
+
+        return LockstepResult(self.reasonCounts(), self.instructions - instructions, time.perf_counter() - start)
+
+    def reasons(self):
+        '''
+        Return the stop reason of each context, 'cycle limit' for those still running.
+        '''
+        return [REASONS[status] for status in self.status.tolist()]
+
+    def reasonCounts(self):
+        counts = {}
+        for reason in self.reasons():
+            counts[reason] = counts.get(reason, 0) + 1
+        return counts
+
+
+@unittest.skipIf(np is None, 'NumPy is not installed')
+class TestLockstepSimulator(unittest.TestCase):
+    def setUp(self):
+        self.folder = os.path.dirname(os.path.abspath(__file__))
+
+    def compare(self, lockstep, program, setup):
+        '''
+        Run every context on FunctionalSimulator, after setup(simulator, context).
+        '''
+        from functionalSimulator import FunctionalSimulator
+
+        reasons = lockstep.reasons()
+        for context in range(lockstep.contexts):
+            simulator = FunctionalSimulator(program)
+            setup(simulator, context)
+            reason = simulator.run(max_cycles=10000).reason
+            with self.subTest(context=context):
+                self.assertEqual(reasons[context], reason)
+                self.assertEqual(lockstep.nCycles[context], simulator.nCycles)
+                self.assertEqual(lockstep.pc[context], simulator.pc)
+                self.assertEqual(lockstep.registers[context].tolist(), list(simulator.registerFile.registers))
+                for address in simulator.dataMemory.memory:
+                    self.assertEqual(lockstep.readWord(address)[context], simulator.dataMemory.memory[address])
+
+    def test_divergent_contexts(self):
+        program = [(0x1000 + 4 * i, word) for i, word in enumerate([
+            0x24090000,     # addiu $t1, $zero, 0
+            0x01284820,     # add   $t1, $t1, $t0       <loop>
+            0xad690100,     # sw    $t1, 0x100($t3)
+            0x256b0004,     # addiu $t3, $t3, 4
+            0x2508ffff,     # addiu $t0, $t0, -1
+            0x0148602a,     # slt   $t4, $t2, $t0
+            0x1580fffa,     # bne   $t4, $zero, <loop>
+            0x8d6d00fc,     # lw    $t5, 0xfc($t3)
+            0x0000000d,     # break
+        ])]
+        # Loop counters, loop ends and base addresses, the last one unaligned
+        initial = {8: [3, 1, 0x40000000, 7, 0x7fffffff, 2],
+                   10: [0, 0, 0x3ffffffd, 5, 0, 1],
+                   11: [0, 0x2000, 0, 0x1000, 0, 2]}
+        lockstep = LockstepSimulator(program, 6)
+        for register, values in initial.items():
+            lockstep.setRegister(register, values)
+        result = lockstep.run(max_cycles=10000)
+
+        self.assertEqual(result.reasons, {'break': 3, 'overflow': 2, 'error': 1})
+        self.assertEqual(result.instructions, sum(lockstep.nCycles.tolist()) - 3)
+
+        def setup(simulator, context):
+            for register, values in initial.items():
+                simulator.registerFile.register[register] = values[context]
+        self.compare(lockstep, program, setup)
+
+    def test_same_result_as_functional(self):
+        filename = os.path.join(self.folder, 'selectionsort.mem')
+        lockstep = LockstepSimulator(filename, 8)
+        data = [[(i * 7919 + context * 104729) % 1000 - 500 for i in range(10)] for context in range(8)]
+        for i in range(10):
+            lockstep.writeWord(0xc0000000 + 4 * i, [values[i] for values in data])
+        lockstep.run()
+        self.assertEqual(lockstep.reasons(), ['break'] * 8)
+
+        def setup(simulator, context):
+            for i, value in enumerate(data[context]):
+                simulator.dataMemory.memory.writeWord(0xc0000000 + 4 * i, value)
+        self.compare(lockstep, filename, setup)
+
+    def test_cycle_limit(self):
+        loop = [(0x1000, 0x25290001), (0x1004, 0x08000400)]  # addiu $t1, $t1, 1; j 0x1000
+        lockstep = LockstepSimulator(loop, 3)
+        result = lockstep.run(max_cycles=101)
+        self.assertEqual(result.reasons, {'cycle limit': 3})
+        self.assertEqual(lockstep.nCycles.tolist(), [101] * 3)
+        self.assertEqual(lockstep.registers[:, 9].tolist(), [51] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+'''
+Converts a memory file to an ELF32 big-endian MIPS executable.
+
+Each range of consecutive words becomes a PT_LOAD segment, the lowest address
+becomes the entry point, and the labels in the comments become symbols.
+
+Code written for inf-2200, University of Tromso
+'''
+
+import sys
+from array import array
+from common import WORD
+from memoryImage import loadImage
+from elfLoader import writeElf
+
+
+def memToElf(memoryFile, elfFile):
+    image = loadImage(memoryFile, useSidecar=False)
+    segments = []
+    for address, words in image.ranges:
+        words = array(WORD, words)
+        if sys.byteorder == 'little':
+            words.byteswap()
+        segments.append((address, words.tobytes(), 4 * len(words)))
+
+    with open(elfFile, 'wb') as f:
+        f.write(writeElf(segments, image.start, image.symbols))
+
+
+if __name__ == '__main__':
+    assert (len(sys.argv) == 3), 'Usage: python %s memoryFile elfFile' % (sys.argv[0],)
+    memToElf(sys.argv[1], sys.argv[2])
@@ -9,50 +9,222 @@ own, isolated copy of the data from the memory file.
 Code written for inf-2200, University of Tromso
 '''
 
+import unittest
+from array import array
+from collections.abc import MutableMapping
 from cpuElement import CPUElement
 import common
+from common import WORD
+from memoryImage import MemoryImage, toImage
+
+# Pages hold 4 KiB, 1024 words
+PAGE_SHIFT = 12
+PAGE_WORDS = 1 << (PAGE_SHIFT - 2)
+PAGE_MASK = (1 << PAGE_SHIFT) - 1
+
+
+class SparseMemory(MutableMapping):
+    '''
+    Sparse 32-bit memory, stored in pages that are allocated on first write.
+
+    readWord() and writeWord() are the fast paths; byte and halfword accesses are
+    big-endian within a word. The memory also behaves as a dictionary mapping
+    word addresses to words, holding the words that have been written (or
+    loaded from a file). Reading a word that was never written returns 0.
+
+    Word addresses must be multiples of 4 below 2**32, and readWord() and
+    writeWord() raise ValueError for any other address. This differs from the
+    plain dictionary used before, which read an unaligned address as 0 and kept
+    writes to it under that key: a lw or sw at an unaligned address now stops
+    the simulators, and run() reports it as an 'error'.
+
+    Pages loaded from a MemoryImage are shared with the image and every other
+    memory that loaded it, and are copied on the first write to them.
+    '''
+
+    __slots__ = ('pages', 'present', 'writable')
+
+    def __init__(self):
+        # Page number -> array of PAGE_WORDS words
+        self.pages = {}
+        # Page number -> bytearray with 1 for each word that has been written
+        self.present = {}
+        # Page number -> array for the pages owned by this memory, the others are shared
+        self.writable = {}
+
+    def allocate(self, number):
+        '''
+        Return the page to write for a page number, allocating or copying it if needed.
+        '''
+        page = self.pages.get(number)
+        if page is None:
+            page = array(WORD, bytes(4 * PAGE_WORDS))
+            self.present[number] = bytearray(PAGE_WORDS)
+        else:
+            page = array(WORD, page)
+            self.present[number] = bytearray(self.present[number])
+        self.pages[number] = self.writable[number] = page
+        return page
+
+    def load(self, image):
+        '''
+        Add the words of a MemoryImage, sharing its pages where this memory has none.
+        '''
+        for number, (page, present) in image.pages().items():
+            if number in self.pages:
+                base = number << PAGE_SHIFT
+                for index in range(PAGE_WORDS):
+                    if present[index]:
+                        self.writeWord(base + 4 * index, page[index])
+            else:
+                self.pages[number] = page
+                self.present[number] = present
+
+    def readWord(self, address):
+        # Also rejects negative addresses and addresses above 32 bits
+        if address & ~0xfffffffc:
+            raise ValueError('Invalid word address: %s' % (hex(address),))
+        page = self.pages.get(address >> PAGE_SHIFT)
+        if page is None:
+            return 0
+        return page[(address & PAGE_MASK) >> 2]
+
+    def writeWord(self, address, value):
+        if address & ~0xfffffffc:
+            raise ValueError('Invalid word address: %s' % (hex(address),))
+        number = address >> PAGE_SHIFT
+        page = self.writable.get(number)
+        if page is None:
+            page = self.allocate(number)
+        index = (address & PAGE_MASK) >> 2
+        page[index] = value & 0xffffffff
+        self.present[number][index] = 1
+
+    def writeWords(self, address, words):
+        '''
+        Write consecutive words starting at address, a page at a time.
+        '''
+        if address & ~0xfffffffc or address + 4 * len(words) > 0x100000000:
+            raise ValueError('Invalid word range: %s, %d words' % (hex(address), len(words)))
+        done = 0
+        while done < len(words):
+            number = address >> PAGE_SHIFT
+            page = self.writable.get(number)
+            if page is None:
+                page = self.allocate(number)
+            index = (address & PAGE_MASK) >> 2
+            count = min(PAGE_WORDS - index, len(words) - done)
+            page[index:index + count] = words[done:done + count]
+            self.present[number][index:index + count] = b'\x01' * count
+            done += count
+            address += 4 * count
+
+    def snapshot(self, image=None):
+        '''
+        Return the pages as a dictionary mapping page numbers to (words, present)
+        bytes objects, or to None for the pages still shared with image.
+        '''
+        shared = image.pages() if image is not None else {}
+        return {number: None if shared.get(number, (None,))[0] is page
+                else (page.tobytes(), bytes(self.present[number]))
+                for number, page in self.pages.items()}
+
+    def restore(self, snapshot, image=None):
+        '''
+        Replace every page with the pages of a snapshot made with the same image.
+        '''
+        self.clear()
+        for number, saved in snapshot.items():
+            if saved is None:
+                self.pages[number], self.present[number] = image.pages()[number]
+            else:
+                words, present = saved
+                assert len(words) == 4 * PAGE_WORDS and len(present) == PAGE_WORDS, 'Invalid page in snapshot'
+                self.pages[number] = self.writable[number] = array(WORD, words)
+                self.present[number] = bytearray(present)
+
+    def readHalf(self, address):
+        if address & 1:
+            raise ValueError('Invalid halfword address: %s' % (hex(address),))
+        return (self.readWord(address & ~3) >> (16 - 8 * (address & 2))) & 0xffff
+
+    def writeHalf(self, address, value):
+        if address & 1:
+            raise ValueError('Invalid halfword address: %s' % (hex(address),))
+        shift = 16 - 8 * (address & 2)
+        word = self.readWord(address & ~3) & ~(0xffff << shift)
+        self.writeWord(address & ~3, word | ((value & 0xffff) << shift))
+
+    def readByte(self, address):
+        return (self.readWord(address & ~3) >> (24 - 8 * (address & 3))) & 0xff
+
+    def writeByte(self, address, value):
+        shift = 24 - 8 * (address & 3)
+        word = self.readWord(address & ~3) & ~(0xff << shift)
+        self.writeWord(address & ~3, word | ((value & 0xff) << shift))
+
+    def __getitem__(self, address):
+        if isinstance(address, int) and not address & ~0xfffffffc:
+            number = address >> PAGE_SHIFT
+            present = self.present.get(number)
+            if present is not None and present[(address & PAGE_MASK) >> 2]:
+                return self.pages[number][(address & PAGE_MASK) >> 2]
+        raise KeyError(address)
+
+    def __setitem__(self, address, value):
+        self.writeWord(address, value)
+
+    def __delitem__(self, address):
+        self[address]  # KeyError if the word was never written
+        number = address >> PAGE_SHIFT
+        page = self.writable.get(number) or self.allocate(number)
+        page[(address & PAGE_MASK) >> 2] = 0
+        self.present[number][(address & PAGE_MASK) >> 2] = 0
+
+    def __iter__(self):
+        # Ascending addresses
+        for number in sorted(self.present):
+            present = self.present[number]
+            base = number << PAGE_SHIFT
+            index = present.find(1)
+            while index >= 0:
+                yield base + 4 * index
+                index = present.find(1, index + 1)
+
+    def __len__(self):
+        return sum(present.count(1) for present in self.present.values())
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def clear(self):
+        self.pages.clear()
+        self.present.clear()
+        self.writable.clear()
 
 
 class Memory(CPUElement):
+    __slots__ = ('memory', 'image')
+
     def __init__(self, filename):
-        if not isinstance(filename, str):
-            raise TypeError("Filename must be a string")
-        '''Dictionary mapping memory addresses to data
-        # Both key and value must be of type 'long'''
-        self.memory = {}
+        '''
+        @param filename: Memory file, or a program in any form accepted by toImage().
+        '''
+        # Sparse memory, which can also be used as a dictionary mapping word addresses to data
+        self.memory = SparseMemory()
         self.initializeMemory(filename)
 
     def initializeMemory(self, filename):
         '''
         Helper function that reads initializes the data memory by reading input
         data from a file.
+
+        The file is parsed once per process, and cached in a binary file next
+        to it for later processes (see memoryImage.py). Every memory loading the
+        same image shares its pages until it writes to them.
         '''
-        '''Implementation MUST populate the dictionary in self.memory!
-        # The memory (data and instruction memory) needs to be initialized with some values (instructions and data)
-        # from a file before the simulation starts. This dictionary serves as the primary data structure
-        # to hold the memory contents of the simulated CPU during execution.'''
-        with open(filename, 'r') as file:
-            for line in file:
-                line = line.strip()
-                # Skip comment lines
-                if line.startswith("0x"):
-                    
-                # Splitting the line by tab to separate address, content and comments
-                # print(repr(line))
-                    parts = line.split('\t')
-                    if len(parts) < 2:
-                        print(f"Error in line: {line.strip()}")
-                        raise ValueError("Each line in the memory file must contain at least an address and a "
-                                        "content value separated by a tab")
-
-                    # Extracting address and content, converting them from hex to int
-                    address = int(parts[0], 16)
-                    content = int(parts[1], 16)
-
-                    # Adding the address and content to the memory dictionary
-                    self.memory[address] = content
-
-        '''raise AssertionError("initializeMemory not implemented in class Memory!")'''
+        self.image = toImage(filename)
+        self.memory.load(self.image)
 
     def printAll(self):
         if not self.memory:
@@ -64,4 +236,103 @@ class Memory(CPUElement):
                 hex(int(key)), common.fromUnsignedWordToSignedWord(self.memory[key]), hex(int(self.memory[key]))))
 
 
+class TestSparseMemory(unittest.TestCase):
+    def setUp(self):
+        self.memory = SparseMemory()
+
+    def test_words(self):
+        self.assertEqual(self.memory.readWord(0x10000000), 0)
+        self.assertEqual(self.memory.pages, {})
+
+        self.memory.writeWord(0x10000000, 0x12345678)
+        self.memory.writeWord(0xfffffffc, -1)
+        self.assertEqual(self.memory.readWord(0x10000000), 0x12345678)
+        self.assertEqual(self.memory.readWord(0xfffffffc), 0xffffffff)
+        self.assertEqual(len(self.memory.pages), 2)
+
+        for address in [0x10000002, -4, 0x100000000]:
+            with self.subTest(address=address):
+                self.assertRaises(ValueError, self.memory.readWord, address)
+                self.assertRaises(ValueError, self.memory.writeWord, address, 1)
+
+    def test_bytes_and_halfwords(self):
+        self.memory.writeWord(0x100, 0x12345678)
+        self.assertEqual([self.memory.readByte(0x100 + i) for i in range(4)], [0x12, 0x34, 0x56, 0x78])
+        self.assertEqual(self.memory.readHalf(0x102), 0x5678)
+
+        self.memory.writeByte(0x101, 0xab)
+        self.memory.writeHalf(0x102, 0xcdef)
+        self.assertEqual(self.memory.readWord(0x100), 0x12abcdef)
+        self.assertRaises(ValueError, self.memory.readHalf, 0x101)
+
+        self.memory.writeByte(0x207, 0x01)
+        self.assertEqual(self.memory[0x204], 0x01)
+
+    def test_dictionary_view(self):
+        self.memory[0x2000] = 5
+        self.memory[0x1000] = 0
+        self.memory.writeWord(0x0ffc, 7)
+
+        self.assertEqual(list(self.memory), [0x0ffc, 0x1000, 0x2000])
+        self.assertEqual(self.memory, {0x1000: 0, 0x2000: 5, 0x0ffc: 7})
+        self.assertEqual(len(self.memory), 3)
+        self.assertEqual(self.memory.get(0x1004, 'missing'), 'missing')
+        self.assertNotIn(0x1002, self.memory)
+
+        del self.memory[0x2000]
+        self.assertNotIn(0x2000, self.memory)
+        self.assertEqual(self.memory.readWord(0x2000), 0)
+        self.assertRaises(KeyError, self.memory.__delitem__, 0x2000)
+
+        self.memory.clear()
+        self.assertEqual(dict(self.memory), {})
+
+    def test_write_words(self):
+        words = array(WORD, range(1, 1501))
+        self.memory.writeWords(0x0ff8, words)
+        self.assertEqual(len(self.memory.pages), 3)
+        self.assertEqual(list(self.memory), list(range(0x0ff8, 0x0ff8 + 4 * 1500, 4)))
+        self.assertEqual(self.memory.readWord(0x1000), 3)
+        self.assertEqual(self.memory.readWord(0x0ff8 + 4 * 1499), 1500)
+        self.assertRaises(ValueError, self.memory.writeWords, 0xfffffffc, words)
+
+    def test_shared_image(self):
+        image = MemoryImage.fromWords({0x1000: 1, 0x1004: 2, 0x5000: 3})
+        other = SparseMemory()
+        self.memory.load(image)
+        other.load(image)
+        self.assertIs(self.memory.pages[1], image.pages()[1][0])
+        self.assertIs(other.pages[1], self.memory.pages[1])
+
+        # The first write copies the page, the image and other memories keep their words
+        self.memory.writeWord(0x1004, 7)
+        del self.memory[0x5000]
+        self.assertEqual(self.memory, {0x1000: 1, 0x1004: 7})
+        self.assertEqual(other, {0x1000: 1, 0x1004: 2, 0x5000: 3})
+        self.assertEqual(image.words(), {0x1000: 1, 0x1004: 2, 0x5000: 3})
+        self.assertEqual(sorted(self.memory.writable), [1, 5])
+        self.assertEqual(other.writable, {})
+
+        # Loading into a page that is already there merges the words
+        other.writeWord(0x1008, 9)
+        other.load(MemoryImage.fromWords({0x1000: 4}))
+        self.assertEqual(other, {0x1000: 4, 0x1004: 2, 0x1008: 9, 0x5000: 3})
+
+    def test_snapshot(self):
+        image = MemoryImage.fromWords({0x1000: 1, 0x5000: 3})
+        self.memory.load(image)
+        self.memory.writeWord(0x1004, 2)
+        snapshot = self.memory.snapshot(image)
+        self.assertIsNone(snapshot[5])
+
+        self.memory.writeWord(0x1000, 7)
+        self.memory.writeWord(0x5000, 8)
+        self.memory.writeWord(0x9000, 9)
+        self.memory.restore(snapshot, image)
+        self.assertEqual(self.memory, {0x1000: 1, 0x1004: 2, 0x5000: 3})
+        self.assertIs(self.memory.pages[5], image.pages()[5][0])
+        self.assertEqual(sorted(self.memory.writable), [1])
+
 
+if __name__ == '__main__':
+    unittest.main()
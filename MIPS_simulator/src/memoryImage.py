@@ -0,0 +1,445 @@
+'''
+Implements loading of memory files into memory images, with a binary cache.
+
+A memory file is parsed into a MemoryImage: its lowest address, the words it
+holds, grouped into ranges of consecutive addresses, and the labels given in
+comments such as "#0xbfc000f0 <selection_sort>". loadImage() keeps each
+image in memory (the most recently used few), and writes it to a binary sidecar file in a __pycache__
+directory next to the memory file, so later loads skip the text parsing. A
+sidecar is used only if it was made from a file with the same modification
+time and size, or the same SHA-1 hash. ELF files are loaded by elfLoader.py
+and have no sidecar.
+
+Sidecar format (big-endian): the header
+    magic, source mtime (ns), source size, source SHA-1, flags, start address,
+    number of ranges, number of labels
+followed by, for each range, its address and number of words and then the words,
+and for each label its address, the length of its name and the name (UTF-8).
+
+Code written for inf-2200, University of Tromso
+'''
+
+import hashlib
+import os
+import re
+import struct
+import sys
+import tempfile
+import unittest
+from array import array
+from collections import OrderedDict
+from collections.abc import Iterable, Mapping
+from common import WORD
+
+MAGIC = b'MIPSIMG2'
+HEADER = struct.Struct('>8sQQ20sIIII')
+RANGE = struct.Struct('>II')
+LABEL = struct.Struct('>IH')
+
+ELF_MAGIC = b'\x7fELF'
+
+# Comment naming an address, such as "#0xbfc000f8 <loop1>" or "#0xbfc00000 <__start>:"
+LABEL_COMMENT = re.compile(r'#\s*0x([0-9a-fA-F]+)\s*<([^<>\s]+)>')
+
+# Header flag for an image that holds at least one word
+HAS_START = 1
+
+
+class MemoryImage:
+    '''
+    Contents of a memory file, which should not be modified once loaded.
+
+    start is the address of the first instruction: the lowest address in a
+    memory file (None if it holds no words), or the entry point of an ELF file.
+    ranges is a tuple of (address, words) pairs in ascending order, where words
+    is an array holding the words at address, address + 4, ... symbols maps
+    names to addresses.
+    '''
+
+    def __init__(self, start, ranges, symbols=None):
+        self.start = start
+        self.ranges = ranges
+        self.symbols = symbols if symbols is not None else {}
+
+        # Page number -> (page, present) shared by every memory loading this image, see pages()
+        self.pageCache = None
+
+    @classmethod
+    def fromWords(cls, words, symbols=None):
+        '''
+        Build an image from a dictionary mapping addresses to words.
+        '''
+        ranges = []
+        address = None
+        current = None
+        for a in sorted(words):
+            if a & ~0xfffffffc:
+                raise ValueError('Invalid word address: %s' % (hex(a),))
+            if current is None or a != address + 4 * len(current):
+                address = a
+                current = array(WORD)
+                ranges.append((address, current))
+            current.append(words[a] & 0xffffffff)
+
+        return cls(ranges[0][0] if ranges else None, tuple(ranges), symbols)
+
+    @classmethod
+    def fromPairs(cls, pairs):
+        '''
+        Build an image from an iterable of (address, word) pairs. Later pairs
+        replace earlier words at the same address.
+        '''
+        return cls.fromWords(dict(pairs))
+
+    @classmethod
+    def fromArray(cls, words, base=0):
+        '''
+        Build an image holding consecutive words starting at base.
+
+        @param words: array.array, NumPy array or other sequence of integers.
+        '''
+        if hasattr(words, 'astype'):
+            # NumPy array, converted without importing NumPy
+            packed = array(WORD, words.astype('=u4').tobytes())
+        elif isinstance(words, array) and words.typecode == WORD:
+            packed = array(WORD, words)
+        else:
+            packed = array(WORD, (word & 0xffffffff for word in words))
+        if base & ~0xfffffffc or base + 4 * len(packed) > 0x100000000:
+            raise ValueError('Invalid word range: %s, %d words' % (hex(base), len(packed)))
+        return cls(base if packed else None, ((base, packed),) if packed else ())
+
+    @classmethod
+    def fromBytes(cls, data):
+        '''
+        Build an image from the contents of an ELF file or a memory file.
+        '''
+        if bytes(data[:len(ELF_MAGIC)]) == ELF_MAGIC:
+            from elfLoader import parseElf
+            return parseElf(bytes(data))
+        return cls.parse(bytes(data).decode())
+
+    @classmethod
+    def parse(cls, text):
+        '''
+        Parse the text of a memory file.
+
+        Lines that start with "0x" hold an address and a word, separated by a tab.
+        Other lines are comments. Later lines replace earlier words at the same address.
+        '''
+        words = {}
+        symbols = {}
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith('#'):
+                label = LABEL_COMMENT.match(line)
+                if label:
+                    symbols[label.group(2)] = int(label.group(1), 16)
+            elif line.startswith('0x'):
+                parts = line.split('\t', 2)
+                if len(parts) < 2:
+                    print(f"Error in line: {line}")
+                    raise ValueError("Each line in the memory file must contain at least an address and a "
+                                     "content value separated by a tab")
+                words[int(parts[0], 16)] = int(parts[1], 16) & 0xffffffff
+        return cls.fromWords(words, symbols)
+
+    def pages(self):
+        '''
+        Return the image as memory pages, in the layout of SparseMemory.pages and
+        SparseMemory.present. The pages are made once, and must not be modified.
+        '''
+        if self.pageCache is None:
+            from memory import SparseMemory
+            memory = SparseMemory()
+            for address, words in self.ranges:
+                memory.writeWords(address, words)
+            self.pageCache = {number: (memory.pages[number], memory.present[number]) for number in memory.pages}
+        return self.pageCache
+
+    def words(self):
+        '''
+        Return a dictionary mapping each address in the image to its word.
+        '''
+        return {address + 4 * i: word for address, words in self.ranges for i, word in enumerate(words)}
+
+    def pack(self, mtime, size, digest):
+        '''
+        Return the sidecar file contents for this image.
+        '''
+        chunks = [HEADER.pack(MAGIC, mtime, size, digest, HAS_START if self.start is not None else 0,
+                              self.start or 0, len(self.ranges), len(self.symbols))]
+        for address, words in self.ranges:
+            chunks.append(RANGE.pack(address, len(words)))
+            packed = array(WORD, words)
+            if sys.byteorder == 'little':
+                packed.byteswap()
+            chunks.append(packed.tobytes())
+        for name, address in self.symbols.items():
+            name = name.encode()
+            chunks.append(LABEL.pack(address, len(name)))
+            chunks.append(name)
+        return b''.join(chunks)
+
+    @classmethod
+    def unpack(cls, data):
+        '''
+        Read an image from sidecar file contents.
+
+        @return: (image, mtime, size, digest)
+        '''
+        magic, mtime, size, digest, flags, start, count, labels = HEADER.unpack_from(data)
+        assert magic == MAGIC, 'Not a memory image sidecar file'
+
+        offset = HEADER.size
+        ranges = []
+        for _ in range(count):
+            address, length = RANGE.unpack_from(data, offset)
+            offset += RANGE.size
+            words = array(WORD)
+            words.frombytes(data[offset:offset + 4 * length])
+            if sys.byteorder == 'little':
+                words.byteswap()
+            offset += 4 * length
+            ranges.append((address, words))
+        symbols = {}
+        for _ in range(labels):
+            address, length = LABEL.unpack_from(data, offset)
+            offset += LABEL.size
+            symbols[data[offset:offset + length].decode()] = address
+            offset += length
+        assert offset == len(data), 'Truncated memory image sidecar file'
+
+        return cls(start if flags & HAS_START else None, tuple(ranges), symbols), mtime, size, digest
+
+
+# Absolute path -> (mtime, size, image) of the images loaded most recently by this process, oldest first
+loadedImages = OrderedDict()
+
+# Number of images kept in loadedImages, so that runs over many files do not keep them all alive
+MAX_LOADED_IMAGES = 8
+
+# Number of memory files parsed as text, for tests and statistics
+parseCount = 0
+
+
+def sidecarPath(filename):
+    directory, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, '__pycache__', name + '.img')
+
+
+def loadImage(filename, useSidecar=True):
+    '''
+    Return the MemoryImage of a memory file or an ELF file.
+
+    @param filename: Path of the file.
+    @param useSidecar: Read and write the binary sidecar file. Failing to write it is not an error.
+    '''
+    global parseCount
+
+    path = os.path.abspath(filename)
+    status = os.stat(path)
+    mtime, size = status.st_mtime_ns, status.st_size
+
+    loaded = loadedImages.get(path)
+    if loaded is not None and loaded[:2] == (mtime, size):
+        loadedImages.move_to_end(path)
+        return loaded[2]
+
+    with open(path, 'rb') as f:
+        if f.read(len(ELF_MAGIC)) == ELF_MAGIC:
+            from elfLoader import parseElf
+            f.seek(0)
+            image = parseElf(f.read())
+            keepLoaded(path, mtime, size, image)
+            return image
+
+    image = None
+    sidecar = sidecarPath(path)
+
+    if useSidecar:
+        try:
+            with open(sidecar, 'rb') as f:
+                cached, cachedMtime, cachedSize, cachedDigest = MemoryImage.unpack(f.read())
+        except (OSError, AssertionError, struct.error):
+            cached = None
+
+        if cached is not None:
+            if (cachedMtime, cachedSize) == (mtime, size):
+                image = cached
+            else:
+                # Touched but maybe not changed, compare the contents
+                with open(path, 'rb') as f:
+                    data = f.read()
+                digest = hashlib.sha1(data).digest()
+                if digest == cachedDigest:
+                    image = cached
+                    writeSidecar(sidecar, image, mtime, size, digest)
+
+    if image is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+        image = MemoryImage.parse(data.decode())
+        parseCount += 1
+        if useSidecar:
+            writeSidecar(sidecar, image, mtime, size, hashlib.sha1(data).digest())
+
+    keepLoaded(path, mtime, size, image)
+    return image
+
+
+def keepLoaded(path, mtime, size, image):
+    '''
+    Add an image to loadedImages, dropping the least recently used ones beyond MAX_LOADED_IMAGES.
+    '''
+    loadedImages[path] = (mtime, size, image)
+    loadedImages.move_to_end(path)
+    while len(loadedImages) > MAX_LOADED_IMAGES:
+        loadedImages.popitem(last=False)
+
+
+def toImage(program):
+    '''
+    Return the MemoryImage of a program given as a MemoryImage, a path of a
+    memory file or an ELF file, the contents of such a file as bytes, a
+    dictionary mapping addresses to words, or an iterable of (address, word)
+    pairs. Use MemoryImage.parse() for the text of a memory file, and
+    MemoryImage.fromArray() for an array of words.
+    '''
+    if isinstance(program, MemoryImage):
+        return program
+    if isinstance(program, (str, os.PathLike)):
+        return loadImage(program)
+    if isinstance(program, (bytes, bytearray, memoryview)):
+        return MemoryImage.fromBytes(program)
+    if isinstance(program, Mapping):
+        return MemoryImage.fromWords(program)
+    if isinstance(program, Iterable):
+        return MemoryImage.fromPairs(program)
+    raise TypeError("A program must be a MemoryImage, a filename, bytes or (address, word) pairs, not %s" % (
+        type(program).__name__,))
+
+
+def writeSidecar(sidecar, image, mtime, size, digest):
+    try:
+        os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+        # Write to a temporary file first, so other processes never read half a sidecar
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(sidecar))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(image.pack(mtime, size, digest))
+        os.replace(temporary, sidecar)
+    except OSError:
+        pass
+
+
+class TestMemoryImage(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.folder.name, 'test.mem')
+        self.writeFile('# comment\n#0x00001000 <main>:\n0x00001000\t0x3c097fff\tlui $t1, 0x7fff\n'
+                       '0x00001004\t0x0000000d\tbreak\n\n0x00002000\t0x0000002a\n')
+        loadedImages.clear()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def writeFile(self, text):
+        with open(self.filename, 'w') as f:
+            f.write(text)
+
+    def test_parse(self):
+        image = MemoryImage.parse(open(self.filename).read())
+        self.assertEqual(image.start, 0x1000)
+        self.assertEqual([(address, list(words)) for address, words in image.ranges],
+                         [(0x1000, [0x3c097fff, 0xd]), (0x2000, [0x2a])])
+        self.assertEqual(image.words(), {0x1000: 0x3c097fff, 0x1004: 0xd, 0x2000: 0x2a})
+        self.assertEqual(image.symbols, {'main': 0x1000})
+
+        self.assertIsNone(MemoryImage.parse('# nothing\n').start)
+        self.assertRaises(ValueError, MemoryImage.parse, '0x00001000 0x00000000\n')
+
+    def test_sources(self):
+        expected = {0x1000: 0x3c097fff, 0x1004: 0xd, 0x2000: 0x2a}
+        text = open(self.filename).read()
+        pairs = sorted(expected.items())
+
+        for name, program in [('path', self.filename), ('bytes', text.encode()), ('dictionary', expected),
+                              ('pairs', pairs), ('generator', (pair for pair in pairs)),
+                              ('image', MemoryImage.parse(text))]:
+            with self.subTest(name=name):
+                self.assertEqual(toImage(program).words(), expected)
+
+        self.assertEqual(MemoryImage.fromArray([1, -1, 3], 0x400).words(), {0x400: 1, 0x404: 0xffffffff, 0x408: 3})
+        self.assertEqual(MemoryImage.fromArray(array(WORD, [5]), 0x400).words(), {0x400: 5})
+        self.assertIsNone(MemoryImage.fromArray([], 0x400).start)
+        self.assertRaises(ValueError, MemoryImage.fromArray, [1], 0x402)
+        self.assertRaises(ValueError, MemoryImage.fromPairs, [(0x1002, 1)])
+        self.assertRaises(TypeError, toImage, 42)
+
+    def test_numpy_array(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest('NumPy is not installed')
+        image = MemoryImage.fromArray(numpy.array([1, -1, 3], dtype=numpy.int32), 0x400)
+        self.assertEqual(image.words(), {0x400: 1, 0x404: 0xffffffff, 0x408: 3})
+
+    def test_pack(self):
+        folder = os.path.dirname(os.path.abspath(__file__))
+        for name in ['add.mem', 'fibonacci.mem', 'selectionsort.mem']:
+            with self.subTest(name=name):
+                image = MemoryImage.parse(open(os.path.join(folder, name)).read())
+                unpacked, mtime, size, digest = MemoryImage.unpack(image.pack(1, 2, b'x' * 20))
+                self.assertEqual((mtime, size, digest), (1, 2, b'x' * 20))
+                self.assertEqual(unpacked.start, image.start)
+                self.assertEqual(unpacked.words(), image.words())
+                self.assertEqual(unpacked.symbols, image.symbols)
+
+    def test_sidecar(self):
+        before = parseCount
+        image = loadImage(self.filename)
+        self.assertEqual(parseCount, before + 1)
+        self.assertTrue(os.path.exists(sidecarPath(self.filename)))
+
+        # Loaded again from the sidecar, not from this process' cache
+        loadedImages.clear()
+        self.assertEqual(loadImage(self.filename).words(), image.words())
+        self.assertEqual(parseCount, before + 1)
+
+        # Same contents, new modification time
+        status = os.stat(self.filename)
+        os.utime(self.filename, ns=(status.st_atime_ns, status.st_mtime_ns + 10 ** 9))
+        loadedImages.clear()
+        loadImage(self.filename)
+        self.assertEqual(parseCount, before + 1)
+
+        # New contents
+        self.writeFile('0x00003000\t0x00000001\n')
+        os.utime(self.filename, ns=(status.st_atime_ns, status.st_mtime_ns + 2 * 10 ** 9))
+        self.assertEqual(loadImage(self.filename).words(), {0x3000: 1})
+        self.assertEqual(parseCount, before + 2)
+
+    def test_loaded_images_are_bounded(self):
+        filenames = [os.path.join(self.folder.name, 'test%d.mem' % (i,)) for i in range(MAX_LOADED_IMAGES + 2)]
+        for filename in filenames:
+            with open(filename, 'w') as f:
+                f.write('0x00001000\t0x0000000d\n')
+        images = [loadImage(filename) for filename in filenames]
+        self.assertEqual(len(loadedImages), MAX_LOADED_IMAGES)
+        self.assertNotIn(os.path.abspath(filenames[0]), loadedImages)
+
+        # A hit makes an image the most recently used
+        self.assertIs(loadImage(filenames[2]), images[2])
+        loadImage(filenames[0])
+        self.assertIn(os.path.abspath(filenames[2]), loadedImages)
+        self.assertNotIn(os.path.abspath(filenames[3]), loadedImages)
+
+    def test_broken_sidecar(self):
+        os.makedirs(os.path.dirname(sidecarPath(self.filename)))
+        with open(sidecarPath(self.filename), 'wb') as f:
+            f.write(MAGIC + b'broken')
+        self.assertEqual(loadImage(self.filename).start, 0x1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
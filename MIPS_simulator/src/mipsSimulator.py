@@ -2,6 +2,8 @@
 Code written for inf-2200, University of Tromso
 '''
 
+import os
+import unittest
 from add import Add
 from constant import Constant
 from instructionMemory import InstructionMemory
@@ -23,8 +25,13 @@ from aluControl import ALUControl
 from alu import ALU
 
 from dataMemory import DataMemory
+from memoryImage import MemoryImage, toImage
 
-from common import Break
+from netlist import Netlist
+from stepFunction import StepFunction
+from checkpoint import Checkpoint
+from common import Break, runCycles
+import tracing
 
 
 class MIPSSimulator():
@@ -35,13 +42,27 @@ class MIPSSimulator():
 
     '''
 
-    def __init__(self, memoryFile):
+    def __init__(self, memoryFile, eventDriven=False, generated=False):
+        '''
+        @param memoryFile: Memory file holding the program and its data, or a program
+        in any other form accepted by memoryImage.toImage().
+        @param eventDriven: Only evaluate elements whose inputs changed since the
+        previous cycle, instead of sweeping over every element each cycle.
+        @param generated: Simulate each cycle with one generated Python function,
+        with the simple combinational elements inlined.
+        '''
+        assert not (eventDriven and generated), 'The generated step function evaluates every element'
+
         self.nCycles = 0  # Used to hold number of clock cycles spent executing instructions
+
+        # Convert the program once, both memories share the image
+        image = toImage(memoryFile)
+        self.eventDriven = eventDriven
         #IF stage
         
         self.constant4 = Constant(4)
         self.adder = Add()
-        self.instructionMemory = InstructionMemory(memoryFile)
+        self.instructionMemory = InstructionMemory(image)
         self.pc = PC(self.startAddress())
         
         #ID stage
@@ -70,22 +91,27 @@ class MIPSSimulator():
         #MEM stage
         self.mux4 = Mux()
         self.mux5 = Mux()
-        self.dataMemory = DataMemory(memoryFile)
+        self.dataMemory = DataMemory(image)
 
 
         #WriteBack stage
         self.mux6 = Mux()
-        # legge til registerFila en gan til i writeback stage
+
+        # Every element is listed once, the evaluation order is derived from the connections
         self.elements = [self.pc, self.instructionMemory, self.constant4, self.adder, self.control,
                          self.registerFile, self.signExtender, self.shifter1, self.jumpmerge,
                          self.shifter16, self.alucontrol, self.mux3, self.shifter2, self.adderAlu,
                          self.mux2, self.alu,  
                          self.notgate, self.andequal, self.andnotequal, self.orgate, self.mux4,
-                         self.mux5, self.dataMemory, self.mux6, self.bufferGate, self.mux1, self.registerFile
+                         self.mux5, self.dataMemory, self.mux6, self.bufferGate, self.mux1
                         ]
                         
         self.connectCPUElements()
 
+        # Schedule the elements and compile the (source, name) wiring into integer-indexed wires
+        self.netlist = Netlist(self.elements)
+        self.stepFunction = StepFunction(self.netlist) if generated else None
+
     def connectCPUElements(self):
         #IF stage
         self.pc.connect(
@@ -281,8 +307,7 @@ class MIPSSimulator():
         '''
         Returns first instruction from instruction memory
         '''
-        first_instruction = next(iter(sorted(self.instructionMemory.memory.keys())))
-        return first_instruction
+        return self.instructionMemory.image.start
 
     def clockCycles(self):
         '''Returns the number of clock cycles spent executing instructions.'''
@@ -298,6 +323,10 @@ class MIPSSimulator():
         register file after instructions have finished executing.'''
         return self.registerFile.register
 
+    def skippedEvaluations(self):
+        '''Returns the number of element evaluations skipped in event-driven mode.'''
+        return self.netlist.skipped
+
     def printDataMemory(self):
         self.dataMemory.printAll()
 
@@ -308,19 +337,144 @@ class MIPSSimulator():
         '''Execute one clock cycle of pipeline.'''
 
         self.nCycles += 1
-        self.pc.writeOutput()
 
         if self.instructionMemory.BREAK == True:
             raise Break("bye bitces")
 
+        self.simulateCycle()
 
-        for elem in self.elements:
-            if elem == self.pc and self.nCycles == 1:
-                pass
+    def simulateCycle(self):
+        '''Evaluate every element once, then update PC, register file and data memory.'''
+        if self.stepFunction is not None:
+            self.stepFunction()
+        else:
+            if self.eventDriven:
+                self.netlist.evaluateChanged()
             else:
-                elem.readControlSignals()
-                elem.readInput()
-                elem.writeOutput()
-                elem.setControlSignals()
-        print(f"MipsSimulator: cycle number: {self.nCycles}")
+                self.netlist.evaluate()
+            self.netlist.clock()
+        if tracing.cycle:
+            tracing.emit('cycle', f"cycle number: {self.nCycles}")
+
+    def run(self, max_cycles=None, max_wall_seconds=None):
+        '''
+        Run clock cycles until the program stops or a limit is reached.
 
+        @param max_cycles: Stop when nCycles reaches this value.
+        @param max_wall_seconds: Stop after about this many seconds.
+        @return: RunResult with the stop reason, the cycle count and the elapsed time.
+        '''
+        return runCycles(self, self.simulateCycle, max_cycles, max_wall_seconds)
+
+
+    def checkpoint(self):
+        '''
+        Return a Checkpoint of the simulator state between two cycles: the cycle
+        count, PC, registers, memories and the outputs of every element.
+        '''
+        return Checkpoint(self.nCycles, self.pc.address, self.instructionMemory.BREAK,
+                          self.registerFile.snapshot(), tuple(self.netlist.wires),
+                          self.instructionMemory.memory.snapshot(self.instructionMemory.image),
+                          self.dataMemory.memory.snapshot(self.dataMemory.image))
+
+    def restore(self, checkpoint):
+        '''
+        Set the simulator state from a Checkpoint of a simulator running the same program.
+
+        The elements and the netlist are kept, only their state is replaced.
+        '''
+        netlist = self.netlist
+        assert len(checkpoint.wires) == len(netlist.wires), 'Checkpoint of a different datapath'
+
+        self.nCycles = checkpoint.nCycles
+        self.pc.address = checkpoint.pc
+        self.instructionMemory.BREAK = checkpoint.breakFlag
+        self.registerFile.restore(checkpoint.registers)
+        self.instructionMemory.memory.restore(checkpoint.instructionPages, self.instructionMemory.image)
+        self.instructionMemory.invalidate()
+        self.dataMemory.memory.restore(checkpoint.dataPages, self.dataMemory.image)
+
+        # The generated step function holds on to the wire list, so it is updated in place
+        netlist.wires[:] = checkpoint.wires
+        for (elem, name), slot in netlist.valueSlots.items():
+            elem.outputValues[name] = netlist.wires[slot]
+        for (elem, name), slot in netlist.signalSlots.items():
+            elem.outputControlSignals[name] = netlist.wires[slot]
+        netlist.dirty[:] = [True] * len(netlist.dirty)
+
+
+class TestMIPSSimulator(unittest.TestCase):
+    def runProgram(self, filename, **kwargs):
+        simulator = MIPSSimulator(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename), **kwargs)
+        with self.assertRaises(Break):
+            while simulator.nCycles < 10000:
+                simulator.tick()
+        return simulator
+
+    def test_event_driven(self):
+        full = self.runProgram('fibonacci.mem')
+        eventDriven = self.runProgram('fibonacci.mem', eventDriven=True)
+
+        self.assertEqual(eventDriven.nCycles, full.nCycles)
+        self.assertEqual(eventDriven.registerFile.register, full.registerFile.register)
+        self.assertEqual(eventDriven.dataMemory.memory, full.dataMemory.memory)
+
+        self.assertEqual(full.skippedEvaluations(), 0)
+        self.assertGreater(eventDriven.skippedEvaluations(), 0)
+
+    def test_run(self):
+        ticked = self.runProgram('add.mem')
+        simulator = MIPSSimulator(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'add.mem'))
+
+        result = simulator.run(max_cycles=3)
+        self.assertEqual((result.reason, result.cycles), ('cycle limit', 3))
+
+        result = simulator.run()
+        self.assertEqual((result.reason, result.cycles), ('break', ticked.nCycles))
+        self.assertEqual(simulator.registerFile.register, ticked.registerFile.register)
+        self.assertEqual(simulator.dataMemory.memory, ticked.dataMemory.memory)
+
+        # An unaligned word address stops the run, where the old dictionary memory read 0
+        simulator = MIPSSimulator({0x1000: 0x8c0a0003,      # lw $t2, 3($zero)
+                                   0x1004: 0x0000000d})     # break
+        result = simulator.run()
+        self.assertEqual((result.reason, result.cycles, result.message), ('error', 1, 'Invalid word address: 0x3'))
+
+    def test_elements_use_slots(self):
+        simulator = MIPSSimulator(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'add.mem'))
+        for elem in simulator.elements:
+            self.assertFalse(hasattr(elem, '__dict__'), type(elem).__name__)
+
+    def test_memories_share_program_image(self):
+        simulator = self.runProgram('selectionsort.mem')
+        second = MIPSSimulator(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'selectionsort.mem'))
+        image = simulator.instructionMemory.image
+
+        self.assertIs(second.instructionMemory.image, image)
+        self.assertIs(simulator.dataMemory.image, image)
+        self.assertEqual(simulator.instructionMemory.memory.writable, {})
+        # Only the pages written by sw were copied
+        self.assertLess(len(simulator.dataMemory.memory.writable), len(image.pages()))
+        self.assertEqual(second.dataMemory.memory, image.words())
+
+    def test_program_without_file(self):
+        text = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'add.mem')).read()
+        reference = self.runProgram('add.mem')
+
+        words = MemoryImage.parse(text).words()
+        simulator = MIPSSimulator((address, words[address]) for address in words)
+        self.assertEqual(simulator.run().cycles, reference.nCycles)
+        self.assertEqual(simulator.registerFile.register, reference.registerFile.register)
+
+    def test_generated(self):
+        full = self.runProgram('selectionsort.mem')
+        generated = self.runProgram('selectionsort.mem', generated=True)
+
+        self.assertEqual(generated.nCycles, full.nCycles)
+        self.assertEqual(generated.registerFile.register, full.registerFile.register)
+        self.assertEqual(generated.dataMemory.memory, full.dataMemory.memory)
+        self.assertEqual(generated.netlist.wires, full.netlist.wires)
+
+
+if __name__ == '__main__':
+    unittest.main()
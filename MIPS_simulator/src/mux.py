@@ -7,6 +7,8 @@ from cpuElement import CPUElement
 from testElement import TestElement
 
 class Mux(CPUElement):
+    __slots__ = ('inputZero', 'inputOne', 'outputName', 'controlName')
+
     def connect(self, inputSources, outputValueNames, control, outputSignalNames):
         '''
         Connect mux to input sources and controller
@@ -41,6 +43,17 @@ class Mux(CPUElement):
             output = self.outputValues[self.outputName]
             # print(f"\nmux: signal 1 output:{hex(output)}, {self.outputValues}")
     
+    def generateOutput(self, inputs, controls):
+        return {self.outputName: '(%s if %s else %s)' % (
+            inputs[self.inputOne], controls[self.controlName], inputs[self.inputZero])}
+
+    def generateChecks(self, inputs, controls):
+        muxControl = controls[self.controlName]
+        return ['assert isinstance(%s, int)' % (muxControl,),
+                'assert not isinstance(%s, bool)' % (muxControl,),
+                "assert %s == 0 or %s == 1, 'Invalid mux control signal value: %%d' %% (%s,)" % (
+                    muxControl, muxControl, muxControl)]
+
     def printOutput(self):
         '''
         Debug function that prints the output value
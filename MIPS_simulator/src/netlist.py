@@ -0,0 +1,620 @@
+'''
+Implements a compiled, integer-indexed netlist for connected CPU elements.
+
+Code written for inf-2200, University of Tromso
+'''
+
+import unittest
+from time import perf_counter_ns
+from cpuElement import CPUElement
+from testElement import TestElement
+from mux import Mux
+from add import Add
+from constant import Constant
+from pc import PC
+
+# Phases timed by evaluateProfiled() and clockProfiled(), see elementProfiler.py
+PROFILE_PHASES = ('readControlSignals', 'readInput', 'writeOutput', 'setControlSignals', 'driveWires', 'clockEdge')
+(READ_CONTROL_SIGNALS, READ_INPUT, WRITE_OUTPUT, SET_CONTROL_SIGNALS, DRIVE_WIRES,
+ CLOCK_EDGE) = range(len(PROFILE_PHASES))
+
+
+def levelize(elements):
+    '''
+    Derive a levelized evaluation schedule from the connections between elements.
+
+    An element depends on the sources of its inputs and control signals, except
+    for the ports it only samples on the clock edge (see CPUElement.latchedInputs).
+    Level 0 holds the elements without such dependencies, and every other element
+    is placed one level after the last of its sources. Within a level, elements
+    keep the order they have in the given list.
+
+    @param elements: List of connected CPU elements, each listed once.
+    @return: List of levels, each a list of elements.
+    '''
+    assert len(set(elements)) == len(elements), 'Each CPU element should only be scheduled once'
+    position = {elem: i for i, elem in enumerate(elements)}
+
+    # Element -> set of elements it depends on within a cycle
+    dependencies = {}
+    for elem in elements:
+        latched = elem.latchedInputs()
+        dependencies[elem] = set()
+        for src, name in list(elem.inputSources) + list(elem.controlSources):
+            assert src in position, \
+                "Input '%s' of CPU element %s is not driven by a scheduled element" % (name, repr(elem))
+            if name not in latched:
+                dependencies[elem].add(src)
+
+    levels = []
+    level = {}
+    remaining = list(elements)
+    while remaining:
+        ready = [elem for elem in remaining if all(src in level for src in dependencies[elem])]
+        assert ready, 'Combinational loop between CPU elements: %s' % (', '.join(repr(elem) for elem in remaining),)
+
+        for elem in ready:
+            level[elem] = max([level[src] + 1 for src in dependencies[elem]], default=0)
+            while len(levels) <= level[elem]:
+                levels.append([])
+            levels[level[elem]].append(elem)
+        remaining = [elem for elem in remaining if elem not in level]
+
+    for elems in levels:
+        elems.sort(key=position.get)
+    return levels
+
+
+class Netlist:
+    '''
+    Flat wire representation of the connections made with CPUElement.connect().
+
+    Every output value and output control signal of the compiled elements gets
+    an integer slot in self.wires. For each step in the evaluation order the
+    (name, slot) pairs of the element's ports are precomputed, so evaluating an
+    element moves values by index instead of going through getOutputValue()
+    and getControlSignal().
+
+    A cycle has two phases. In the combinational phase every element is
+    evaluated once, in the order given by levelize(). In the clock phase the
+    elements with state read their latched ports and update on the clock edge.
+    '''
+
+    def __init__(self, elements):
+        '''
+        Schedule and compile the netlist.
+
+        @param elements: List of connected CPU elements, in any order. Every input
+        and control source must itself be in the list.
+        '''
+        self.levels = levelize(elements)
+        self.schedule = [elem for level in self.levels for elem in level]
+
+        # Flat array holding the current value of every output and output control signal
+        self.wires = []
+
+        # (element, name) -> slot maps for output values and output control signals
+        self.valueSlots = {}
+        self.signalSlots = {}
+
+        for elem in self.schedule:
+            assert isinstance(elem, CPUElement)
+            assert hasattr(elem, 'outputValues'), 'CPU Element %s must be connected before compiling' % (repr(elem),)
+
+            for name, value in elem.outputValues.items():
+                self.valueSlots[(elem, name)] = len(self.wires)
+                self.wires.append(value)
+
+            for name, value in elem.outputControlSignals.items():
+                self.signalSlots[(elem, name)] = len(self.wires)
+                self.wires.append(value)
+
+        # (element, input ports, control ports, output ports, output control ports) for each step
+        self.steps = [self.compileElement(elem) for elem in self.schedule]
+
+        # (element, latched input ports, latched control ports) for each element with state
+        self.clockSteps = [self.compileClockEdge(elem) for elem in self.schedule
+                           if type(elem).clockEdge is not CPUElement.clockEdge]
+
+        # Index in self.steps of the element of each clock step
+        self.clockStepIndices = tuple(self.schedule.index(step[0]) for step in self.clockSteps)
+
+        # Slot -> indices of the steps that read it in the combinational phase
+        self.consumers = [[] for _ in self.wires]
+        for i, (elem, inputs, controls, outputs, signals) in enumerate(self.steps):
+            for name, slot in inputs + controls:
+                self.consumers[slot].append(i)
+        self.consumers = [tuple(steps) for steps in self.consumers]
+
+        # Indices of the steps whose outputs can change without any of their inputs changing
+        clocked = set(step[0] for step in self.clockSteps)
+        self.stateSteps = tuple(i for i, step in enumerate(self.steps) if step[0] in clocked)
+
+        # Event-driven evaluation: per-step dirty flags and statistics
+        self.dirty = [True] * len(self.steps)
+        self.evaluations = 0
+        self.skipped = 0
+
+    def resolve(self, elem, sources, slots, latched):
+        '''
+        Map (source, name) connections to (name, slot) pairs.
+
+        @param latched: True to resolve only the latched ports, False to resolve the others.
+        '''
+        names = elem.latchedInputs()
+        ports = []
+        for src, name in sources:
+            assert (src, name) in slots, \
+                "Port '%s' of CPU element %s is not driven by a compiled element" % (name, repr(elem))
+            if (name in names) == latched:
+                ports.append((name, slots[(src, name)]))
+        return tuple(ports)
+
+    def compileElement(self, elem):
+        '''
+        Resolve the ports of one element to (name, slot) pairs.
+        '''
+        # Elements that read their ports in a special way cannot be compiled
+        assert type(elem).readInput is CPUElement.readInput, \
+            'CPU element %s overrides readInput and cannot be compiled' % (repr(elem),)
+        assert type(elem).readControlSignals is CPUElement.readControlSignals, \
+            'CPU element %s overrides readControlSignals and cannot be compiled' % (repr(elem),)
+
+        inputs = self.resolve(elem, elem.inputSources, self.valueSlots, False)
+        controls = self.resolve(elem, elem.controlSources, self.signalSlots, False)
+        outputs = tuple((name, self.valueSlots[(elem, name)]) for name in elem.outputValues)
+        signals = tuple((name, self.signalSlots[(elem, name)]) for name in elem.outputControlSignals)
+
+        return (elem, inputs, controls, outputs, signals)
+
+    def compileClockEdge(self, elem):
+        '''
+        Resolve the latched ports of one element to (name, slot) pairs.
+        '''
+        inputs = self.resolve(elem, elem.inputSources, self.valueSlots, True)
+        controls = self.resolve(elem, elem.controlSources, self.signalSlots, True)
+        return (elem, inputs, controls)
+
+    def publish(self, elem):
+        '''
+        Copy the current outputs of an element to its wires.
+
+        Only needed when an element is evaluated outside of evaluate().
+        '''
+        slots = [self.valueSlots[(elem, name)] for name in elem.outputValues]
+        slots += [self.signalSlots[(elem, name)] for name in elem.outputControlSignals]
+        values = list(elem.outputValues.values()) + list(elem.outputControlSignals.values())
+
+        for slot, value in zip(slots, values):
+            if value != self.wires[slot]:
+                self.wires[slot] = value
+                for j in self.consumers[slot]:
+                    self.dirty[j] = True
+
+    def evaluate(self, steps=None):
+        '''
+        Combinational phase: for each step read control signals and inputs, write
+        outputs, set control signals and drive the results onto the wires.
+
+        @param steps: Optional subset of self.steps to evaluate.
+        '''
+        wires = self.wires
+        for elem, inputs, controls, outputs, signals in (self.steps if steps is None else steps):
+            controlSignals = elem.controlSignals
+            for name, slot in controls:
+                controlSignals[name] = wires[slot]
+
+            inputValues = elem.inputValues
+            for name, slot in inputs:
+                inputValues[name] = wires[slot]
+
+            elem.writeOutput()
+            elem.setControlSignals()
+
+            outputValues = elem.outputValues
+            for name, slot in outputs:
+                wires[slot] = outputValues[name]
+
+            outputControlSignals = elem.outputControlSignals
+            for name, slot in signals:
+                wires[slot] = outputControlSignals[name]
+
+    def evaluateChanged(self):
+        '''
+        Event-driven combinational phase.
+
+        Like evaluate(), but a step is skipped when none of its input or control
+        wires changed since it was last evaluated. Elements with state are always
+        evaluated, and every other element must be a pure function of its ports.
+        The number of evaluated and skipped steps is counted in self.evaluations
+        and self.skipped.
+        '''
+        wires = self.wires
+        dirty = self.dirty
+        consumers = self.consumers
+        for i in self.stateSteps:
+            dirty[i] = True
+
+        i = -1
+        for elem, inputs, controls, outputs, signals in self.steps:
+            i += 1
+            if not dirty[i]:
+                self.skipped += 1
+                continue
+            dirty[i] = False
+            self.evaluations += 1
+
+            controlSignals = elem.controlSignals
+            for name, slot in controls:
+                controlSignals[name] = wires[slot]
+
+            inputValues = elem.inputValues
+            for name, slot in inputs:
+                inputValues[name] = wires[slot]
+
+            elem.writeOutput()
+            elem.setControlSignals()
+
+            # Wake up the readers of every wire that changed value
+            outputValues = elem.outputValues
+            for name, slot in outputs:
+                value = outputValues[name]
+                if value != wires[slot]:
+                    wires[slot] = value
+                    for j in consumers[slot]:
+                        dirty[j] = True
+
+            outputControlSignals = elem.outputControlSignals
+            for name, slot in signals:
+                value = outputControlSignals[name]
+                if value != wires[slot]:
+                    wires[slot] = value
+                    for j in consumers[slot]:
+                        dirty[j] = True
+
+    def clock(self):
+        '''
+        Clock phase: elements with state read their latched ports and update.
+        '''
+        wires = self.wires
+        for elem, inputs, controls in self.clockSteps:
+            controlSignals = elem.controlSignals
+            for name, slot in controls:
+                controlSignals[name] = wires[slot]
+
+            inputValues = elem.inputValues
+            for name, slot in inputs:
+                inputValues[name] = wires[slot]
+
+            elem.clockEdge()
+
+    def evaluateProfiled(self, times, calls):
+        '''
+        Like evaluate(), while timing each phase of each step. Kept apart from
+        it, so that it is not slowed down.
+
+        @param times: Nanoseconds, indexed by step index * len(PROFILE_PHASES) + phase.
+        @param calls: Calls, indexed like times.
+        '''
+        clock = perf_counter_ns
+        wires = self.wires
+
+        base = -len(PROFILE_PHASES)
+        for elem, inputs, controls, outputs, signals in self.steps:
+            base += len(PROFILE_PHASES)
+
+            t0 = clock()
+            controlSignals = elem.controlSignals
+            for name, slot in controls:
+                controlSignals[name] = wires[slot]
+            t1 = clock()
+            inputValues = elem.inputValues
+            for name, slot in inputs:
+                inputValues[name] = wires[slot]
+            t2 = clock()
+            elem.writeOutput()
+            t3 = clock()
+            elem.setControlSignals()
+            t4 = clock()
+
+            outputValues = elem.outputValues
+            for name, slot in outputs:
+                wires[slot] = outputValues[name]
+
+            outputControlSignals = elem.outputControlSignals
+            for name, slot in signals:
+                wires[slot] = outputControlSignals[name]
+            t5 = clock()
+
+            times[base + READ_CONTROL_SIGNALS] += t1 - t0
+            times[base + READ_INPUT] += t2 - t1
+            times[base + WRITE_OUTPUT] += t3 - t2
+            times[base + SET_CONTROL_SIGNALS] += t4 - t3
+            times[base + DRIVE_WIRES] += t5 - t4
+            for phase in range(CLOCK_EDGE):
+                calls[base + phase] += 1
+
+    def evaluateChangedProfiled(self, times, calls):
+        '''
+        Like evaluateChanged(), while timing each phase of each evaluated step,
+        in times and calls as for evaluateProfiled().
+        '''
+        clock = perf_counter_ns
+        wires = self.wires
+        dirty = self.dirty
+        consumers = self.consumers
+        for i in self.stateSteps:
+            dirty[i] = True
+
+        base = -len(PROFILE_PHASES)
+        for i, (elem, inputs, controls, outputs, signals) in enumerate(self.steps):
+            base += len(PROFILE_PHASES)
+            if not dirty[i]:
+                self.skipped += 1
+                continue
+            dirty[i] = False
+            self.evaluations += 1
+
+            t0 = clock()
+            controlSignals = elem.controlSignals
+            for name, slot in controls:
+                controlSignals[name] = wires[slot]
+            t1 = clock()
+            inputValues = elem.inputValues
+            for name, slot in inputs:
+                inputValues[name] = wires[slot]
+            t2 = clock()
+            elem.writeOutput()
+            t3 = clock()
+            elem.setControlSignals()
+            t4 = clock()
+
+            outputValues = elem.outputValues
+            for name, slot in outputs:
+                value = outputValues[name]
+                if value != wires[slot]:
+                    wires[slot] = value
+                    for j in consumers[slot]:
+                        dirty[j] = True
+
+            outputControlSignals = elem.outputControlSignals
+            for name, slot in signals:
+                value = outputControlSignals[name]
+                if value != wires[slot]:
+                    wires[slot] = value
+                    for j in consumers[slot]:
+                        dirty[j] = True
+            t5 = clock()
+
+            times[base + READ_CONTROL_SIGNALS] += t1 - t0
+            times[base + READ_INPUT] += t2 - t1
+            times[base + WRITE_OUTPUT] += t3 - t2
+            times[base + SET_CONTROL_SIGNALS] += t4 - t3
+            times[base + DRIVE_WIRES] += t5 - t4
+            for phase in range(CLOCK_EDGE):
+                calls[base + phase] += 1
+
+    def clockProfiled(self, times, calls):
+        '''
+        Like clock(), while timing the latched port reads and the clock edge
+        of each element, in times and calls as for evaluateProfiled().
+        '''
+        clock = perf_counter_ns
+        wires = self.wires
+        for i, (elem, inputs, controls) in zip(self.clockStepIndices, self.clockSteps):
+            base = i * len(PROFILE_PHASES)
+            t0 = clock()
+            controlSignals = elem.controlSignals
+            for name, slot in controls:
+                controlSignals[name] = wires[slot]
+            t1 = clock()
+            inputValues = elem.inputValues
+            for name, slot in inputs:
+                inputValues[name] = wires[slot]
+            t2 = clock()
+            elem.clockEdge()
+            t3 = clock()
+
+            times[base + READ_CONTROL_SIGNALS] += t1 - t0
+            times[base + READ_INPUT] += t2 - t1
+            times[base + CLOCK_EDGE] += t3 - t2
+            calls[base + CLOCK_EDGE] += 1
+
+    def cycle(self):
+        '''
+        Simulate one clock cycle.
+        '''
+        self.evaluate()
+        self.clock()
+
+
+class TestNetlist(unittest.TestCase):
+    def setUp(self):
+        self.mux = Mux()
+        self.testInput = TestElement()
+        self.testOutput = TestElement()
+
+        self.testInput.connect(
+            [],
+            ['dataA', 'dataB'],
+            [],
+            ['muxControl']
+        )
+
+        self.mux.connect(
+            [(self.testInput, 'dataA'), (self.testInput, 'dataB')],
+            ['muxData'],
+            [(self.testInput, 'muxControl')],
+            []
+        )
+
+        self.testOutput.connect(
+            [(self.mux, 'muxData')],
+            [],
+            [],
+            []
+        )
+
+        self.netlist = Netlist([self.testInput, self.mux, self.testOutput])
+
+    def test_slots(self):
+        # One slot per output value and output control signal
+        self.assertEqual(len(self.netlist.wires), 4)
+        self.assertEqual(len(set(self.netlist.valueSlots.values()) | set(self.netlist.signalSlots.values())), 4)
+
+    def test_correct_behavior(self):
+        self.testInput.setOutputValue('dataA', 10)
+        self.testInput.setOutputValue('dataB', 20)
+
+        self.testInput.setOutputControl('muxControl', 0)
+        self.netlist.evaluate()
+        self.assertEqual(self.testOutput.inputValues['muxData'], 10)
+
+        self.testInput.setOutputControl('muxControl', 1)
+        self.netlist.evaluate()
+        self.assertEqual(self.testOutput.inputValues['muxData'], 20)
+        self.assertEqual(self.mux.getOutputValue('muxData'), 20)
+
+    def test_publish(self):
+        self.testInput.setOutputValue('dataA', 30)
+        self.netlist.publish(self.testInput)
+        self.assertEqual(self.netlist.wires[self.netlist.valueSlots[(self.testInput, 'dataA')]], 30)
+
+        # Evaluate the mux alone, without the source element
+        self.netlist.evaluate(self.netlist.steps[1:])
+        self.assertEqual(self.testOutput.inputValues['muxData'], 30)
+
+    def test_levels(self):
+        # Connections are levelized regardless of the order the elements are given in
+        netlist = Netlist([self.testOutput, self.mux, self.testInput])
+        self.assertEqual(netlist.levels, [[self.testInput], [self.mux], [self.testOutput]])
+
+    def test_unconnected_source(self):
+        other = TestElement()
+        other.connect([], ['data'], [], [])
+        self.mux.connect(
+            [(other, 'data'), (self.testInput, 'dataB')],
+            ['muxData'],
+            [(self.testInput, 'muxControl')],
+            []
+        )
+        self.assertRaises(AssertionError, Netlist, [self.testInput, self.mux])
+
+
+class TestClocking(unittest.TestCase):
+    def setUp(self):
+        # A PC that counts up by 4 every cycle
+        self.pc = PC(0x100)
+        self.constant4 = Constant(4)
+        self.adder = Add()
+
+        self.pc.connect([(self.adder, 'sum')], ['address'], [], [])
+        self.constant4.connect([], ['constant'], [], [])
+        self.adder.connect([(self.pc, 'address'), (self.constant4, 'constant')], ['sum'], [], [])
+
+    def test_feedback_through_pc(self):
+        netlist = Netlist([self.adder, self.constant4, self.pc])
+        self.assertEqual(netlist.levels, [[self.constant4, self.pc], [self.adder]])
+        self.assertEqual([step[0] for step in netlist.clockSteps], [self.pc])
+
+        for i in range(3):
+            netlist.cycle()
+            self.assertEqual(self.pc.getOutputValue('address'), 0x100 + 4 * i)
+            self.assertEqual(self.pc.currentAddress(), 0x100 + 4 * (i + 1))
+
+    def test_combinational_loop(self):
+        mux = Mux()
+        control = TestElement()
+        control.connect([], [], [], ['select'])
+        mux.connect([(mux, 'out'), (self.constant4, 'constant')], ['out'], [(control, 'select')], [])
+        self.assertRaises(AssertionError, levelize, [self.constant4, control, mux])
+
+
+class TestEventDriven(unittest.TestCase):
+    def setUp(self):
+        self.pc = PC(0x100)
+        self.constant4 = Constant(4)
+        self.adder = Add()
+        self.mux = Mux()
+        self.control = TestElement()
+
+        self.pc.connect([(self.mux, 'next')], ['address'], [], [])
+        self.constant4.connect([], ['constant'], [], [])
+        self.adder.connect([(self.pc, 'address'), (self.constant4, 'constant')], ['sum'], [], [])
+        self.control.connect([], [], [], ['hold'])
+        self.mux.connect([(self.adder, 'sum'), (self.pc, 'address')], ['next'], [(self.control, 'hold')], [])
+
+        self.netlist = Netlist([self.pc, self.constant4, self.adder, self.control, self.mux])
+
+    def run_cycles(self, n):
+        for _ in range(n):
+            self.netlist.evaluateChanged()
+            self.netlist.clock()
+
+    def test_skips_unchanged_elements(self):
+        self.run_cycles(3)
+        self.assertEqual(self.pc.currentAddress(), 0x10c)
+
+        # Constant and control only run on the first cycle
+        self.assertEqual(self.netlist.evaluations, 5 + 3 + 3)
+        self.assertEqual(self.netlist.skipped, 2 + 2)
+
+    def test_profiled(self):
+        times = [0] * (len(self.netlist.steps) * len(PROFILE_PHASES))
+        calls = [0] * len(times)
+        for _ in range(3):
+            self.netlist.evaluateChangedProfiled(times, calls)
+            self.netlist.clockProfiled(times, calls)
+        self.assertEqual(self.pc.currentAddress(), 0x10c)
+        self.assertEqual(self.netlist.evaluations, 5 + 3 + 3)
+        self.assertEqual(sum(calls[WRITE_OUTPUT::len(PROFILE_PHASES)]), self.netlist.evaluations)
+        self.assertEqual(calls[CLOCK_EDGE], 3)
+
+    def test_same_result_as_full_sweep(self):
+        self.run_cycles(2)
+        self.control.setOutputControl('hold', 1)
+        self.netlist.publish(self.control)
+
+        # The changed signal reaches the mux even though its other inputs are unchanged
+        self.run_cycles(2)
+        self.assertEqual(self.pc.currentAddress(), 0x108)
+
+
+class TestProfiledSweeps(unittest.TestCase):
+    '''
+    The profiled sweeps repeat the loops of the plain ones, so they are checked
+    to leave the datapath in the same state.
+    '''
+    def run_cycles(self, eventDriven, profiled, n=300):
+        import os
+        from mipsSimulator import MIPSSimulator
+
+        simulator = MIPSSimulator(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'selectionsort.mem'),
+                                  eventDriven=eventDriven)
+        netlist = simulator.netlist
+        times = [0] * (len(netlist.steps) * len(PROFILE_PHASES))
+        calls = [0] * len(times)
+        for _ in range(n):
+            if profiled:
+                if eventDriven:
+                    netlist.evaluateChangedProfiled(times, calls)
+                else:
+                    netlist.evaluateProfiled(times, calls)
+                netlist.clockProfiled(times, calls)
+            else:
+                if eventDriven:
+                    netlist.evaluateChanged()
+                else:
+                    netlist.evaluate()
+                netlist.clock()
+        return (list(netlist.wires), simulator.pc.currentAddress(), list(simulator.registerFile.register),
+                dict(simulator.dataMemory.memory), netlist.evaluations, netlist.skipped)
+
+    def test_same_state_as_plain_sweeps(self):
+        for eventDriven in [False, True]:
+            with self.subTest(eventDriven=eventDriven):
+                self.assertEqual(self.run_cycles(eventDriven, True), self.run_cycles(eventDriven, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,11 @@
 from cpuElement import CPUElement
 from testElement import TestElement
+import tracing
 import unittest
 
 class Not(CPUElement):
+    __slots__ = ('aluzero', 'controlOutput')
+
     def connect(self, inputSources, outputValueNames, control, outputSignalNames):
         CPUElement.connect(self, inputSources, outputValueNames, control, outputSignalNames)
 
@@ -30,7 +33,14 @@ class Not(CPUElement):
             self.outputControlSignals[self.controlOutput] = 1
         else:
             pass
-        print(f"\nnot: the outputsignal is: {self.outputControlSignals}")
+        if tracing.control >= 2:
+            tracing.emit('control', f"not: the outputsignal is: {self.outputControlSignals}")
+
+    def generateOutput(self, inputs, controls):
+        if tracing.control >= 2:
+            return None  # Keep the traced setControlSignals
+        # The ALU zero flag is always 0 or 1
+        return {self.controlOutput: '(0 if %s == 1 else 1)' % (controls[self.aluzero],)}
             
 
 class TestNot(unittest.TestCase):
@@ -3,6 +3,8 @@ from testElement import TestElement
 import unittest
 
 class ORgate(CPUElement):
+    __slots__ = ('BEQ', 'BNE', 'controlOutput')
+
     def connect(self, inputSources, outputValueNames, control, outputSignalNames):
         CPUElement.connect(self, inputSources, outputValueNames, control, outputSignalNames)
 
@@ -33,6 +35,9 @@ class ORgate(CPUElement):
 
         # Updating the value in the map with output control signals
         self.outputControlSignals[self.controlOutput] = output
+
+    def generateOutput(self, inputs, controls):
+        return {self.controlOutput: '(%s | %s)' % (controls[self.BEQ], controls[self.BNE])}
             
 
 class TestOR(unittest.TestCase):
@@ -5,6 +5,8 @@ Code written for inf-2200, University of Tromso
 from cpuElement import CPUElement
 
 class PC(CPUElement):
+    __slots__ = ('baseaddr', 'inputField_newPcAddress', 'outputField_pcAddress', 'address')
+
     def __init__(self, baseaddr):
         self.baseaddr = baseaddr
     
@@ -20,9 +22,17 @@ class PC(CPUElement):
         self.outputField_pcAddress = outputValueNames[0]
         
         self.inputValues[self.inputField_newPcAddress] = self.baseaddr # initialize PC
+        self.address = self.baseaddr
     
     def writeOutput (self):
-        self.outputValues[self.outputField_pcAddress] = self.inputValues[self.inputField_newPcAddress]
+        self.outputValues[self.outputField_pcAddress] = self.address
+
+    def clockEdge(self):
+        # Latch the next address at the end of the cycle
+        self.address = self.inputValues[self.inputField_newPcAddress]
+
+    def latchedInputs(self):
+        return [self.inputField_newPcAddress]
 
     def currentAddress (self):
-        return self.inputValues[self.inputField_newPcAddress]
+        return self.address
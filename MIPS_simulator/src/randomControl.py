@@ -9,6 +9,9 @@ class RandomControl(CPUElement):
     '''
     Random control unit. It randomly sets it's output signal
     '''
+
+    __slots__ = ('signalName',)
+
     def connect(self, inputSources, outputValueNames, control, outputSignalNames):
         CPUElement.connect(self, inputSources, outputValueNames, control, outputSignalNames)
         
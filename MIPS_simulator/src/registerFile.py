@@ -3,34 +3,65 @@ Code written for inf-2200, University of Tromso
 '''
 
 import unittest
+from array import array
+from collections.abc import MutableMapping
 from cpuElement import CPUElement
 import common
+from common import WORD
 from testElement import TestElement
 
 
+class RegisterView(MutableMapping):
+    '''
+    Dictionary-like view of the register array, mapping register number to value.
+
+    Writes are masked to 32 bits, and writes to $zero are ignored.
+    '''
+
+    __slots__ = ('registers',)
+
+    def __init__(self, registers):
+        self.registers = registers
+
+    def __getitem__(self, number):
+        if isinstance(number, int) and 0 <= number < 32:
+            return self.registers[number]
+        raise KeyError(number)
+
+    def __setitem__(self, number, value):
+        if not (isinstance(number, int) and 0 <= number < 32):
+            raise KeyError(number)
+        if number != 0:
+            self.registers[number] = value & 0xffffffff
+
+    def __delitem__(self, number):
+        raise TypeError('Registers cannot be removed')
+
+    def __iter__(self):
+        return iter(range(32))
+
+    def __len__(self):
+        return 32
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 class RegisterFile(CPUElement):
+    __slots__ = (
+        'registers', 'register', 'registerNames', 'read_reg1', 'read_reg2', 'write_reg', 'write_data',
+        'control_signal', 'read_data1', 'read_data2')
+
     def __init__(self):
-        # Dictionary mapping register number to register value
-        self.register = {}
+        # Register values, indexed by register number. All registers default to 0
+        self.registers = array(WORD, bytes(4 * 32))
+        # Dictionary-like view mapping register number to register value
+        self.register = RegisterView(self.registers)
         # Note that we won't actually use all the registers listed here...
         self.registerNames = ['$zero', '$at', '$v0', '$v1', '$a0', '$a1', '$a2', '$a3',
                               '$t0', '$t1', '$t2', '$t3', '$t4', '$t5', '$t6', '$t7',
                               '$s0', '$s1', '$s2', '$s3', '$s4', '$s5', '$s6', '$s7',
                               '$t8', '$t9', '$k0', '$k1', '$gp', '$sp', '$fp', '$ra']
-        # All registers default to 0
-        for i in range(0, 32):
-            self.register[i] = 0
-
-    def readInput(self):
-        '''
-        Read and set input values for this element.
-        This function is called once for each simulation step.
-        '''
-        for i in self.inputSources:
-            src, name = i
-            value = src.getOutputValue(name)
-            self.inputValues[name] = value
-        # After reading input, decompose the instruction
 
     def connect(self, inputSources, outputValueNames, control, outputSignalNames):
         CPUElement.connect(self, inputSources, outputValueNames, control, outputSignalNames)
@@ -53,15 +84,44 @@ class RegisterFile(CPUElement):
     def writeOutput(self):
         read_reg1 = self.inputValues[self.read_reg1]
         read_reg2 = self.inputValues[self.read_reg2]
+
+        self.outputValues[self.read_data1] = self.registers[read_reg1]
+        self.outputValues[self.read_data2] = self.registers[read_reg2]
+
+    def clockEdge(self):
+        # The write port is clocked, the result is visible to reads in the next cycle
         write_reg = self.inputValues[self.write_reg]
         write_data = self.inputValues[self.write_data]
         reg_write = self.controlSignals[self.control_signal]
 
-        if reg_write:
-            self.register[write_reg] = write_data
+        # $zero is hard-wired to 0
+        if reg_write and write_reg != 0:
+            self.registers[write_reg] = write_data & 0xffffffff
 
-        self.outputValues[self.read_data1] = self.register[read_reg1]
-        self.outputValues[self.read_data2] = self.register[read_reg2]
+    def latchedInputs(self):
+        return [self.write_reg, self.write_data, self.control_signal]
+
+    def snapshot(self):
+        '''
+        Return the value of every register as an immutable bytes object.
+        '''
+        return self.registers.tobytes()
+
+    def restore(self, snapshot):
+        '''
+        Set every register from a snapshot.
+        '''
+        assert len(snapshot) == 4 * 32, 'Register snapshot must hold 32 words'
+        self.registers[:] = array(WORD, snapshot)
+
+    def compare(self, snapshot):
+        '''
+        Return the numbers of the registers that differ from a snapshot.
+        '''
+        if self.registers.tobytes() == snapshot:
+            return []
+        other = array(WORD, snapshot)
+        return [i for i in range(32) if self.registers[i] != other[i]]
 
     def printAll(self):
         '''
@@ -115,6 +175,7 @@ class TestRegisterFile(unittest.TestCase):
         self.rf.readInput()
         self.rf.readControlSignals()
         self.rf.writeOutput()
+        self.rf.clockEdge()
 
         self.assertEqual(self.rf.register[3], 25)
         self.rf.printAll()
@@ -125,6 +186,7 @@ class TestRegisterFile(unittest.TestCase):
         self.rf.readInput()
         self.rf.readControlSignals()
         self.rf.writeOutput()
+        self.rf.clockEdge()
 
         self.assertEqual(self.rf.register[3], 30)
         self.rf.printAll()
@@ -141,6 +203,10 @@ class TestRegisterFile(unittest.TestCase):
         self.rf.readInput()
         self.rf.readControlSignals()
         self.rf.writeOutput()
+        self.rf.clockEdge()
+
+        # The written value is read in the next cycle
+        self.rf.writeOutput()
         self.testOutput.readInput()
 
         self.assertEqual(self.rf.register[1], 10)
@@ -152,6 +218,62 @@ class TestRegisterFile(unittest.TestCase):
         self.assertEqual(output2, 0)
         self.rf.printAll()
 
+    def test_write_is_clocked(self):
+        self.testInput.setOutputValue('Read register 1', 5)
+        self.testInput.setOutputValue('Write register', 5)
+        self.testInput.setOutputValue('Write Data', 50)
+        self.testInput.setOutputControl('RegWrite', 1)
+
+        self.rf.readInput()
+        self.rf.readControlSignals()
+        self.rf.writeOutput()
+        self.testOutput.readInput()
+
+        # Nothing is written before the clock edge
+        self.assertEqual(self.rf.register[5], 0)
+        self.assertEqual(self.testOutput.inputValues['Read data 1'], 0)
+
+        self.rf.clockEdge()
+        self.assertEqual(self.rf.register[5], 50)
+
+    def test_zero_is_hard_wired(self):
+        self.testInput.setOutputValue('Write register', 0)
+        self.testInput.setOutputValue('Write Data', 45)
+        self.testInput.setOutputControl('RegWrite', 1)
+
+        self.rf.readInput()
+        self.rf.readControlSignals()
+        self.rf.writeOutput()
+        self.rf.clockEdge()
+        self.assertEqual(self.rf.register[0], 0)
+
+        self.rf.register[0] = 7
+        self.assertEqual(self.rf.register[0], 0)
+
+    def test_register_view(self):
+        self.rf.register[8] = -1
+        self.assertEqual(self.rf.register[8], 0xffffffff)
+        self.assertEqual(self.rf.registers[8], 0xffffffff)
+        self.assertEqual(len(self.rf.register), 32)
+        self.assertEqual(dict(self.rf.register)[8], 0xffffffff)
+        self.assertEqual(self.rf.register, {i: 0xffffffff if i == 8 else 0 for i in range(32)})
+        self.assertNotIn(32, self.rf.register)
+        self.assertNotIn(-1, self.rf.register)
+        self.assertRaises(KeyError, self.rf.register.__setitem__, 32, 1)
+
+    def test_snapshot(self):
+        self.rf.register[9] = 90
+        snapshot = self.rf.snapshot()
+
+        self.rf.register[9] = 91
+        self.rf.register[31] = 0x80000000
+        self.assertEqual(self.rf.compare(snapshot), [9, 31])
+
+        self.rf.restore(snapshot)
+        self.assertEqual(self.rf.compare(snapshot), [])
+        self.assertEqual(self.rf.register[9], 90)
+        self.assertEqual(self.rf.register[31], 0)
+
     def test_read_after_write(self):
         self.testInput.setOutputValue('Write register', 4)
         self.testInput.setOutputValue('Write Data', 45)
@@ -160,6 +282,7 @@ class TestRegisterFile(unittest.TestCase):
         self.rf.readInput()
         self.rf.readControlSignals()
         self.rf.writeOutput()
+        self.rf.clockEdge()
 
         self.testInput.setOutputValue('Read register 1', 4)
         self.rf.readInput()
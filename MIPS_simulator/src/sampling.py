@@ -0,0 +1,231 @@
+'''
+Implements sampled simulation: the functional simulator runs most of the
+program, and the datapath simulates short windows of it in detail.
+
+Code written for inf-2200, University of Tromso
+'''
+
+import math
+import os
+import time
+import unittest
+from functionalSimulator import FunctionalSimulator
+from mipsSimulator import MIPSSimulator
+
+# Two-sided 95% quantiles of Student's t distribution by degrees of freedom,
+# the normal quantile is used above 30
+T_95 = (None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+Z_95 = 1.960
+
+# Counters read from the datapath before and after each window
+DEFAULT_COUNTERS = {
+    'cycles': lambda simulator: simulator.nCycles,
+    'evaluations': lambda simulator: simulator.netlist.evaluations,
+}
+
+
+def handOver(source, target):
+    '''
+    Copy the architectural state (PC, registers, data memory, break flag and
+    cycle count) from one simulator to another. Either can be a MIPSSimulator
+    or a FunctionalSimulator, running the same program.
+    '''
+    pc = source.pc.address if isinstance(source, MIPSSimulator) else source.pc
+    if isinstance(target, MIPSSimulator):
+        target.pc.address = pc
+        # The datapath recomputes every wire from the new state
+        target.netlist.dirty[:] = [True] * len(target.netlist.dirty)
+    else:
+        target.pc = pc
+
+    target.nCycles = source.nCycles
+    target.instructionMemory.BREAK = source.instructionMemory.BREAK
+    target.registerFile.restore(source.registerFile.snapshot())
+    image = source.dataMemory.image
+    target.dataMemory.memory.restore(source.dataMemory.memory.snapshot(image), image)
+
+
+class Estimate:
+    '''
+    Estimate of a counter per instruction, and of its total over the program,
+    with a 95% confidence interval (None with fewer than two windows).
+    '''
+
+    def __init__(self, samples, instructions):
+        n = len(samples)
+        self.samples = samples
+        self.perInstruction = sum(samples) / n if n else 0.0
+        if n >= 2:
+            deviation = math.sqrt(sum((x - self.perInstruction) ** 2 for x in samples) / (n - 1))
+            margin = (T_95[n - 1] if n - 1 < len(T_95) else Z_95) * deviation / math.sqrt(n)
+            self.low, self.high = self.perInstruction - margin, self.perInstruction + margin
+        else:
+            self.low = self.high = None
+
+        self.total = self.perInstruction * instructions
+        self.totalLow = None if self.low is None else self.low * instructions
+        self.totalHigh = None if self.high is None else self.high * instructions
+
+    def __repr__(self):
+        if self.low is None:
+            return 'Estimate(total=%.1f)' % (self.total,)
+        return 'Estimate(total=%.1f, 95%% interval=[%.1f, %.1f])' % (self.total, self.totalLow, self.totalHigh)
+
+
+class SamplingResult:
+    '''
+    Outcome of SampledSimulation.run().
+
+    reason is the stop reason of the program, as in RunResult, and instructions
+    the number of instructions it executed, counted like FunctionalSimulator.nCycles
+    (including the cycle that finds the break flag). estimates maps each counter
+    name to an Estimate.
+    '''
+
+    def __init__(self, reason, instructions, windows, detailedInstructions, estimates, elapsed):
+        self.reason = reason
+        self.instructions = instructions
+        self.windows = windows
+        self.detailedInstructions = detailedInstructions
+        self.estimates = estimates
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return 'SamplingResult(reason=%r, instructions=%d, windows=%d, estimates=%r)' % (
+            self.reason, self.instructions, self.windows, self.estimates)
+
+
+class SampledSimulation:
+    '''
+    Alternates between fast-forwarding fastForward instructions with a
+    FunctionalSimulator and simulating a window of window cycles with an
+    event-driven MIPSSimulator, handing the architectural state over each time.
+
+    In each window, the increase of every counter is divided by the number of
+    instructions executed, and these samples give the estimate of the counter
+    per instruction and for the whole program.
+
+    The two simulators must agree on the program's behaviour; the datapath
+    does not trap on overflow, so programs that overflow stop in the first
+    fast-forward that reaches the overflow.
+    '''
+
+    def __init__(self, memoryFile, fastForward=10000, window=1000, translated=True, counters=None):
+        '''
+        @param memoryFile: Memory file holding the program and its data.
+        @param fastForward: Instructions between windows.
+        @param window: Cycles in each detailed window.
+        @param translated: Fast-forward with the block translator.
+        @param counters: Dictionary mapping names to functions returning a counter
+        of a MIPSSimulator, DEFAULT_COUNTERS if not given.
+        '''
+        assert fastForward >= 0 and window > 0, 'Window must be at least one cycle'
+        self.fastForward = fastForward
+        self.window = window
+        self.counters = dict(DEFAULT_COUNTERS if counters is None else counters)
+
+        self.functional = FunctionalSimulator(memoryFile, translated=translated)
+        self.detailed = MIPSSimulator(memoryFile, eventDriven=True)
+
+    def run(self, max_instructions=None):
+        '''
+        Run the program until it stops, or until about max_instructions instructions.
+
+        @return: SamplingResult
+        '''
+        start = time.perf_counter()
+        functional = self.functional
+        detailed = self.detailed
+        samples = {name: [] for name in self.counters}
+        windows = 0
+        detailedInstructions = 0
+
+        while True:
+            limit = functional.nCycles + self.fastForward
+            if max_instructions is not None:
+                limit = min(limit, max_instructions)
+            result = functional.run(max_cycles=limit)
+            if result.reason != 'cycle limit' or (max_instructions is not None and
+                                                  functional.nCycles >= max_instructions):
+                break
+
+            handOver(functional, detailed)
+            before = {name: counter(detailed) for name, counter in self.counters.items()}
+            result = detailed.run(max_cycles=detailed.nCycles + self.window)
+
+            instructions = detailed.nCycles - functional.nCycles
+            if instructions > 0:
+                windows += 1
+                detailedInstructions += instructions
+                for name, counter in self.counters.items():
+                    samples[name].append((counter(detailed) - before[name]) / instructions)
+
+            handOver(detailed, functional)
+            if result.reason != 'cycle limit':
+                break
+
+        instructions = functional.nCycles
+        estimates = {name: Estimate(values, instructions) for name, values in samples.items()}
+        return SamplingResult(result.reason, instructions, windows, detailedInstructions, estimates,
+                              time.perf_counter() - start)
+
+
+class TestSampledSimulation(unittest.TestCase):
+    def setUp(self):
+        self.filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'selectionsort.mem')
+
+    def test_hand_over(self):
+        # Fast-forward, then finish the program on the datapath
+        functional = FunctionalSimulator(self.filename)
+        functional.run(max_cycles=400)
+        detailed = MIPSSimulator(self.filename)
+        handOver(functional, detailed)
+        self.assertEqual(detailed.pc.currentAddress(), functional.pc)
+        detailed.run()
+
+        reference = MIPSSimulator(self.filename)
+        reference.run()
+        self.assertEqual(detailed.nCycles, reference.nCycles)
+        self.assertEqual(detailed.registerFile.register, reference.registerFile.register)
+        self.assertEqual(detailed.dataMemory.memory, reference.dataMemory.memory)
+
+        # And back
+        handOver(detailed, functional)
+        self.assertTrue(functional.instructionMemory.BREAK)
+        self.assertEqual(functional.nCycles, reference.nCycles)
+        self.assertEqual(functional.pc, reference.pc.currentAddress())
+        self.assertEqual(functional.dataMemory.memory, reference.dataMemory.memory)
+
+    def test_estimates(self):
+        reference = MIPSSimulator(self.filename, eventDriven=True)
+        reference.run()
+        instructions = reference.nCycles
+
+        for translated in [False, True]:
+            with self.subTest(translated=translated):
+                sampling = SampledSimulation(self.filename, fastForward=60, window=40, translated=translated)
+                result = sampling.run()
+                self.assertEqual(result.reason, 'break')
+                self.assertEqual(result.instructions, instructions)
+                self.assertGreaterEqual(result.windows, 5)
+                self.assertLess(result.detailedInstructions, instructions)
+
+                # Every instruction takes one cycle on the single-cycle datapath
+                cycles = result.estimates['cycles']
+                self.assertEqual((cycles.perInstruction, cycles.low, cycles.high), (1, 1, 1))
+
+                evaluations = result.estimates['evaluations']
+                self.assertLess(evaluations.totalLow, evaluations.totalHigh)
+                self.assertAlmostEqual(evaluations.total / reference.netlist.evaluations, 1, delta=0.2)
+
+    def test_instruction_limit(self):
+        result = SampledSimulation(self.filename, fastForward=100, window=50).run(max_instructions=300)
+        self.assertEqual(result.reason, 'cycle limit')
+        self.assertGreaterEqual(result.instructions, 300)
+        self.assertEqual(result.windows, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,8 @@ from testElement import TestElement
 
 
 class ShiftLeft2(CPUElement):
+    __slots__ = ('inputField_sliceInstruction', 'outputField_shiftedInstruction')
+
     def connect(self, inputSources, outputValueNames, control, outputSignalNames):
         CPUElement.connect(self, inputSources, outputValueNames, control, outputSignalNames)
         assert len(inputSources) == 1, 'ShiftLeft2 should have only one input.'
@@ -20,6 +22,9 @@ class ShiftLeft2(CPUElement):
         shifted_instruction = (slice_instruction << shift) & 0xFFFFFFFF  # Perform a left shift by 2 on the binary value
         self.outputValues[self.outputField_shiftedInstruction] = shifted_instruction  # Set the output value
 
+    def generateOutput(self, inputs, controls):
+        return {self.outputField_shiftedInstruction: '((%s << 2) & 0xFFFFFFFF)' % (inputs[self.inputField_sliceInstruction],)}
+
 
 class TestShiftLeft2(unittest.TestCase):
     def setUp(self):
@@ -4,12 +4,9 @@ from testElement import TestElement
 
 
 class Sign_Extend(CPUElement):
+    __slots__ = ('inputZero', 'outputName')
+
     def connect(self, inputSources, outputValueNames, control, outputSignalNames):
-        # Print the input arguments to see their values
-        print(f"inputSources: {inputSources}")
-        print(f"outputValueNames: {outputValueNames}")
-        print(f"control: {control}")
-        print(f"outputSignalNames: {outputSignalNames}")
         CPUElement.connect(self, inputSources, outputValueNames, control, outputSignalNames)
 
         assert (len(inputSources) == 1), 'sign_extend should have one inputs'
@@ -31,6 +28,10 @@ class Sign_Extend(CPUElement):
             extended_value = sign_value
         self.outputValues[self.outputName] = extended_value
 
+    def generateOutput(self, inputs, controls):
+        value = inputs[self.inputZero]
+        return {self.outputName: '(%s | 0xFFFF0000 if %s & 0x8000 else %s)' % (value, value, value)}
+
 
 class TestSign_Extend(unittest.TestCase):
     def setUp(self):
@@ -2,25 +2,20 @@
 Code written for inf-2200, University of Tromso
 '''
 
+import os
 import sys
 from mipsSimulator import MIPSSimulator
-from common import Break
-
-def runSimulatorIF(sim):
-    while (1):
-        sim.tick()
-        sim.registerFile.printAll()
-        sim.dataMemory.printAll()
-        if sim.instructionMemory.BREAK == True:
-            sim.registerFile.printAll()
-            sim.dataMemory.printAll()
-            raise Break("bye bitces")
+import tracing
 
 
 if __name__ == '__main__':
     assert (len(sys.argv) == 2), 'Usage: python %s memoryFile' % (sys.argv[0],)
     memoryFile = sys.argv[1]
+    # For example MIPS_TRACE=fetch,alu=2 python simulator.py add.mem
+    tracing.configure(os.environ.get('MIPS_TRACE', ''))
     simulator = MIPSSimulator(memoryFile)
-    runSimulatorIF(simulator)
-    print()
+    result = simulator.run()
+    simulator.registerFile.printAll()
+    simulator.dataMemory.printAll()
+    print(result)
 
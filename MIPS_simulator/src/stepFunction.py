@@ -0,0 +1,191 @@
+'''
+Generates one straight-line Python function that simulates a cycle of a netlist.
+
+Code written for inf-2200, University of Tromso
+'''
+
+import unittest
+from cpuElement import CPUElement
+from netlist import Netlist
+from testElement import TestElement
+from mux import Mux
+from add import Add
+from constant import Constant
+from pc import PC
+from sign_extend import Sign_Extend
+
+
+class StepFunction:
+    '''
+    Specialized step function for a compiled netlist.
+
+    The generated code follows the netlist schedule and keeps every wire in a
+    local variable. Elements that implement generateOutput() are inlined as
+    arithmetic on those variables. The other elements are called through their
+    port dictionaries, as in Netlist.evaluate(), and the clock phase is emitted
+    at the end. The wires are stored back to netlist.wires after each cycle.
+
+    Inlined elements check their ports with the statements of
+    generateChecks(), so a wiring error stops the generated code where it
+    stops writeOutput(). Inlined elements do not update their own outputValues
+    and outputControlSignals; call sync() before inspecting them.
+    '''
+
+    def __init__(self, netlist):
+        self.netlist = netlist
+
+        # Elements whose logic is inlined in the generated code
+        self.inlined = []
+
+        # Objects the generated code refers to, bound as closure variables
+        self.names = []
+        self.objects = []
+
+        body = []
+        for i, (elem, inputs, controls, outputs, signals) in enumerate(netlist.steps):
+            body.append('# %s' % (type(elem).__name__,))
+
+            inputNames = {name: 'w%d' % (slot,) for name, slot in inputs}
+            controlNames = {name: 'w%d' % (slot,) for name, slot in controls}
+            expressions = elem.generateOutput(inputNames, controlNames)
+
+            if expressions is not None:
+                self.inlined.append(elem)
+                body.extend(elem.generateChecks(inputNames, controlNames))
+                for name, slot in outputs + signals:
+                    body.append('w%d = %s' % (slot, expressions[name]))
+                continue
+
+            if controls:
+                c = self.bind('e%d_controls' % (i,), elem.controlSignals)
+                body.extend('%s[%r] = w%d' % (c, name, slot) for name, slot in controls)
+            if inputs:
+                v = self.bind('e%d_inputs' % (i,), elem.inputValues)
+                body.extend('%s[%r] = w%d' % (v, name, slot) for name, slot in inputs)
+
+            body.append('%s()' % (self.bind('e%d_write' % (i,), elem.writeOutput),))
+            if type(elem).setControlSignals is not CPUElement.setControlSignals:
+                body.append('%s()' % (self.bind('e%d_set' % (i,), elem.setControlSignals),))
+
+            if outputs:
+                o = self.bind('e%d_outputs' % (i,), elem.outputValues)
+                body.extend('w%d = %s[%r]' % (slot, o, name) for name, slot in outputs)
+            if signals:
+                s = self.bind('e%d_signals' % (i,), elem.outputControlSignals)
+                body.extend('w%d = %s[%r]' % (slot, s, name) for name, slot in signals)
+
+        body.append('# Clock edge')
+        for i, (elem, inputs, controls) in enumerate(netlist.clockSteps):
+            if controls:
+                c = self.bind('c%d_controls' % (i,), elem.controlSignals)
+                body.extend('%s[%r] = w%d' % (c, name, slot) for name, slot in controls)
+            if inputs:
+                v = self.bind('c%d_inputs' % (i,), elem.inputValues)
+                body.extend('%s[%r] = w%d' % (v, name, slot) for name, slot in inputs)
+            body.append('%s()' % (self.bind('c%d_clock' % (i,), elem.clockEdge),))
+
+        wires = self.bind('wires', netlist.wires)
+        body.append('%s[:] = (%s,)' % (wires, ', '.join('w%d' % (slot,) for slot in range(len(netlist.wires)))))
+
+        self.source = 'def makeStep(%s):\n    def step():\n%s\n    return step\n' % (
+            ', '.join(self.names), '\n'.join('        ' + line for line in body))
+
+        namespace = {}
+        exec(compile(self.source, '<step function>', 'exec'), namespace)
+        self.step = namespace['makeStep'](*self.objects)
+
+    def bind(self, name, obj):
+        '''
+        Make an object available to the generated code under the given name.
+        '''
+        self.names.append(name)
+        self.objects.append(obj)
+        return name
+
+    def __call__(self):
+        '''
+        Simulate one clock cycle.
+        '''
+        self.step()
+
+    def sync(self):
+        '''
+        Copy the wires to the output dictionaries of the inlined elements.
+        '''
+        wires = self.netlist.wires
+        for elem in self.inlined:
+            for name in elem.outputValues:
+                elem.outputValues[name] = wires[self.netlist.valueSlots[(elem, name)]]
+            for name in elem.outputControlSignals:
+                elem.outputControlSignals[name] = wires[self.netlist.signalSlots[(elem, name)]]
+
+
+class TestStepFunction(unittest.TestCase):
+    def build(self):
+        '''
+        A PC that counts up by 4, or jumps to a sign extended offset.
+        '''
+        pc = PC(0x100)
+        constant4 = Constant(4)
+        adder = Add()
+        signExtend = Sign_Extend()
+        mux = Mux()
+        testInput = TestElement()
+
+        testInput.connect([], ['offset'], [], ['jump'])
+        pc.connect([(mux, 'next')], ['address'], [], [])
+        constant4.connect([], ['constant'], [], [])
+        adder.connect([(pc, 'address'), (constant4, 'constant')], ['sum'], [], [])
+        signExtend.connect([(testInput, 'offset')], ['extended'], [], [])
+        mux.connect([(adder, 'sum'), (signExtend, 'extended')], ['next'], [(testInput, 'jump')], [])
+
+        return Netlist([pc, constant4, adder, signExtend, mux, testInput]), pc, signExtend, testInput
+
+    def test_inlined(self):
+        step = StepFunction(self.build()[0])
+        self.assertEqual([type(elem) for elem in step.inlined], [Constant, Add, Sign_Extend, Mux])
+        self.assertIn('def step():', step.source)
+
+    def test_same_result_as_netlist(self):
+        netlist, pc, _, testInput = self.build()
+        generated, generatedPc, _, generatedInput = self.build()
+        step = StepFunction(generated)
+
+        for jump, offset in [(0, 0), (0, 0), (1, 0xfff0), (0, 0), (1, 0x0200), (0, 0)]:
+            for elem in (testInput, generatedInput):
+                elem.setOutputValue('offset', offset)
+                elem.setOutputControl('jump', jump)
+
+            netlist.cycle()
+            step()
+
+            self.assertEqual(generated.wires, netlist.wires)
+            self.assertEqual(generatedPc.currentAddress(), pc.currentAddress())
+
+    def test_checks(self):
+        # The generated code rejects the mux control values that writeOutput() rejects
+        for jump in [2, True]:
+            with self.subTest(jump=jump):
+                netlist, _, _, testInput = self.build()
+                generated, _, _, generatedInput = self.build()
+                step = StepFunction(generated)
+                for elem in (testInput, generatedInput):
+                    elem.setOutputControl('jump', jump)
+                self.assertRaises(AssertionError, netlist.cycle)
+                self.assertRaises(AssertionError, step)
+
+    def test_sync(self):
+        netlist, pc, signExtend, testInput = self.build()
+        step = StepFunction(netlist)
+        testInput.setOutputValue('offset', 0x8000)
+        testInput.setOutputControl('jump', 1)
+        step()
+
+        self.assertEqual(signExtend.outputValues['extended'], 0)
+        step.sync()
+        self.assertEqual(signExtend.outputValues['extended'], 0xffff8000)
+        self.assertEqual(pc.currentAddress(), 0xffff8000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,7 @@ the functions in common.py work as intended, and demonstrate how
 unit tests can be written using the unittest python module.
 '''
 
+import io
 import operator
 import unittest
 from common import *
@@ -53,5 +54,75 @@ class TestCommon(unittest.TestCase):
             self.assertEqual(a, r)
             self.assertEqual(a, c) # Unsigned-to-unsigned does not alter value
 
+
+def runMain(main, argv):
+    '''
+    Run the main() of a command-line tool, such as batch.py, with its output in memory.
+
+    @return: (value returned by main(), output text)
+    '''
+    output = io.StringIO()
+    return main(argv, output), output.getvalue()
+
+
+class CountingSimulator:
+    '''
+    Sets BREAK, or raises Overflow or ValueError, after a given number of cycles.
+    '''
+    def __init__(self, breakAfter=None, overflowAfter=None, errorAfter=None):
+        self.nCycles = 0
+        self.instructionMemory = self
+        self.BREAK = False
+        self.breakAfter = breakAfter
+        self.overflowAfter = overflowAfter
+        self.errorAfter = errorAfter
+
+    def cycle(self):
+        if self.nCycles == self.overflowAfter:
+            raise Overflow("overflow in cycle %d" % (self.nCycles,))
+        if self.nCycles == self.errorAfter:
+            raise ValueError("error in cycle %d" % (self.nCycles,))
+        if self.nCycles == self.breakAfter:
+            self.BREAK = True
+
+
+class TestRunCycles(unittest.TestCase):
+    def test_break(self):
+        simulator = CountingSimulator(breakAfter=5000)
+        result = runCycles(simulator, simulator.cycle)
+        self.assertEqual(result.reason, 'break')
+        self.assertEqual(result.cycles, 5001)
+        self.assertGreaterEqual(result.elapsed, 0)
+
+    def test_cycle_limit(self):
+        simulator = CountingSimulator(breakAfter=100)
+        result = runCycles(simulator, simulator.cycle, max_cycles=100)
+        self.assertEqual(result.reason, 'cycle limit')
+        self.assertEqual(result.cycles, 100)
+
+        # Continuing finds the break, as tick() would
+        result = runCycles(simulator, simulator.cycle, max_cycles=200)
+        self.assertEqual(result.reason, 'break')
+        self.assertEqual(result.cycles, 101)
+
+    def test_overflow(self):
+        simulator = CountingSimulator(overflowAfter=10)
+        result = runCycles(simulator, simulator.cycle)
+        self.assertEqual(result.reason, 'overflow')
+        self.assertEqual(result.cycles, 10)
+        self.assertEqual(result.message, 'overflow in cycle 10')
+
+    def test_error(self):
+        simulator = CountingSimulator(errorAfter=7)
+        result = runCycles(simulator, simulator.cycle)
+        self.assertEqual((result.reason, result.cycles, result.message), ('error', 7, 'error in cycle 7'))
+
+    def test_timeout(self):
+        simulator = CountingSimulator()
+        result = runCycles(simulator, simulator.cycle, max_wall_seconds=0)
+        self.assertEqual(result.reason, 'timeout')
+        self.assertEqual(result.cycles, TIME_CHECK_INTERVAL)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -8,6 +8,8 @@ Code written for inf-2200, University of Tromso
 from cpuElement import CPUElement
 
 class TestElement(CPUElement):
+    __slots__ = ('inputNames', 'controlNames')
+
     def __init__(self):
         pass
     
@@ -0,0 +1,206 @@
+'''
+Implements leveled tracing for the simulator, used instead of print().
+
+Each subsystem (fetch, alu, control, memory, cycle) has a trace level, which is
+0 (disabled) by default. Code that traces checks the level first, so a disabled
+trace costs one attribute lookup and no string formatting:
+
+    if tracing.alu:
+        tracing.emit('alu', f"result: {hex(result)}")
+
+Messages meant for level 2 and above are guarded with "if tracing.alu >= 2:".
+Enabled messages go to a sink, which buffers them. The default sink writes to
+standard output.
+
+Code written for inf-2200, University of Tromso
+'''
+
+import atexit
+import sys
+import unittest
+
+SUBSYSTEMS = ('fetch', 'alu', 'control', 'memory', 'cycle')
+
+# Trace level of each subsystem, 0 means disabled
+fetch = 0
+alu = 0
+control = 0
+memory = 0
+cycle = 0
+
+
+class MemorySink:
+    '''
+    Keeps traced messages as (subsystem, message) tuples in self.records.
+    '''
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, subsystem, message):
+        self.records.append((subsystem, message))
+
+    def lines(self, subsystem=None):
+        '''
+        Return the messages of one subsystem, or of all subsystems.
+        '''
+        return [message for s, message in self.records if subsystem is None or s == subsystem]
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileSink:
+    '''
+    Writes traced messages as "subsystem: message" lines to a file.
+
+    Lines are buffered and written bufferSize lines at a time, and on flush().
+    @param file: Path of the file, or an open text file (not closed by this sink).
+    '''
+
+    def __init__(self, file, bufferSize=4096):
+        if isinstance(file, str):
+            self.file = open(file, 'w')
+            self.ownsFile = True
+        else:
+            self.file = file
+            self.ownsFile = False
+        self.bufferSize = bufferSize
+        self.buffer = []
+
+    def write(self, subsystem, message):
+        self.buffer.append('%s: %s\n' % (subsystem, message))
+        if len(self.buffer) >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        self.file.write(''.join(self.buffer))
+        self.buffer.clear()
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.ownsFile:
+            self.file.close()
+
+
+sink = None
+
+
+def emit(subsystem, message):
+    '''
+    Send a message to the current sink. Callers check the trace level first.
+    '''
+    global sink
+    if sink is None:
+        sink = FileSink(sys.stdout)
+    sink.write(subsystem, message)
+
+
+def enable(subsystem, level=1):
+    '''
+    Set the trace level of a subsystem, or of all subsystems if subsystem is 'all'.
+    '''
+    names = SUBSYSTEMS if subsystem == 'all' else (subsystem,)
+    for name in names:
+        assert name in SUBSYSTEMS, 'Unknown trace subsystem: \'%s\'' % (name,)
+        assert isinstance(level, int) and level >= 0, 'Trace level must be a non-negative integer'
+        globals()[name] = level
+
+
+def disable(subsystem='all'):
+    enable(subsystem, 0)
+
+
+def configure(spec):
+    '''
+    Set trace levels from a string such as "fetch,alu=2" (level 1 if not given).
+    '''
+    for item in spec.split(','):
+        item = item.strip()
+        if item:
+            name, _, level = item.partition('=')
+            enable(name.strip(), int(level) if level else 1)
+
+
+def setSink(newSink):
+    '''
+    Send messages to newSink, closing the previous sink. Returns newSink.
+    '''
+    global sink
+    if sink is not None:
+        sink.close()
+    sink = newSink
+    return sink
+
+
+def flush():
+    if sink is not None:
+        sink.flush()
+
+
+atexit.register(flush)
+
+
+class TestTracing(unittest.TestCase):
+    # Use the module the CPU elements import, also when this file is run as a script
+    import tracing
+
+    def setUp(self):
+        self.sink = self.tracing.setSink(self.tracing.MemorySink())
+
+    def tearDown(self):
+        self.tracing.disable()
+        self.tracing.setSink(None)
+
+    def test_levels(self):
+        tracing = self.tracing
+        tracing.enable('alu')
+        tracing.configure('fetch, memory=2')
+        self.assertEqual([tracing.fetch, tracing.alu, tracing.control, tracing.memory, tracing.cycle],
+                         [1, 1, 0, 2, 0])
+
+        tracing.disable('memory')
+        self.assertEqual(tracing.memory, 0)
+        self.assertRaises(AssertionError, tracing.enable, 'registers')
+
+    def test_memory_sink(self):
+        self.tracing.emit('alu', 'first')
+        self.tracing.emit('fetch', 'second')
+        self.assertEqual(self.sink.lines(), ['first', 'second'])
+        self.assertEqual(self.sink.lines('fetch'), ['second'])
+
+    def test_file_sink_is_buffered(self):
+        import io
+        output = io.StringIO()
+        tracing = self.tracing
+        tracing.setSink(tracing.FileSink(output, bufferSize=2))
+
+        tracing.emit('cycle', 'cycle number: 1')
+        self.assertEqual(output.getvalue(), '')
+        tracing.emit('cycle', 'cycle number: 2')
+        self.assertEqual(output.getvalue(), 'cycle: cycle number: 1\ncycle: cycle number: 2\n')
+        tracing.emit('memory', 'read 0x10')
+        tracing.flush()
+        self.assertTrue(output.getvalue().endswith('memory: read 0x10\n'))
+
+    def test_simulator_is_quiet_by_default(self):
+        import os
+        from mipsSimulator import MIPSSimulator
+
+        filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'add.mem')
+        MIPSSimulator(filename).run()
+        self.assertEqual(self.sink.records, [])
+
+        self.tracing.configure('cycle,fetch')
+        result = MIPSSimulator(filename).run()
+        self.assertEqual(len(self.sink.lines('cycle')), result.cycles - 1)
+        self.assertEqual(len(self.sink.lines('fetch')), result.cycles - 1)
+        self.assertEqual(self.sink.lines('alu'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,5 +2,5 @@
 
 # Install dependencies, run tests, and sum score
 python -m pip install -r ../requirements.txt -r ../test-requirements.txt
-pytest -rPf
+pytest -rPf -n auto
 python3 sumresult.py
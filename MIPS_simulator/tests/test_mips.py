@@ -1,11 +1,24 @@
 from genericpath import exists
+import functools
+from collections.abc import Mapping
 import pytest
 import logging
+try:
+    import fcntl
+except ImportError:  # Windows, where appending a short line is atomic enough
+    fcntl = None
 import os  # nopep8
 import sys  # nopep8
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))  # nopep8
 from common import fromUnsignedWordToSignedWord, Break, Overflow
+from memoryImage import MemoryImage
 from src.mipsSimulator import MIPSSimulator
+from src.functionalSimulator import FunctionalSimulator
+
+# Set MIPS_SIMULATOR=functional (or translated) to run the tests on the instruction-level simulator
+SIMULATORS = {"datapath": MIPSSimulator, "functional": FunctionalSimulator,
+              "translated": functools.partial(FunctionalSimulator, translated=True)}
+Simulator = SIMULATORS[os.environ.get("MIPS_SIMULATOR", "datapath")]
 
 
 log = logging.getLogger(__name__)
@@ -19,12 +32,13 @@ class SubTest():
         self.minCycles = minCycles
         self.maxCycles = maxCycles
         self.code = code
+        # The program is given to the simulator directly, no files are written
+        self.image = MemoryImage.parse(''.join(code))
 
 
 class MipsWrapper():
     def __init__(self, cwd, memfolder, file, trapTest):
         self.cd = cwd
-        self.tmpFileFolder = os.getcwd()+'/'
         self.memfolder = memfolder
         self.filename = file
         self.trapTest = trapTest
@@ -50,7 +64,6 @@ class MipsWrapper():
                         self.setupSubTest(test, dest, expVal, memfile)
                     elif not self.trapTest:
                         self.setupSubTest(test, dest, expVal, memfile)
-        self.creatTmpFiles()
         # Each subtest has a max score of 2(1 for trap, 1 for val)
         if self.trapTest:
             self.maxScore = len(self.tests.keys()) * (self.trapPoint)
@@ -73,41 +86,32 @@ class MipsWrapper():
         self.tests[test] = SubTest(
             test, dest, expVal, minCycles, len(code)*10, code)
 
-    def creatTmpFiles(self):
-        for _, subtest in self.tests.items():
-            log.debug(f"Writing tmp files for {subtest.name}")
-            with open(self.tmpFileFolder+subtest.name, "w") as f:
-                for line in subtest.code:
-                    f.writelines(line)
-
-    def rmTmpFiles(self):
-        log.debug(f"Removing all tmp files for {self.filename}")
-        for tmpFile in self.tests.keys():
-            try:
-                os.remove(self.tmpFileFolder+tmpFile)
-            except FileNotFoundError:
-                log.error(f"Failed removing {tmpFile}, not found!")
-
     def checkSimulator(self):
         assert hasattr(self.simulator, "registerFile")
         assert hasattr(self.simulator.registerFile, "register")
-        assert type(self.simulator.registerFile.register) == dict
+        assert isinstance(self.simulator.registerFile.register, Mapping)
         assert hasattr(self.simulator.registerFile, "registerNames")
         assert type(self.simulator.registerFile.registerNames) == list
         assert hasattr(self.simulator, "dataMemory")
         assert hasattr(self.simulator.dataMemory, "memory")
-        assert type(self.simulator.dataMemory.memory) == dict
+        assert isinstance(self.simulator.dataMemory.memory, Mapping)
 
     def prepare(self, test):
         log.debug(f"Wrapper setting up subtest {test.name}")
-        self.simulator = MIPSSimulator(test.name)
+        self.simulator = Simulator(test.image)
         self.CT = test
         self.checkSimulator()
 
     def _runSimulator(self):
         log.debug(f"Running simulator with {self.CT.name}")
-        while(self.simulator.nCycles <= self.CT.maxCycles):
-            self.simulator.tick()
+        result = self.simulator.run(max_cycles=self.CT.maxCycles + 1)
+        if result.reason == "break":
+            raise Break(f"Break after {result.cycles} cycles")
+        if result.reason == "overflow":
+            raise Overflow(result.message)
+        if result.reason == "error":
+            # An unknown instruction or unaligned address, raised as before run() existed
+            raise ValueError(result.message)
         log.critical(
             f"Simulation of '{self.CT.name}' exit due to exceeding cycle limit: {self.CT.maxCycles}")
 
@@ -122,7 +126,11 @@ class MipsWrapper():
     def writeResults(self):
         log.info(
             f"Subtest completed with: [{self.score}] out of [{self.maxScore}] points")
-        with open("result", "a+") as res:
+        # Tests may run in parallel worker processes (pytest -n auto), each line is
+        # written at once while holding a lock on the file
+        with open("result", "a") as res:
+            if fcntl is not None:
+                fcntl.flock(res, fcntl.LOCK_EX)
             res.write(f"{self.score}/{self.maxScore}\n")
 
     def getRegisterName(self):
@@ -180,7 +188,6 @@ class MipsWrapper():
     def tearDown(self):
         log.debug(f"Tearing down {self} for {self.filename}")
         self.writeResults()
-        self.rmTmpFiles()
 
 
 class TestMips():